@@ -0,0 +1,94 @@
+import csv
+import heapq
+import random
+from datetime import date
+from decimal import Decimal
+
+cent = Decimal('0.01')
+
+
+class LedgerGenerator:
+    """Generates a synthetic ledger of transactions, in the format read by the
+    TransactionsReader, that is the same for the same seed.
+
+    Each ticker has a price that follows a random walk and is traded in a
+    single currency, picked with the weights in currencies. The transactions
+    are spread evenly over the days from start_date to end_date. loss_density
+    is the share of the SELLs that are sold at a loss, and wash_clustering is
+    the share of those losses that are followed by a BUY of the same ticker
+    within 30 days, which makes them superficial losses.
+    """
+    # Days after a loss that the BUY of a wash sale can be on
+    wash_days = 30
+
+    def __init__(self, rows, tickers=20, currencies=None, loss_density=0.2,
+                 wash_clustering=0.5, seed=0, start_date=date(2008, 1, 2),
+                 end_date=date(2024, 12, 31)):
+        self.rows = rows
+        self.tickers = tickers
+        self.currencies = currencies or {'USD': 0.7, 'CAD': 0.3}
+        self.loss_density = loss_density
+        self.wash_clustering = wash_clustering
+        self.seed = seed
+        self.start_date = start_date
+        self.end_date = end_date
+
+    def __iter__(self):
+        """Generate the entries of the ledger in chronological order, one at
+        a time"""
+        r = random.Random(self.seed)
+        names = ["T{:04d}".format(i) for i in range(self.tickers)]
+        currencies = r.choices(list(self.currencies),
+                               weights=list(self.currencies.values()),
+                               k=self.tickers)
+        prices = [Decimal(r.randint(1000, 50000)) / 100 for _ in names]
+        balances = [0] * self.tickers
+        # Ordinal of the day, ticker and quantity of each pending wash sale
+        # BUY
+        wash_buys = []
+        days = (self.end_date - self.start_date).days + 1
+        start = self.start_date.toordinal()
+        for row in range(self.rows):
+            ordinal = start + row * days // self.rows
+            if wash_buys and wash_buys[0][0] <= ordinal:
+                _, ticker, qty = heapq.heappop(wash_buys)
+                balances[ticker] += qty
+                yield self._get_entry(ordinal, 'WASH SALE', names[ticker],
+                                      'BUY', qty, prices[ticker],
+                                      currencies[ticker], r)
+                continue
+            ticker = r.randrange(self.tickers)
+            # Moves the price up to 2% either way
+            prices[ticker] = max(cent, (prices[ticker] * Decimal(
+                r.randint(9800, 10200)) / 10000).quantize(cent))
+            if balances[ticker] and r.random() < 0.4:
+                qty = r.randint(1, balances[ticker])
+                balances[ticker] -= qty
+                price = prices[ticker]
+                if r.random() < self.loss_density:
+                    # Sold well under the price the shares were bought at
+                    price = (price * Decimal('0.5')).quantize(cent)
+                    if r.random() < self.wash_clustering:
+                        heapq.heappush(wash_buys, (
+                            ordinal + r.randint(0, self.wash_days), ticker,
+                            qty))
+                yield self._get_entry(ordinal, 'SALE', names[ticker], 'SELL',
+                                      qty, price, currencies[ticker], r)
+                continue
+            qty = r.randint(1, 200)
+            balances[ticker] += qty
+            yield self._get_entry(ordinal, 'RSU VEST', names[ticker], 'BUY',
+                                  qty, prices[ticker], currencies[ticker], r)
+
+    @staticmethod
+    def _get_entry(ordinal, description, ticker, action, qty, price,
+                   currency, r):
+        return [date.fromordinal(ordinal).isoformat(), description, ticker,
+                action, str(qty), str(price),
+                "{}.99".format(r.randint(0, 9)), currency]
+
+    def write(self, path):
+        """Write the ledger to a CSV-file"""
+        with open(path, 'w', newline='') as f:
+            csv.writer(f).writerows(self)
+        return path
@@ -0,0 +1,277 @@
+import click
+import json
+import math
+import os
+import tempfile
+import time
+from click.testing import CliRunner
+from tabulate import tabulate
+
+from capgains.cli import capgains
+from capgains.commands.capgains_calc import \
+    _get_map_of_currencies_to_exchange_rates
+from capgains.exchange_rate import ExchangeRate
+from capgains.ticker_gains import TickerGains
+from capgains.transactions_reader import TransactionsReader
+from benchmarks.ledger_generator import LedgerGenerator
+from benchmarks.valet_stub import ValetStub
+
+
+class Ledger:
+    """A generated ledger and what the benchmarks need from it, which is
+    prepared before they are timed"""
+
+    def __init__(self, path, generator):
+        self.path = path
+        self.rows = generator.rows
+        self.year = generator.end_date.year
+        self.transactions = TransactionsReader.get_transactions(path)
+        self.exchange_rates = _get_map_of_currencies_to_exchange_rates(
+            self.transactions)
+        self.dates = {currency: [t.date for t in self.transactions
+                                 if t.currency == currency]
+                      for currency in self.exchange_rates}
+        self.ticker_transactions = self.transactions.group_by_ticker()
+
+
+def bench_reader(ledger):
+    TransactionsReader.get_transactions(ledger.path)
+
+
+def bench_reader_columnar(ledger):
+    TransactionsReader.get_transactions(ledger.path, columnar=True)
+
+
+def bench_exchange_rate(ledger):
+    for currency, exchange_rate in ledger.exchange_rates.items():
+        exchange_rate.get_rates(ledger.dates[currency])
+
+
+def bench_ticker_gains(ledger):
+    for ticker, transactions in ledger.ticker_transactions.items():
+        TickerGains(ticker).add_transactions(transactions,
+                                             ledger.exchange_rates)
+
+
+def bench_filter_by(ledger):
+    transactions = ledger.transactions
+    for ticker in transactions.tickers:
+        len(transactions.filter_by(tickers=[ticker], year=ledger.year,
+                                   action='SELL'))
+    for year in range(ledger.year - 4, ledger.year + 1):
+        len(transactions.filter_by(year=year))
+        len(transactions.filter_by(max_year=year, action='BUY'))
+
+
+def _invoke(*args):
+    result = CliRunner(mix_stderr=False).invoke(capgains, args)
+    if result.exit_code:
+        raise click.ClickException("capgains {} failed: {}".format(
+            " ".join(args), result.stderr or result.exception))
+
+
+def bench_calc(ledger):
+    _invoke('--no-cache', 'calc', ledger.path, str(ledger.year))
+
+
+def bench_show(ledger):
+    _invoke('--no-cache', 'show', '-f', 'csv', ledger.path)
+
+
+# Benchmarks that can be run, in the order that they are run in
+benchmarks = {
+    'reader': bench_reader,
+    'reader_columnar': bench_reader_columnar,
+    'exchange_rate': bench_exchange_rate,
+    'ticker_gains': bench_ticker_gains,
+    'filter_by': bench_filter_by,
+    'calc': bench_calc,
+    'show': bench_show,
+}
+
+
+def time_benchmark(benchmark, ledger, repeat):
+    """Return the shortest time in seconds that the benchmark took out of
+    repeat runs"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        benchmark(ledger)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def run_benchmarks(names, sizes, repeat, generator_options, work_dir):
+    """Run the benchmarks on a generated ledger of each of the sizes. Returns
+    a list of the results, each with the benchmark, number of rows and
+    seconds."""
+    results = []
+    with ValetStub() as stub:
+        valet_obs_url = ExchangeRate.valet_obs_url
+        ExchangeRate.valet_obs_url = stub.url
+        try:
+            for rows in sizes:
+                generator = LedgerGenerator(rows, **generator_options)
+                path = generator.write(os.path.join(
+                    work_dir, "ledger-{}.csv".format(rows)))
+                ledger = Ledger(path, generator)
+                for name in names:
+                    results.append({
+                        'benchmark': name,
+                        'rows': rows,
+                        'seconds': time_benchmark(benchmarks[name], ledger,
+                                                  repeat)})
+                os.remove(path)
+        finally:
+            ExchangeRate.valet_obs_url = valet_obs_url
+    return results
+
+
+def get_scaling(results):
+    """Add the time per row of each result, and the exponent of the growth
+    in time from the previous size of the same benchmark (1 is linear, 2 is
+    quadratic)"""
+    previous = {}
+    for result in results:
+        result['us_per_row'] = result['seconds'] / result['rows'] * 10 ** 6
+        result['slope'] = None
+        prev = previous.get(result['benchmark'])
+        if (prev is not None and prev['seconds'] > 0 and
+                result['rows'] != prev['rows']):
+            result['slope'] = (
+                math.log(result['seconds'] / prev['seconds']) /
+                math.log(result['rows'] / prev['rows']))
+        previous[result['benchmark']] = result
+    return results
+
+
+def get_regressions(results, baseline, tolerance):
+    """Return the results that took more than tolerance (a fraction) longer
+    than the result of the same benchmark and size in the baseline"""
+    baseline_seconds = {(r['benchmark'], r['rows']): r['seconds']
+                        for r in baseline['results']}
+    regressions = []
+    for result in results:
+        seconds = baseline_seconds.get((result['benchmark'], result['rows']))
+        if seconds is not None and result['seconds'] > seconds * (
+                1 + tolerance):
+            regressions.append(dict(result, baseline_seconds=seconds))
+    return regressions
+
+
+def _format_results(results):
+    return tabulate(
+        [[r['benchmark'], r['rows'], "{:.4f}".format(r['seconds']),
+          "{:.2f}".format(r['us_per_row']),
+          "" if r['slope'] is None else "{:.2f}".format(r['slope'])]
+         for r in sorted(results, key=lambda r: (
+             list(benchmarks).index(r['benchmark']), r['rows']))],
+        headers=["benchmark", "rows", "seconds", "us/row", "slope"],
+        tablefmt="psql",
+        disable_numparse=True,
+        colalign=("left", "right", "right", "right", "right"))
+
+
+def _parse_list(value, convert, choices=None):
+    try:
+        items = [convert(item) for item in value.split(',') if item]
+    except ValueError:
+        raise click.BadParameter("{} is not a valid list".format(value))
+    if choices is not None:
+        for item in items:
+            if item not in choices:
+                raise click.BadParameter("{} is not one of {}".format(
+                    item, ", ".join(choices)))
+    if not items:
+        raise click.BadParameter("At least one value is needed")
+    return items
+
+
+def _parse_sizes(value):
+    sizes = _parse_list(value, int)
+    if min(sizes) < 1:
+        raise click.BadParameter("The ledgers need at least one row")
+    return sizes
+
+
+def _parse_currencies(value):
+    currencies = {}
+    for item in value.split(','):
+        currency, _, weight = item.partition('=')
+        try:
+            currencies[currency] = float(weight or 1)
+        except ValueError:
+            raise click.BadParameter("{} is not a valid weight".format(item))
+        if currency not in ExchangeRate.supported_currencies:
+            raise click.BadParameter("{} is not a supported currency".format(
+                currency))
+    return currencies
+
+
+@click.command(help="Run the benchmarks on synthetic ledgers of growing "
+                    "sizes and print how their times scale with the number "
+                    "of rows.")
+@click.option('--sizes', default='1000,10000,100000', show_default=True,
+              callback=lambda ctx, param, value: _parse_sizes(value),
+              help="Comma-separated numbers of rows of the ledgers")
+@click.option('--only', metavar='BENCHMARKS',
+              callback=lambda ctx, param, value: value and _parse_list(
+                  value, str, list(benchmarks)),
+              help="Comma-separated benchmarks to run, out of {}".format(
+                  ", ".join(benchmarks)))
+@click.option('--repeat', default=3, show_default=True,
+              type=click.IntRange(min=1),
+              help="Number of times each benchmark is run, the best time is "
+                   "kept")
+@click.option('--seed', default=0, show_default=True, type=click.INT,
+              help="Seed of the generated ledgers")
+@click.option('--tickers', default=20, show_default=True,
+              type=click.IntRange(min=1),
+              help="Number of tickers in the generated ledgers")
+@click.option('--currencies', default='USD=0.7,CAD=0.3', show_default=True,
+              callback=lambda ctx, param, value: _parse_currencies(value),
+              help="Comma-separated currencies and the share of the tickers "
+                   "that are traded in each")
+@click.option('--loss-density', default=0.2, show_default=True,
+              type=click.FloatRange(0, 1),
+              help="Share of the SELLs that are at a loss")
+@click.option('--wash-clustering', default=0.5, show_default=True,
+              type=click.FloatRange(0, 1),
+              help="Share of the losses that are followed by a BUY within "
+                   "30 days")
+@click.option('-o', '--output', metavar='FILE',
+              help="Write the results to FILE as JSON")
+@click.option('--baseline', metavar='FILE', type=click.File(),
+              help="Compare the results with the JSON results in FILE, and "
+                   "fail if any of them regressed")
+@click.option('--tolerance', default=0.25, show_default=True,
+              type=click.FloatRange(min=0),
+              help="How much longer (as a fraction) than the baseline a "
+                   "benchmark can take before it is a regression")
+def main(sizes, only, repeat, seed, tickers, currencies, loss_density,
+         wash_clustering, output, baseline, tolerance):
+    generator_options = {'tickers': tickers, 'currencies': currencies,
+                         'loss_density': loss_density,
+                         'wash_clustering': wash_clustering, 'seed': seed}
+    with tempfile.TemporaryDirectory() as work_dir:
+        results = get_scaling(run_benchmarks(
+            only or list(benchmarks), sizes, repeat, generator_options,
+            work_dir))
+    click.echo(_format_results(results))
+    if output:
+        with open(output, 'w') as f:
+            json.dump(dict(generator_options, repeat=repeat,
+                           results=results), f, indent=2)
+    if baseline:
+        regressions = get_regressions(results, json.load(baseline),
+                                      tolerance)
+        if regressions:
+            raise click.ClickException("\n".join(
+                "{} regressed on {} rows: {:.4f}s against {:.4f}s".format(
+                    r['benchmark'], r['rows'], r['seconds'],
+                    r['baseline_seconds'])
+                for r in regressions))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+import json
+import threading
+import zlib
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class ValetStub:
+    """A local stand-in for the Bank of Canada Valet API that serves made up
+    exchange rates, so that benchmarks are not slowed down or rate limited by
+    the real API.
+
+    Used as a context manager, it serves from a thread the observations of
+    any series on every business day of the requested range that the series
+    has observations for. The rates are the same for the same series and
+    day. ExchangeRate.valet_obs_url can be set to its url to fetch the rates
+    from it.
+    """
+    path = '/valet/observations'
+    # Like the real API, the noon rates end after the indicative rates start
+    # and there are no observations outside of a series' dates
+    noon_series = 'IEXE0101'
+    noon_rate_dates = (date(2007, 5, 1), date(2017, 4, 28))
+    indicative_rate_min_date = date(2017, 1, 3)
+
+    def __init__(self):
+        self.request_count = 0
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return "http://{}:{}{}".format(host, port, self.path)
+
+    @staticmethod
+    def get_rate(series, day):
+        """Return the made up rate of the series on the day"""
+        key = "{}{}".format(series, day.isoformat()).encode()
+        return "{:.4f}".format(1 + zlib.crc32(key) % 5000 / 10000)
+
+    def get_observations(self, series, start_date, end_date):
+        """Return the observations of the series in the range, in the format
+        of the Valet API"""
+        if series == self.noon_series:
+            start_date = max(start_date, self.noon_rate_dates[0])
+            end_date = min(end_date, self.noon_rate_dates[1])
+        else:
+            start_date = max(start_date, self.indicative_rate_min_date)
+        observations = []
+        day = start_date
+        while day <= end_date:
+            if day.weekday() < 5:
+                observations.append({'d': day.isoformat(),
+                                     series: {'v': self.get_rate(series,
+                                                                 day)}})
+            day += timedelta(days=1)
+        return {'observations': observations}
+
+    def _handle(self, request):
+        with self._lock:
+            self.request_count += 1
+        url = urlparse(request.path)
+        prefix, _, series = url.path.rpartition('/json')[0].rpartition('/')
+        query = parse_qs(url.query)
+        if prefix != self.path or not series:
+            request.send_error(404)
+            return
+        try:
+            start_date = date.fromisoformat(query['start_date'][0])
+            end_date = date.fromisoformat(query['end_date'][0])
+        except (KeyError, ValueError):
+            request.send_error(400)
+            return
+        body = json.dumps(self.get_observations(series, start_date,
+                                                end_date)).encode()
+        request.send_response(200)
+        request.send_header('Content-Type', 'application/json')
+        request.send_header('Content-Length', str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+    def __enter__(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                stub._handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
@@ -0,0 +1,151 @@
+import hashlib
+import os
+import sqlite3
+from contextlib import contextmanager
+from datetime import date
+from decimal import Decimal
+
+from capgains.ticker_gains import Checkpoint, get_rates, get_year_end_cutoff
+
+
+class CheckpointStore:
+    """A persistent, on-disk store of the year-end Checkpoints of the tickers'
+    gains, kept alongside the exchange rate cache.
+
+    Each checkpoint is keyed by a hash of the ticker's transactions that it
+    was calculated from and of their exchange rates (see get_ledger_hashes).
+    Changing any of those transactions or rates, such as when rates are
+    fetched again or imported, changes the hash, so the checkpoint is never
+    found again.
+    The store is backed by SQLite and can safely be shared between several
+    processes, each of which keeps its own connection open since the store
+    is used for every ticker.
+    """
+    filename = 'checkpoints.sqlite'
+    # Seconds to wait on a lock held by another process
+    lock_timeout = 30
+
+    def __init__(self, cache_dir):
+        self._path = os.path.join(cache_dir, self.filename)
+        self._conn = None
+        # Process that opened the connection, a forked process needs its own
+        self._conn_pid = None
+        os.makedirs(cache_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS checkpoints ("
+                "ledger_hash TEXT NOT NULL, "
+                "year INTEGER NOT NULL, "
+                "share_balance TEXT NOT NULL, "
+                "total_acb TEXT NOT NULL, "
+                "last_buy_date TEXT, "
+                "PRIMARY KEY (ledger_hash))")
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_conn'] = None
+        state['_conn_pid'] = None
+        return state
+
+    @property
+    def path(self):
+        return self._path
+
+    @contextmanager
+    def _connect(self):
+        """Use the process's connection, opening it if needed, and commit (or
+        roll back) on exit"""
+        if self._conn is None or self._conn_pid != os.getpid():
+            self._conn = sqlite3.connect(self._path,
+                                         timeout=self.lock_timeout)
+            self._conn_pid = os.getpid()
+        with self._conn:
+            yield self._conn
+
+    @classmethod
+    def get_ledger_hashes(cls, transactions, year, exchange_rates):
+        """Return a map of each year before the given one, starting from the
+        year of the first transaction, to the hash of the transactions that
+        its year-end checkpoint depends on, along with their rates in the map
+        of currencies to ExchangeRates. The transactions are a single
+        ticker's, in chronological order."""
+        # Whether a loss is superficial depends on the transactions shortly
+        # after it, so they are part of the year end's hash
+        last_cutoff = get_year_end_cutoff(year - 1)
+        hashed_transactions = list()
+        for t in transactions:
+            if t.date > last_cutoff:
+                break
+            hashed_transactions.append(t)
+        rates = get_rates(hashed_transactions, exchange_rates)
+        hashes = dict()
+        ledger_hash = hashlib.sha256()
+        # Lines of the transactions that are not in the hash yet, which are
+        # hashed together
+        lines = list()
+        hash_year = None
+        cutoff = None
+        for t, rate in zip(hashed_transactions, rates):
+            if hash_year is None:
+                hash_year = t.date.year
+                cutoff = get_year_end_cutoff(hash_year)
+            while hash_year < year and t.date > cutoff:
+                hashes[hash_year] = cls._get_year_hash(ledger_hash, lines,
+                                                       hash_year)
+                hash_year += 1
+                cutoff = get_year_end_cutoff(hash_year)
+            # The description doesn't change the gains, so it is left out
+            lines.append("%d|%s|%s|%s|%s|%s|%s|%s\n" % (
+                t.date.toordinal(), t.ticker, t.action, t.qty, t.price,
+                t.commission, t.currency, rate))
+        while hash_year is not None and hash_year < year:
+            hashes[hash_year] = cls._get_year_hash(ledger_hash, lines,
+                                                   hash_year)
+            hash_year += 1
+        return hashes
+
+    @staticmethod
+    def _get_year_hash(ledger_hash, lines, year):
+        ledger_hash.update("".join(lines).encode())
+        lines.clear()
+        year_hash = ledger_hash.copy()
+        year_hash.update("{}\n".format(year).encode())
+        return year_hash.hexdigest()
+
+    def get_checkpoint(self, ledger_hashes):
+        """Return the latest Checkpoint stored for one of the ledger hashes
+        (as returned by get_ledger_hashes), or None if there isn't one"""
+        if not ledger_hashes:
+            return None
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT ledger_hash, year, share_balance, total_acb, "
+                "last_buy_date FROM checkpoints WHERE ledger_hash IN "
+                "({})".format(", ".join("?" * len(ledger_hashes))),
+                list(ledger_hashes.values())).fetchall()
+        checkpoint = None
+        for ledger_hash, year, share_balance, total_acb, last_buy_date in rows:
+            if ledger_hashes.get(year) != ledger_hash:
+                continue
+            if checkpoint is not None and checkpoint.year > year:
+                continue
+            checkpoint = Checkpoint(
+                year, Decimal(share_balance), Decimal(total_acb),
+                date.fromisoformat(last_buy_date) if last_buy_date else None)
+        return checkpoint
+
+    def add_checkpoints(self, ledger_hashes, checkpoints):
+        """Store the Checkpoints, keyed by the ledger hashes of their
+        years"""
+        rows = [(ledger_hashes[c.year], c.year, str(c.share_balance),
+                 str(c.total_acb),
+                 c.last_buy_date.isoformat() if c.last_buy_date else None)
+                for c in checkpoints if c.year in ledger_hashes]
+        if not rows:
+            return
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO checkpoints (ledger_hash, year, "
+                "share_balance, total_acb, last_buy_date) "
+                "VALUES (?, ?, ?, ?, ?)", rows)
@@ -1,34 +1,249 @@
 import click
+import sqlite3
 
 from capgains.commands.capgains_show import capgains_show
-from capgains.commands.capgains_calc import capgains_calc
+from capgains.commands.capgains_calc import capgains_calc_years
+from capgains.commands.capgains_rates import (capgains_rates_export,
+                                              capgains_rates_import)
+from capgains.commands.output_formats import formats
+from capgains.checkpoint_store import CheckpointStore
+from capgains.ledger_cache import LedgerCache
+from capgains.rate_store import RateStore
 from capgains.transactions_reader import TransactionsReader
+from capgains.valet_session import ValetSession
+
+
+class YearRange(click.ParamType):
+    """A range of years written as FIRST-LAST, or a single year"""
+    name = 'years'
+
+    def convert(self, value, param, ctx):
+        if isinstance(value, range):
+            return value
+        first, separator, last = value.partition('-')
+        try:
+            first = int(first)
+            last = int(last) if separator else first
+        except ValueError:
+            self.fail("{} is not a range of years such as 2015-2024"
+                      .format(value), param, ctx)
+        if last < first:
+            self.fail("{} ends before it starts".format(value), param, ctx)
+        return range(first, last + 1)
 
 
 @click.group()
-def capgains():
-    pass
+@click.option('--cache-dir', metavar='DIR', envvar='CAPGAINS_CACHE_DIR',
+              default=click.get_app_dir('capgains'),
+              help="Directory used to cache exchange rates and parsed "
+                   "transactions")
+@click.option('--no-cache', is_flag=True,
+              help="Do not cache exchange rates or parsed transactions on "
+                   "disk")
+@click.option('--offline', is_flag=True, envvar='CAPGAINS_OFFLINE',
+              help="Only use the cached exchange rates, never fetch them")
+@click.option('--connect-timeout', metavar='SECONDS', type=click.FLOAT,
+              default=ValetSession.connect_timeout, show_default=True,
+              help="Timeout to connect to the Bank of Canada")
+@click.option('--read-timeout', metavar='SECONDS', type=click.FLOAT,
+              default=ValetSession.read_timeout, show_default=True,
+              help="Timeout to read exchange rates from the Bank of Canada")
+@click.pass_context
+def capgains(ctx, cache_dir, no_cache, offline, connect_timeout,
+             read_timeout):
+    if no_cache and offline:
+        raise click.UsageError(
+            "--offline needs the exchange rate cache, it cannot be used with "
+            "--no-cache")
+    ctx.obj = {'cache_dir': None if no_cache else cache_dir,
+               'offline': offline,
+               'connect_timeout': connect_timeout,
+               'read_timeout': read_timeout}
+
+
+def _open_cache(obj, cache_class, required=False):
+    """Create the cache_class in the cache directory. If the directory can't
+    be used, that is an error when the cache is required. Otherwise a warning
+    is printed and the command runs without any of the caches."""
+    try:
+        return cache_class(obj['cache_dir'])
+    except (OSError, sqlite3.Error) as e:
+        message = "Cannot use the cache directory {}: {}".format(
+            obj['cache_dir'], e)
+        if required:
+            raise click.ClickException(message)
+        click.echo("Warning: {}. Running without the cache.".format(message),
+                   err=True)
+        obj['cache_dir'] = None
+        return None
+
+
+def _get_rate_store(obj, required=False):
+    """Create the RateStore requested through the group options, if any"""
+    if not obj['cache_dir']:
+        if required:
+            raise click.UsageError(
+                "This command needs the exchange rate cache, it cannot be "
+                "used with --no-cache")
+        return None
+    # The offline exchange rates can only come from the cache
+    return _open_cache(obj, RateStore, required or obj['offline'])
+
+
+def _get_checkpoint_store(obj):
+    """Create the CheckpointStore kept alongside the exchange rate cache, if
+    the cache is used"""
+    if not obj['cache_dir']:
+        return None
+    return _open_cache(obj, CheckpointStore)
+
+
+def _get_ledger_cache(obj):
+    """Create the LedgerCache kept alongside the exchange rate cache, if the
+    cache is used"""
+    if not obj['cache_dir']:
+        return None
+    return _open_cache(obj, LedgerCache)
+
 
+def _get_session(obj):
+    """Create the ValetSession configured through the group options"""
+    return ValetSession(connect_timeout=obj['connect_timeout'],
+                        read_timeout=obj['read_timeout'])
 
-@capgains.command(help=("Show entries from the transactions CSV-file in a "
-                        "tabular format. Filters can be applied to narrow "
-                        "down the entries."))
-@click.argument('transactions-csv')
+
+def _sort_options(command):
+    """Add the options of the external sort to the command"""
+    command = click.option(
+        '--sort-memory', metavar='MIB', type=click.IntRange(min=1),
+        default=TransactionsReader.sort_memory // 2 ** 20,
+        show_default=True,
+        help="Memory used to sort the transactions before spilling them to "
+             "temporary files")(command)
+    return click.option(
+        '--sort', is_flag=True,
+        help="Sort the transactions by date, for CSV-files that are not in "
+             "chronological order. Transactions on the same date keep their "
+             "order.")(command)
+
+
+def _split_year(args, years):
+    """Split the calc arguments into the CSV-files and the YEAR. YEAR can't
+    be an argument of its own, since click would then take the only CSV-file
+    for it whenever --years is used."""
+    if years is not None:
+        if len(args) > 1 and args[-1].isdigit():
+            raise click.UsageError("YEAR cannot be used with --years.")
+        return args, None
+    if len(args) < 2:
+        raise click.UsageError("Missing argument 'YEAR' (or --years).")
+    try:
+        return args[:-1], int(args[-1])
+    except ValueError:
+        raise click.BadParameter(
+            "{} is not a valid integer".format(args[-1]), param_hint="'YEAR'")
+
+
+@capgains.command(help=("Show entries from the transactions CSV-files in a "
+                        "tabular format. A directory stands for the "
+                        "CSV-files in it, and the entries of several files "
+                        "are merged by date. Filters can be applied to "
+                        "narrow down the entries."))
+@click.argument('transactions-csv', nargs=-1, required=True)
 @click.option('-t', '--tickers', metavar='TICKERS',
               multiple=True, help="Stocks tickers to filter for")
-def show(transactions_csv, tickers):
-    transactions = TransactionsReader.get_transactions(transactions_csv)
-    capgains_show(transactions, tickers)
+@_sort_options
+@click.option('-f', '--format', 'fmt', type=click.Choice(formats),
+              default='table', show_default=True,
+              help="Format of the output. The csv and jsonl rows hold the "
+                   "values exactly as they were read.")
+@click.pass_obj
+def show(obj, transactions_csv, tickers, sort, sort_memory, fmt):
+    csv_files = TransactionsReader.find_csv_files(transactions_csv)
+    ledger_cache = _get_ledger_cache(obj)
+    if sort:
+        transactions = TransactionsReader.iter_sorted_transactions(
+            csv_files, sort_memory * 2 ** 20)
+    else:
+        transactions = None
+        if ledger_cache is not None:
+            # The cached transactions are only used as they are, the files
+            # are streamed otherwise rather than loaded in full to cache them
+            transactions = TransactionsReader.iter_cached_transactions(
+                csv_files, ledger_cache)
+        if transactions is None:
+            transactions = TransactionsReader.iter_merged_transactions(
+                csv_files)
+    capgains_show(transactions, tickers, fmt)
 
 
 @capgains.command(help=("Calculates capital gains from the transactions "
-                        "CSV-file and displays output in a tabular format. "
+                        "CSV-files and displays output in a tabular format. "
+                        "A directory stands for the CSV-files in it, and the "
+                        "entries of several files are merged by date. "
                         "Filters can be applied to select which stocks to "
                         "calculate the capital gains on."))
-@click.argument('transactions-csv')
-@click.argument('year', type=click.INT)
+@click.argument('args', nargs=-1, required=True,
+                metavar='TRANSACTIONS_CSV... [YEAR]')
 @click.option('-t', '--tickers', metavar='TICKERS',
               multiple=True, help="Stocks tickers to filter for")
-def calc(transactions_csv, year, tickers):
-    transactions = TransactionsReader.get_transactions(transactions_csv)
-    capgains_calc(transactions, year, tickers=tickers)
+@click.option('--years', metavar='FIRST-LAST', type=YearRange(),
+              help="Calculate the capital gains of each of these years at "
+                   "once, instead of the ones of YEAR")
+@click.option('--columnar', is_flag=True,
+              help="Store the transactions column by column to use less "
+                   "memory on large files")
+@click.option('-j', '--jobs', metavar='N', type=click.IntRange(min=1),
+              default=1, show_default=True,
+              help="Number of processes calculating the gains of the "
+                   "tickers at once")
+@_sort_options
+@click.option('-f', '--format', 'fmt', type=click.Choice(formats),
+              default='table', show_default=True,
+              help="Format of the output. The csv and jsonl rows hold every "
+                   "digit of the amounts, and no totals.")
+@click.pass_obj
+def calc(obj, args, tickers, years, columnar, jobs, sort, sort_memory,
+         fmt):
+    transactions_csv, year = _split_year(args, years)
+    csv_files = TransactionsReader.find_csv_files(transactions_csv)
+    if sort:
+        transactions = TransactionsReader.get_sorted_transactions(
+            csv_files, columnar=columnar, memory=sort_memory * 2 ** 20)
+    else:
+        transactions = TransactionsReader.get_merged_transactions(
+            csv_files, columnar=columnar,
+            ledger_cache=_get_ledger_cache(obj))
+    capgains_calc_years(transactions, years or [year], tickers=tickers,
+                        rate_store=_get_rate_store(obj),
+                        offline=obj['offline'], session=_get_session(obj),
+                        jobs=jobs, checkpoint_store=_get_checkpoint_store(obj),
+                        fmt=fmt)
+
+
+@capgains.group(help=("Manage the exchange rates cached from the Bank of "
+                      "Canada, for example to use them offline."))
+def rates():
+    pass
+
+
+@rates.command(name='import',
+               help=("Load a Bank of Canada Valet JSON or CSV dump of the "
+                     "noon (IEXE0101) or indicative (FX<CUR>CAD) exchange "
+                     "rates into the cache."))
+@click.argument('bundle-file')
+@click.pass_obj
+def rates_import(obj, bundle_file):
+    capgains_rates_import(_get_rate_store(obj, required=True), bundle_file)
+
+
+@rates.command(name='export',
+               help=("Write every cached exchange rate to OUTPUT (or to "
+                     "stdout) so it can be imported on another machine."))
+@click.argument('output', type=click.File('w'), default='-')
+@click.option('-f', '--format', 'fmt', type=click.Choice(['json', 'csv']),
+              default='json', show_default=True,
+              help="Format of the exported rates")
+@click.pass_obj
+def rates_export(obj, output, fmt):
+    capgains_rates_export(_get_rate_store(obj, required=True), output, fmt)
@@ -0,0 +1,290 @@
+from array import array
+from datetime import date
+from decimal import Context, Decimal
+
+from .transaction import Transaction
+
+# Context used to rebuild Decimals. Its precision is enough for any
+# coefficient that is stored as an integer, so nothing is ever rounded.
+_context = Context(prec=28)
+
+
+class _CategoricalColumn:
+    """Stores each value as a code that indexes a list of the distinct
+    values"""
+
+    def __init__(self):
+        self._codes = array('I')
+        self._values = list()
+        self._value_codes = dict()
+
+    def __getitem__(self, idx):
+        return self._values[self._codes[idx]]
+
+    def __iter__(self):
+        return map(self._values.__getitem__, self._codes)
+
+    def iter_values(self, positions):
+        """Iterate over the values at the positions"""
+        return map(self._values.__getitem__,
+                   map(self._codes.__getitem__, positions))
+
+    def append(self, value):
+        code = self._value_codes.get(value)
+        if code is None:
+            code = self._value_codes[value] = len(self._values)
+            self._values.append(value)
+        self._codes.append(code)
+
+    def get_value(self, code):
+        """Return the value that the code stands for"""
+        return self._values[code]
+
+    def get_code(self, value):
+        """Return the code of the value, or None if it was never stored"""
+        return self._value_codes.get(value)
+
+    @property
+    def codes(self):
+        return self._codes
+
+
+class _DecimalValues(dict):
+    """Maps the (coefficient, exponent) of each value to the value, which is
+    rebuilt the first time it is looked up"""
+
+    def __init__(self, max_values):
+        super().__init__()
+        self._max_values = max_values
+
+    def __missing__(self, key):
+        if len(self) >= self._max_values:
+            self.clear()
+        value = self[key] = Decimal(key[0]).scaleb(key[1], _context)
+        return value
+
+
+class _DecimalColumn:
+    """Stores each Decimal as an integer coefficient and a base 10 exponent.
+    Decimals that don't fit (such as ones with more than 18 digits, or
+    negative zero) are kept as they are."""
+    max_digits = 18
+    # Number of distinct values to remember the encoding of before starting
+    # over
+    max_memoized_values = 100000
+
+    def __init__(self):
+        self._coefficients = array('q')
+        self._exponents = array('b')
+        self._overflow = dict()
+        # Maps the string of each value appended to its (coefficient,
+        # exponent), or None if it doesn't fit. Decimals are slow to hash
+        # and take apart, but their strings are neither.
+        self._encodings = dict()
+
+    def __getstate__(self):
+        # The encodings are only remembered to speed up appending, they
+        # aren't worth storing
+        state = self.__dict__.copy()
+        state['_encodings'] = dict()
+        return state
+
+    def __len__(self):
+        return len(self._exponents)
+
+    def __getitem__(self, idx):
+        if self._overflow and idx in self._overflow:
+            return self._overflow[idx]
+        return Decimal(self._coefficients[idx]).scaleb(self._exponents[idx],
+                                                       _context)
+
+    def __iter__(self):
+        return self._iter_values(range(len(self)),
+                                 zip(self._coefficients, self._exponents))
+
+    def iter_values(self, positions):
+        """Iterate over the values at the positions"""
+        return self._iter_values(
+            positions, zip(map(self._coefficients.__getitem__, positions),
+                           map(self._exponents.__getitem__, positions)))
+
+    def _iter_values(self, positions, keys):
+        """Iterate over the values at the positions from their (coefficient,
+        exponent) keys, rebuilding every distinct value once"""
+        values = _DecimalValues(self.max_memoized_values)
+        if not self._overflow:
+            return map(values.__getitem__, keys)
+        overflow = self._overflow
+        return (overflow[idx] if idx in overflow else values[key]
+                for idx, key in zip(positions, keys))
+
+    def append(self, value):
+        value_str = str(value)
+        encoding = self._encodings.get(value_str, False)
+        if encoding is False:
+            if len(self._encodings) >= self.max_memoized_values:
+                self._encodings.clear()
+            encoding = self._encodings[value_str] = self._encode(value)
+        if encoding is None:
+            self._overflow[len(self)] = value
+            encoding = (0, 0)
+        self._coefficients.append(encoding[0])
+        self._exponents.append(encoding[1])
+
+    def _encode(self, value):
+        """Return the (coefficient, exponent) of the value, or None if it
+        doesn't fit"""
+        sign, digits, exponent = value.as_tuple()
+        if (isinstance(exponent, int) and -128 <= exponent <= 127 and
+                len(digits) <= self.max_digits and (value or not sign)):
+            return int(value.scaleb(-exponent, _context)), exponent
+        return None
+
+
+class ColumnarLedger:
+    """A read-only sequence of transactions that is stored column by column.
+
+    Dates are stored as ordinals, the ticker, action, currency and
+    description as codes into lists of their distinct values, and the
+    quantity, price and commission as scaled integers. This takes a fraction
+    of the memory that a list of Transactions does. Transactions are only
+    created when they are accessed, and only hold the values that were read
+    from the CSV-file: the values calculated on them are not kept.
+    """
+
+    def __init__(self, transactions=()):
+        self._dates = array('i')
+        self._descriptions = _CategoricalColumn()
+        self._tickers = _CategoricalColumn()
+        self._actions = _CategoricalColumn()
+        self._qtys = _DecimalColumn()
+        self._prices = _DecimalColumn()
+        self._commissions = _DecimalColumn()
+        self._currencies = _CategoricalColumn()
+        for transaction in transactions:
+            self.append(transaction)
+
+    def __len__(self):
+        return len(self._dates)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self._get_row(i) for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("ledger index out of range")
+        return self._get_row(idx)
+
+    def __iter__(self):
+        # Each column is gone through on its own, which is much faster than
+        # looking up every row
+        return map(Transaction,
+                   map(date.fromordinal, self._dates),
+                   self._descriptions,
+                   self._tickers,
+                   self._actions,
+                   self._qtys,
+                   self._prices,
+                   self._commissions,
+                   self._currencies)
+
+    def iter_rows(self, positions):
+        """Create the transactions at the positions, going through each
+        column on its own like __iter__ does"""
+        return map(Transaction,
+                   map(date.fromordinal,
+                       map(self._dates.__getitem__, positions)),
+                   self._descriptions.iter_values(positions),
+                   self._tickers.iter_values(positions),
+                   self._actions.iter_values(positions),
+                   self._qtys.iter_values(positions),
+                   self._prices.iter_values(positions),
+                   self._commissions.iter_values(positions),
+                   self._currencies.iter_values(positions))
+
+    def _get_row(self, idx):
+        return Transaction(date.fromordinal(self._dates[idx]),
+                           self._descriptions[idx],
+                           self._tickers[idx],
+                           self._actions[idx],
+                           self._qtys[idx],
+                           self._prices[idx],
+                           self._commissions[idx],
+                           self._currencies[idx])
+
+    def append(self, transaction):
+        """Store the values that were read for the transaction"""
+        self._dates.append(transaction.date.toordinal())
+        self._descriptions.append(transaction.description)
+        self._tickers.append(transaction.ticker)
+        self._actions.append(transaction.action)
+        self._qtys.append(transaction.qty)
+        self._prices.append(transaction.price)
+        self._commissions.append(transaction.commission)
+        self._currencies.append(transaction.currency)
+
+    def get_tickers(self, positions):
+        """Return the unique tickers of the transactions at the positions"""
+        tickers = self._tickers
+        return sorted(set(tickers[p] for p in positions))
+
+    def get_currency_date_ranges(self, positions):
+        """Return a map of each currency of the transactions at the
+        positions to the [first, last] dates of its transactions"""
+        dates = self._dates
+        currency_codes = self._currencies.codes
+        ranges = dict()
+        for p in positions:
+            day = dates[p]
+            code = currency_codes[p]
+            code_range = ranges.get(code)
+            if code_range is None:
+                ranges[code] = [day, day]
+            elif day < code_range[0]:
+                code_range[0] = day
+            elif day > code_range[1]:
+                code_range[1] = day
+        return {self._currencies.get_value(code):
+                [date.fromordinal(first), date.fromordinal(last)]
+                for code, (first, last) in ranges.items()}
+
+    def filter_positions(self, positions, tickers=None, year=None,
+                         max_year=None, action=None, superficial_loss=None):
+        """Return the positions that match the filter parameters, checking
+        the columns directly instead of creating the transactions"""
+        # The superficial losses are calculated on the transactions, so none
+        # of the stored transactions are one
+        if superficial_loss:
+            return array('q')
+        ticker_codes = None
+        if tickers is not None:
+            ticker_codes = set(self._tickers.get_code(t) for t in tickers)
+        action_code = None
+        if action is not None:
+            action_code = self._actions.get_code(action)
+            if action_code is None:
+                return array('q')
+        start = stop = None
+        if year is not None:
+            start = date(year, 1, 1).toordinal()
+            stop = date(year + 1, 1, 1).toordinal()
+        if max_year is not None:
+            max_stop = date(max_year + 1, 1, 1).toordinal()
+            stop = max_stop if stop is None else min(stop, max_stop)
+        dates = self._dates
+        ticker_column = self._tickers.codes
+        action_column = self._actions.codes
+        matches = array('q')
+        for p in positions:
+            if (ticker_codes is not None and
+                    ticker_column[p] not in ticker_codes):
+                continue
+            if start is not None and dates[p] < start:
+                continue
+            if stop is not None and dates[p] >= stop:
+                continue
+            if action_code is not None and action_column[p] != action_code:
+                continue
+            matches.append(p)
+        return matches
@@ -1,9 +1,11 @@
 import click
 import tabulate
-from itertools import groupby
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
+from capgains.commands.output_formats import format_decimal, format_rows
 from capgains.exchange_rate import ExchangeRate
-from capgains.ticker_gains import TickerGains
+from capgains.ticker_gains import TickerGains, get_year_end_cutoff
 
 # describes how to align the individual table columns
 colalign = (
@@ -17,6 +19,17 @@ colalign = (
     "right",  # capital gain
 )
 
+# the fields of each reported transaction in the csv and jsonl formats
+report_fields = ["year", "date", "description", "ticker", "qty", "proceeds",
+                 "acb", "outlays", "capital_gain"]
+
+# Transactions of each ticker, exchange rates and checkpoint store shared by
+# the calls to _get_worker_ticker_reports in a worker process, set once when
+# the worker starts
+_worker_ticker_transactions = None
+_worker_exchange_rates = None
+_worker_checkpoint_store = None
+
 
 def _get_total_gains(transactions):
     total = 0
@@ -25,63 +38,263 @@ def _get_total_gains(transactions):
     return total
 
 
-def _get_map_of_currencies_to_exchange_rates(transactions):
-    """First, split the list of transactions into sublists where each sublist
-    will only contain transactions with the same currency"""
+def _get_currency_date_ranges(transactions, last_year):
+    """Return a map of each currency to the [first, last] dates of the
+    transactions up to the year end cutoff of last_year"""
+    currency_dates = transactions.filter_by(
+        max_year=last_year).currency_date_ranges
+    cutoff = get_year_end_cutoff(last_year)
+    for t in transactions.filter_by(year=last_year + 1):
+        if t.date > cutoff:
+            break
+        date_range = currency_dates.setdefault(t.currency, [t.date, t.date])
+        date_range[1] = t.date
+    return currency_dates
+
 
-    contiguous_currencies = sorted(transactions.transactions,
-                                   key=lambda t: t.currency)
-    currency_groups = [list(g) for _, g in groupby(contiguous_currencies,
-                                                   lambda t: t.currency)]
-    currencies_to_exchange_rates = dict()
-    # Create a separate ExchangeRate object for each currency
-    for currency_group in currency_groups:
-        currency = currency_group[0].currency
-        min_date = currency_group[0].date
-        max_date = currency_group[-1].date
-        currencies_to_exchange_rates[currency] = ExchangeRate(
-            currency, min_date, max_date)
-    return currencies_to_exchange_rates
+def _get_map_of_currencies_to_exchange_rates(transactions, rate_store=None,
+                                             offline=False, session=None,
+                                             last_year=None):
+    """First, find the range of dates that each currency is used in, up to
+    the year end cutoff of last_year if it is given"""
+    if last_year is None:
+        currency_dates = transactions.currency_date_ranges
+    else:
+        currency_dates = _get_currency_date_ranges(transactions, last_year)
+    if not currency_dates:
+        return dict()
+    # Create a separate ExchangeRate object for each currency, fetching the
+    # exchange rates of every currency concurrently
+    with ThreadPoolExecutor(max_workers=len(currency_dates)) as executor:
+        futures = {
+            currency: executor.submit(
+                ExchangeRate, currency, start_date, end_date,
+                rate_store=rate_store, offline=offline, session=session)
+            for currency, (start_date, end_date) in currency_dates.items()
+        }
+    return {currency: future.result()
+            for currency, future in futures.items()}
 
 
-def calculate_gains(transactions, year, ticker):
+def calculate_gains_by_year(transactions, years, ticker, exchange_rates=None,
+                            rate_store=None, checkpoint_store=None):
+    """Calculate the gains for the ticker in a single pass over its
+    transactions, and return a map of each of the years to the
+    transactions that need to be reported for it. The transactions can either
+    be the whole ledger or just the ticker's transactions. The exchange rates
+    can be shared between calls, otherwise they are fetched for the ticker's
+    transactions. If a CheckpointStore is supplied, the calculation resumes
+    from the latest year-end checkpoint of the ticker's transactions before
+    the first year, and the year ends it crosses are checkpointed.
+
+    A loss at the end of a year is superficial if the shares are bought back
+    early in the next one, so the transactions are replayed up to that
+    cutoff after the last year. The gains of a year are then the same
+    whichever other years are calculated with it."""
+    years = sorted(years)
+    cutoff = get_year_end_cutoff(years[-1])
     ticker_transactions = transactions.filter_by(tickers=[ticker],
-                                                 max_year=year)
-    er_map = _get_map_of_currencies_to_exchange_rates(ticker_transactions)
-    tg = TickerGains(ticker)
-    tg.add_transactions(ticker_transactions, er_map)
-    return ticker_transactions.filter_by(year=year, action='SELL',
-                                         superficial_loss=False)
+                                                 max_year=years[-1] + 1)
+    if ticker_transactions.columnar:
+        # The gains are calculated on the transactions, so they have to be
+        # created once and kept while the ticker is being reported
+        ticker_transactions = ticker_transactions.materialize()
+    if exchange_rates is None:
+        exchange_rates = _get_map_of_currencies_to_exchange_rates(
+            ticker_transactions, rate_store, last_year=years[-1])
+    transactions_to_add = ticker_transactions[:bisect_right(
+        ticker_transactions, cutoff, key=lambda t: t.date)]
+    checkpoint = None
+    if checkpoint_store is not None:
+        ledger_hashes = checkpoint_store.get_ledger_hashes(
+            transactions_to_add, years[-1], exchange_rates)
+        # The checkpoints of the years being reported are past some of their
+        # transactions
+        checkpoint = checkpoint_store.get_checkpoint(
+            {year: ledger_hash for year, ledger_hash in ledger_hashes.items()
+             if year < years[0]})
+    if checkpoint is not None:
+        # Only the transactions after the checkpoint's year are needed
+        transactions_to_add = transactions_to_add[bisect_right(
+            transactions_to_add, checkpoint.year, key=lambda t: t.date.year):]
+    tg = TickerGains(ticker, checkpoint)
+    tg.add_transactions(transactions_to_add, exchange_rates)
+    if checkpoint_store is not None:
+        checkpoint_store.add_checkpoints(ledger_hashes, tg.checkpoints)
+    return {year: ticker_transactions.filter_by(year=year, action='SELL',
+                                                superficial_loss=False)
+            for year in years}
+
+
+def calculate_gains(transactions, year, ticker, exchange_rates=None,
+                    rate_store=None, checkpoint_store=None):
+    """Calculate the gains for the ticker and return the transactions that
+    need to be reported for the year. See calculate_gains_by_year."""
+    return calculate_gains_by_year(transactions, [year], ticker,
+                                   exchange_rates, rate_store,
+                                   checkpoint_store)[year]
+
+
+def _format_gains(transactions_to_report, total_gains):
+    """Return the text reporting the gains of a ticker's transactions"""
+    if not transactions_to_report:
+        return "No capital gains\n"
+    headers = ["date", "description", "ticker", "qty", "proceeds", "ACB",
+               "outlays", "capital gain/loss"]
+    rows = [[
+        t.date,
+        t.description,
+        t.ticker,
+        "{0:f}".format(t.qty.normalize()),
+        "{:,.2f}".format(t.proceeds),
+        "{:,.2f}".format(t.acb),
+        "{:,.2f}".format(t.expenses),
+        "{:,.2f}".format(t.capital_gain)
+    ] for t in transactions_to_report]
+    output = tabulate.tabulate(rows, headers=headers, tablefmt="psql",
+                               colalign=colalign, disable_numparse=True)
+    return "[Total Gains = {0:,.2f}]\n{1}\n".format(total_gains, output)
+
+
+def _format_report_rows(year, transactions_to_report, fmt):
+    """Return the rows reporting the gains of a ticker's transactions in the
+    csv or jsonl format, with every digit of the amounts"""
+    rows = [[
+        year,
+        t.date.isoformat(),
+        t.description,
+        t.ticker,
+        format_decimal(t.qty),
+        format_decimal(t.proceeds),
+        format_decimal(t.acb),
+        format_decimal(t.expenses),
+        format_decimal(t.capital_gain)
+    ] for t in transactions_to_report]
+    return format_rows(rows, report_fields, fmt, header=False)
+
 
+def _format_year_totals(year_totals):
+    """Return the text reporting the total gains of every ticker for each
+    year"""
+    rows = [[year, "{:,.2f}".format(total_gains)]
+            for year, total_gains in year_totals.items()]
+    output = tabulate.tabulate(rows, headers=["year", "capital gain/loss"],
+                               tablefmt="psql", colalign=("left", "right"),
+                               disable_numparse=True)
+    return "[Total Gains by Year]\n{}\n".format(output)
 
-def capgains_calc(transactions, year, tickers=None):
+
+def _get_ticker_reports(transactions, years, ticker, exchange_rates,
+                        checkpoint_store, fmt="table"):
+    """Calculate the gains of the ticker and return the (total gains, text
+    reporting them in the format) of each of the years"""
+    transactions_to_report = calculate_gains_by_year(
+        transactions, years, ticker, exchange_rates,
+        checkpoint_store=checkpoint_store)
+    reports = []
+    for year in years:
+        total_gains = _get_total_gains(transactions_to_report[year])
+        if fmt == "table":
+            output = _format_gains(transactions_to_report[year], total_gains)
+        else:
+            output = _format_report_rows(year, transactions_to_report[year],
+                                         fmt)
+        reports.append((total_gains, output))
+    return reports
+
+
+def _init_worker(ticker_transactions, exchange_rates, checkpoint_store):
+    global _worker_ticker_transactions, _worker_exchange_rates, \
+        _worker_checkpoint_store
+    _worker_ticker_transactions = ticker_transactions
+    _worker_exchange_rates = exchange_rates
+    _worker_checkpoint_store = checkpoint_store
+
+
+def _get_worker_ticker_reports(ticker, years, fmt):
+    """Calculate the gains of the ticker in a worker process"""
+    return _get_ticker_reports(_worker_ticker_transactions[ticker], years,
+                               ticker, _worker_exchange_rates,
+                               _worker_checkpoint_store, fmt)
+
+
+def capgains_calc(transactions, year, tickers=None, rate_store=None,
+                  offline=False, session=None, jobs=1,
+                  checkpoint_store=None, fmt="table"):
     """Take a list of transactions and print the calculated capital
-    gains in a separate tabular format for each specified ticker."""
+    gains in a separate tabular format for each specified ticker. If a
+    RateStore is supplied, exchange rates are cached in it, and if offline is
+    set they are only ever read from it. Exchange rates are fetched with the
+    ValetSession if one is supplied. The gains are calculated in that many
+    processes if jobs is more than 1. If a
+    CheckpointStore is supplied, the gains of each ticker are calculated from
+    its latest year-end checkpoint. With the csv or jsonl format, a row with
+    the exact amounts is printed for each reported transaction instead of
+    the tables."""
+    capgains_calc_years(transactions, [year], tickers, rate_store, offline,
+                        session, jobs, checkpoint_store, fmt)
+
+
+def capgains_calc_years(transactions, years, tickers=None, rate_store=None,
+                        offline=False, session=None, jobs=1,
+                        checkpoint_store=None, fmt="table"):
+    """Like capgains_calc, but print the capital gains of each ticker for
+    each of the years. The gains of all the years are calculated in a single
+    pass over each ticker's transactions. If there is more than one year, the
+    total gains of each year are printed last in the table format. The rows
+    of the other formats are printed as soon as each ticker is done."""
+    years = sorted(set(years))
+    if fmt == "csv":
+        click.echo(format_rows([], report_fields, fmt), nl=False)
     filtered_transactions = transactions.filter_by(tickers=tickers)
     if not filtered_transactions:
-        click.echo("No transactions available")
+        # Kept out of the rows of the other formats
+        click.echo("No transactions available", err=fmt != "table")
         return
-    for ticker in filtered_transactions.tickers:
-        click.echo("{}-{}".format(ticker, year))
-        transactions_to_report = calculate_gains(filtered_transactions, year,
-                                                 ticker)
-        if not transactions_to_report:
-            click.echo("No capital gains\n")
-            continue
-        total_gains = _get_total_gains(transactions_to_report)
-        click.echo("[Total Gains = {0:,.2f}]".format(total_gains))
-        headers = ["date", "description", "ticker", "qty", "proceeds", "ACB",
-                   "outlays", "capital gain/loss"]
-        rows = [[
-            t.date,
-            t.description,
-            t.ticker,
-            "{0:f}".format(t.qty.normalize()),
-            "{:,.2f}".format(t.proceeds),
-            "{:,.2f}".format(t.acb),
-            "{:,.2f}".format(t.expenses),
-            "{:,.2f}".format(t.capital_gain)
-        ] for t in transactions_to_report]
-        output = tabulate.tabulate(rows, headers=headers, tablefmt="psql",
-                                   colalign=colalign, disable_numparse=True)
-        click.echo("{}\n".format(output))
+    # Fetch the exchange rates once for all the tickers, instead of once per
+    # ticker
+    exchange_rates = _get_map_of_currencies_to_exchange_rates(
+        filtered_transactions, rate_store,
+        offline, session, last_year=years[-1])
+    # Partition the ledger by ticker once, so that every ticker's gains are
+    # calculated from its own transactions instead of the whole ledger
+    ticker_transactions = filtered_transactions.group_by_ticker()
+    tickers = filtered_transactions.tickers
+    if jobs > 1 and len(tickers) > 1:
+        reports = _iter_parallel_ticker_reports(
+            ticker_transactions, tickers, years, exchange_rates, jobs,
+            checkpoint_store, fmt)
+    else:
+        reports = (_get_ticker_reports(ticker_transactions[ticker], years,
+                                       ticker, exchange_rates,
+                                       checkpoint_store, fmt)
+                   for ticker in tickers)
+    year_totals = dict.fromkeys(years, 0)
+    for ticker, ticker_reports in zip(tickers, reports):
+        for year, (total_gains, output) in zip(years, ticker_reports):
+            if fmt != "table":
+                click.echo(output, nl=False)
+                continue
+            click.echo("{}-{}".format(ticker, year))
+            click.echo(output)
+            year_totals[year] += total_gains
+    if fmt == "table" and len(years) > 1:
+        click.echo(_format_year_totals(year_totals))
+
+
+def _iter_parallel_ticker_reports(ticker_transactions, tickers, years,
+                                  exchange_rates, jobs,
+                                  checkpoint_store=None, fmt="table"):
+    """Calculate the gains of the tickers in a pool of processes. The reports
+    of each ticker are yielded in ticker order as soon as it and the tickers
+    before it are done."""
+    # The transactions and exchange rates are handed to each worker once
+    # when it starts (processes that are forked inherit them without any
+    # copying), so only the tickers are sent for every task
+    with ProcessPoolExecutor(max_workers=min(jobs, len(tickers)),
+                             initializer=_init_worker,
+                             initargs=(ticker_transactions, exchange_rates,
+                                       checkpoint_store)) as executor:
+        yield from executor.map(_get_worker_ticker_reports, tickers,
+                                [years] * len(tickers),
+                                [fmt] * len(tickers))
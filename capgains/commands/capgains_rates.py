@@ -0,0 +1,143 @@
+import click
+import csv
+import io
+import json
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+from capgains.exchange_rate import ExchangeRate
+
+observations = ExchangeRate.observations
+coverage = "coverage"
+
+
+def _parse_rate(series, date_str, value):
+    try:
+        return date.fromisoformat(date_str), Decimal(value)
+    except (ValueError, InvalidOperation):
+        raise click.ClickException(
+            "Invalid {} observation on {}: {}".format(series, date_str, value))
+
+
+def _read_json_bundle(content):
+    """Read the rates out of a Valet JSON response. Returns a map of series to
+    rates, and a map of series to the date ranges the rates cover if the
+    bundle was exported by us."""
+    try:
+        bundle = json.loads(content)
+        observation_list = bundle[observations]
+    except (ValueError, KeyError, TypeError):
+        raise click.ClickException(
+            "No observations were found in the rate bundle")
+    series_rates = dict()
+    for observation in observation_list:
+        date_str = observation[ExchangeRate.date]
+        for series, value in observation.items():
+            if series == ExchangeRate.date:
+                continue
+            day, rate = _parse_rate(series, date_str,
+                                    value[ExchangeRate.value])
+            series_rates.setdefault(series, dict())[day] = rate
+    series_coverage = {
+        series: [(date.fromisoformat(s), date.fromisoformat(e))
+                 for s, e in ranges]
+        for series, ranges in bundle.get(coverage, dict()).items()
+    }
+    return series_rates, series_coverage
+
+
+def _read_csv_bundle(content):
+    """Read the rates out of a Valet CSV response. The observations follow
+    the header row that starts with a 'date' column."""
+    series_rates = dict()
+    header = None
+    for row in csv.reader(io.StringIO(content)):
+        if header is None:
+            if row and row[0] == "date":
+                header = row
+            continue
+        if not row:
+            # The observations section is over
+            break
+        for series, value in zip(header[1:], row[1:]):
+            if not value:
+                # Series don't always have an observation on the same day
+                continue
+            day, rate = _parse_rate(series, row[0], value)
+            series_rates.setdefault(series, dict())[day] = rate
+    if header is None:
+        raise click.ClickException(
+            "No observations were found in the rate bundle")
+    return series_rates, dict()
+
+
+def capgains_rates_import(rate_store, bundle_file):
+    """Load a Bank of Canada Valet JSON or CSV dump into the rate store"""
+    try:
+        with open(bundle_file, newline='') as f:
+            content = f.read()
+    except FileNotFoundError:
+        raise click.ClickException("File not found: {}".format(bundle_file))
+    if content.lstrip().startswith("{"):
+        series_rates, series_coverage = _read_json_bundle(content)
+    else:
+        series_rates, series_coverage = _read_csv_bundle(content)
+    supported_series = ExchangeRate.get_supported_series()
+    imported = False
+    for series in sorted(series_rates):
+        if series not in supported_series:
+            click.echo("Skipping unsupported series {}".format(series))
+            continue
+        rates = series_rates[series]
+        # Rates that were not exported by us are assumed to cover every day
+        # from the first to the last observation
+        ranges = series_coverage.get(series, [(min(rates), max(rates))])
+        for start_date, end_date in ranges:
+            rates_in_range = {d: r for d, r in rates.items()
+                              if start_date <= d <= end_date}
+            rate_store.add_rates(series, rates_in_range, start_date, end_date)
+        click.echo("Imported {} {} rates from {} to {}".format(
+            len(rates), series, ranges[0][0], ranges[-1][1]))
+        imported = True
+    if not imported:
+        raise click.ClickException(
+            "No supported series were found in the rate bundle. The supported "
+            "series are {}".format(supported_series))
+
+
+def capgains_rates_export(rate_store, output, fmt="json"):
+    """Write every rate held in the rate store out as a Valet-style JSON or
+    CSV dump"""
+    all_series = rate_store.get_series()
+    series_rates = {
+        series: rate_store.get_rates(series, date.min, date.max)
+        for series in all_series
+    }
+    days = sorted(set(d for rates in series_rates.values() for d in rates))
+    if fmt == "csv":
+        writer = csv.writer(output, lineterminator='\n')
+        writer.writerow(["date"] + all_series)
+        for day in days:
+            writer.writerow([day.isoformat()] + [
+                str(series_rates[series].get(day, ""))
+                for series in all_series
+            ])
+        return
+    bundle = {
+        coverage: {
+            series: [[s.isoformat(), e.isoformat()]
+                     for s, e in rate_store.get_coverage(series)]
+            for series in all_series
+        },
+        observations: [],
+    }
+    for day in days:
+        observation = {ExchangeRate.date: day.isoformat()}
+        for series in all_series:
+            if day in series_rates[series]:
+                observation[series] = {
+                    ExchangeRate.value: str(series_rates[series][day])
+                }
+        bundle[observations].append(observation)
+    json.dump(bundle, output, indent=2)
+    output.write("\n")
@@ -1,6 +1,8 @@
 import click
 import tabulate
 
+from capgains.commands.output_formats import format_decimal, write_rows
+
 
 # describes how to align the individual table columns
 colalign = (
@@ -15,14 +17,27 @@ colalign = (
 )
 
 
-def capgains_show(transactions, tickers=None):
-    """Take a list of transactions and print them in tabular format."""
-    filtered_transactions = transactions.filter_by(tickers=tickers)
-    if not filtered_transactions:
-        click.echo("No results found")
-        return
+def capgains_show(transactions, tickers=None, fmt="table"):
+    """Take a list of transactions and print them in tabular format, or in
+    the csv or jsonl format. The transactions can also be a stream, in which
+    case only the formatted rows are held in memory for the table, and
+    nothing at all for the other formats."""
     headers = ["date", "description", "ticker", "action", "qty", "price",
                "commission", "currency"]
+    if fmt != "table":
+        # The values are written exactly as they were read
+        rows = ([
+            t.date.isoformat(),
+            t.description,
+            t.ticker,
+            t.action,
+            format_decimal(t.qty),
+            format_decimal(t.price),
+            format_decimal(t.commission),
+            t.currency
+        ] for t in transactions if not tickers or t.ticker in tickers)
+        write_rows(rows, headers, fmt)
+        return
     rows = [[
         t.date,
         t.description,
@@ -32,7 +47,10 @@ def capgains_show(transactions, tickers=None):
         "{:,.2f}".format(t.price),
         "{:,.2f}".format(t.commission),
         t.currency
-    ] for t in filtered_transactions]
+    ] for t in transactions if not tickers or t.ticker in tickers]
+    if not rows:
+        click.echo("No results found")
+        return
     output = tabulate.tabulate(rows, headers=headers, colalign=colalign,
                                tablefmt="psql", disable_numparse=True)
     click.echo(output)
@@ -0,0 +1,42 @@
+import click
+import csv
+import io
+import json
+
+# formats that the commands can print their rows in, besides the table
+formats = ("table", "csv", "jsonl")
+
+
+def format_decimal(value):
+    """Format the Decimal with all of its digits, without an exponent, so
+    that it can be read back exactly"""
+    return "{0:f}".format(value)
+
+
+def format_rows(rows, headers, fmt, header=True):
+    """Return the rows (lists of values, one for each of the headers) in the
+    csv or jsonl format. A CSV header row comes first if header is set."""
+    output = io.StringIO()
+    write_rows(rows, headers, fmt, output, header)
+    return output.getvalue()
+
+
+def write_rows(rows, headers, fmt, stream=None, header=True):
+    """Write the rows (lists of values, one for each of the headers) in the
+    csv or jsonl format to the stream, stdout by default. Each row is written
+    as soon as it is produced, so the rows can be a stream. A CSV header row
+    comes first if header is set."""
+    if stream is None:
+        stream = click.get_text_stream('stdout')
+    if fmt == "csv":
+        writer = csv.writer(stream, lineterminator='\n')
+        if header:
+            writer.writerow(headers)
+        writer.writerows(rows)
+    else:
+        write = stream.write
+        dumps = json.dumps
+        for row in rows:
+            write(dumps(dict(zip(headers, row))))
+            write('\n')
+    stream.flush()
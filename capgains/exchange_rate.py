@@ -1,8 +1,13 @@
 import requests
+import threading
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, timedelta, datetime
 from decimal import Decimal
 from click import ClickException
 
+from capgains.valet_session import ValetSession
+
 
 class ExchangeRate:
     indicative_rate_min_date = date(2017, 1, 3)
@@ -14,12 +19,27 @@ class ExchangeRate:
     value = 'v'
     supported_currencies = ['CAD', 'USD']
     noon_rate_forex_str = {'USD': 'IEXE0101'}
+    # Maximum number of requests made to the Bank of Canada at once
+    max_workers = 8
+    # Long date ranges are split into chunks of this many days that are
+    # fetched concurrently
+    chunk_days = 3 * 365
+    # Session shared by every ExchangeRate that isn't given its own
+    _default_session = None
+    _default_session_lock = threading.Lock()
 
-    def __init__(self, currency_from, start_date, end_date):
+    def __init__(self, currency_from, start_date, end_date, rate_store=None,
+                 offline=False, session=None):
         self._currency_from = currency_from
         self._start_date = start_date
         self._end_date = end_date
+        self._rate_store = rate_store
+        self._offline = offline
+        self._session = session
         self._rates = dict()
+        # Sorted index of the dates in self._rates, used to look up the
+        # closest preceeding rate in O(log n)
+        self._dates = list()
 
         if currency_from not in self.supported_currencies:
             raise ClickException(
@@ -42,24 +62,135 @@ class ExchangeRate:
             # Nothing to do if currencies are the same
             return
 
-        noon_rates = self._fetch_noon_rates(start_date, end_date)
-        indicative_rates = self._fetch_indicative_rates(start_date, end_date)
-        self._rates.update(noon_rates)
-        self._rates.update(indicative_rates)
+        ranges = [self._get_noon_rate_range(start_date, end_date),
+                  self._get_indicative_rate_range(start_date, end_date)]
+        self._rates = self._get_rates([r for r in ranges if r])
+        self._dates = sorted(self._rates)
 
-    def _fetch_rates(self, start_date, end_date, forex_str):
-        """Fetch exchange rates from the supplied URL"""
+    def __getstate__(self):
+        # The rates are all fetched when the ExchangeRate is created, so the
+        # rate store and session are not needed by a copy of it (such as the
+        # ones sent to the processes calculating gains)
+        state = self.__dict__.copy()
+        state['_rate_store'] = None
+        state['_session'] = None
+        return state
+
+    @classmethod
+    def get_default_session(cls):
+        """Return the ValetSession shared by every ExchangeRate, so that
+        connections are reused between them"""
+        with cls._default_session_lock:
+            if cls._default_session is None:
+                cls._default_session = ValetSession()
+            return cls._default_session
+
+    @classmethod
+    def get_supported_series(cls):
+        """Return the Bank of Canada series that exchange rates are fetched
+        from"""
+        series = list(cls.noon_rate_forex_str.values())
+        for currency in cls.supported_currencies:
+            if currency != cls.currency_to:
+                series.append("FX{}{}".format(currency, cls.currency_to))
+        return series
+
+    def _get_offline_rates(self, start_date, end_date, forex_str):
+        """Get exchange rates from the rate store without ever fetching
+        them"""
+        if self._rate_store is None:
+            raise ClickException(
+                "Exchange rates can only be used offline from the cache")
+        missing = self._rate_store.missing_ranges(forex_str, start_date,
+                                                  end_date, expired_ok=True)
+        if missing:
+            raise ClickException(
+                "Exchange rates for {} are not available offline from {} to {}"  # noqa: E501
+                .format(forex_str, missing[0][0].isoformat(),
+                        missing[-1][1].isoformat()))
+        return self._rate_store.get_rates(
+            forex_str, start_date - timedelta(days=7), end_date)
+
+    def _get_rates(self, ranges):
+        """Get exchange rates for a list of (forex_str, start_date, end_date)
+        ranges. Rates are read from the rate store if one is available, and
+        only the date ranges that it does not already hold are fetched."""
         rates = {}
+        if self._offline:
+            for forex_str, start_date, end_date in ranges:
+                rates.update(self._get_offline_rates(start_date, end_date,
+                                                     forex_str))
+            return rates
         # Always move the start date back 7 days in case the start
         # date, end date, and all days in between are all weekends/holidays
         # where no exchange rate can be found
-        start_date -= timedelta(days=7)
+        ranges = [(forex_str, start_date - timedelta(days=7), end_date)
+                  for forex_str, start_date, end_date in ranges]
+        fetch_ranges = []
+        for forex_str, start_date, end_date in ranges:
+            if self._rate_store is None:
+                gaps = [(start_date, end_date)]
+            else:
+                gaps = self._rate_store.missing_ranges(forex_str, start_date,
+                                                       end_date)
+            for gap_start, gap_end in gaps:
+                fetch_ranges.extend(
+                    (forex_str, chunk_start, chunk_end)
+                    for chunk_start, chunk_end in self._split_range(gap_start,
+                                                                    gap_end))
+        fetched_rates = self._fetch_ranges(fetch_ranges)
+        for forex_str, start_date, end_date in ranges:
+            if self._rate_store is not None:
+                rates.update(self._rate_store.get_rates(forex_str, start_date,
+                                                        end_date))
+            rates.update(fetched_rates.get(forex_str, {}))
+        return rates
+
+    def _split_range(self, start_date, end_date):
+        """Split the date range into chunks of at most chunk_days days"""
+        chunks = []
+        while start_date <= end_date:
+            chunk_end = min(end_date,
+                            start_date + timedelta(days=self.chunk_days - 1))
+            chunks.append((start_date, chunk_end))
+            start_date = chunk_end + timedelta(days=1)
+        return chunks
+
+    def _fetch_ranges(self, fetch_ranges):
+        """Fetch the (forex_str, start_date, end_date) ranges concurrently and
+        return a map of forex_str to rates. Every range is stored in the rate
+        store as soon as it is fetched, so that if one of them fails the next
+        run only has to fetch the ranges that are still missing."""
+        if not fetch_ranges:
+            return {}
+        max_workers = min(self.max_workers, len(fetch_ranges))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(self._fetch_and_store_rates,
+                                       start_date, end_date, forex_str)
+                       for forex_str, start_date, end_date in fetch_ranges]
+        fetched_rates = {}
+        for (forex_str, _, _), future in zip(fetch_ranges, futures):
+            fetched_rates.setdefault(forex_str, {}).update(future.result())
+        return fetched_rates
+
+    def _fetch_and_store_rates(self, start_date, end_date, forex_str):
+        """Fetch exchange rates and store them in the rate store, if one is
+        available"""
+        rates = self._fetch_rates(start_date, end_date, forex_str)
+        if self._rate_store is not None:
+            self._rate_store.add_rates(forex_str, rates, start_date, end_date)
+        return rates
+
+    def _fetch_rates(self, start_date, end_date, forex_str):
+        """Fetch exchange rates from the supplied URL"""
+        rates = {}
         params = {"start_date": start_date.isoformat(),
                   "end_date": end_date.isoformat()}
         url = "{}/{}/json".format(self.valet_obs_url, forex_str)
+        session = self._session or self.get_default_session()
         response = None
         try:
-            response = requests.get(url=url, params=params)
+            response = session.get(url, params=params)
         except requests.ConnectionError as e:
             raise ClickException(
                 "Error with internet connection to URL {} : {}".format(url, e))
@@ -88,29 +219,31 @@ class ExchangeRate:
             rates[date] = rate
         return rates
 
-    def _fetch_noon_rates(self, start_date, end_date):
-        """Get the historical noon rates from the Bank of Canada"""
+    def _get_noon_rate_range(self, start_date, end_date):
+        """Get the range of historical noon rates to get from the Bank of
+        Canada"""
         if start_date >= self.indicative_rate_min_date:
             # No available noon dates for this date range
-            return {}
+            return None
         if end_date >= self.indicative_rate_min_date:
             # Our date range overlaps with the noon rate and indicative rate
             # boundary
             end_date = self.indicative_rate_min_date - timedelta(days=1)
         forex_str = self.noon_rate_forex_str[self._currency_from]
-        return self._fetch_rates(start_date, end_date, forex_str)
+        return forex_str, start_date, end_date
 
-    def _fetch_indicative_rates(self, start_date, end_date):
-        """Get the indicative rates from the Bank of Canada"""
+    def _get_indicative_rate_range(self, start_date, end_date):
+        """Get the range of indicative rates to get from the Bank of
+        Canada"""
         if end_date < self.indicative_rate_min_date:
             # No available indicative rates for this date range
-            return {}
+            return None
         if start_date < self.indicative_rate_min_date:
             # Our date range overlaps with the noon rate and indicative rate
             # boundary
             start_date = self.indicative_rate_min_date
         forex_str = "FX{}{}".format(self._currency_from, self.currency_to)
-        return self._fetch_rates(start_date, end_date, forex_str)
+        return forex_str, start_date, end_date
 
     def _get_closest_rate_for_day(self, date):
         """Gets the exchange rate for the closest preceeding date with a
@@ -118,10 +251,9 @@ class ExchangeRate:
         """
         if date in self._rates:
             return self._rates[date]
-        dates_preceeding = [d for d in self._rates if d < date]
-        if dates_preceeding:
-            closest_date = min(dates_preceeding, key=lambda d: (date - d))
-            return self._rates[closest_date]
+        idx = bisect_right(self._dates, date)
+        if idx:
+            return self._rates[self._dates[idx - 1]]
         return None
 
     def get_rate(self, date):
@@ -139,3 +271,26 @@ class ExchangeRate:
             raise ClickException(
                 "Unable to find exchange rate on {}".format(date))
         return rate
+
+    def get_rates(self, dates):
+        """Gets the exchange rates for a list of dates, following the same
+        rules as get_rate. The dates are expected to be sorted, in which case
+        they are all resolved in a single pass over the stored rates."""
+        if self._currency_from == self.currency_to:
+            # Converting CAD to CAD
+            return [Decimal(1.00)] * len(dates)
+        rates = []
+        idx = 0
+        last_date = None
+        for date in dates:
+            if last_date is not None and date < last_date:
+                # Out of order, so start again from the closest rate
+                idx = bisect_right(self._dates, date)
+            while idx < len(self._dates) and self._dates[idx] <= date:
+                idx += 1
+            if not idx:
+                raise ClickException(
+                    "Unable to find exchange rate on {}".format(date))
+            rates.append(self._rates[self._dates[idx - 1]])
+            last_date = date
+        return rates
@@ -0,0 +1,172 @@
+import hashlib
+import mmap
+import os
+import pickle
+import tempfile
+import time
+from contextlib import suppress
+
+
+class LedgerCache:
+    """A persistent, on-disk cache of the Transactions parsed from CSV-files,
+    kept alongside the exchange rate cache.
+
+    Each CSV-file has its own cache file, named after its path, that holds a
+    small header with the file's fingerprint (its path, size, modification
+    time and a hash of its contents) followed by its transactions in a
+    ColumnarLedger. Both are pickled, so the cache directory must only be
+    writable by its user. The cache file is memory-mapped when it is loaded,
+    and it is only used while the CSV-file still has the same fingerprint, or
+    while its cached size is still a prefix of it. Brokers only ever append
+    entries to the end of their CSV-files, so those are the only entries
+    that need to be read.
+
+    A cache file is touched whenever it is used, and the cache files that
+    weren't used for max_age seconds are deleted whenever a file is cached,
+    so that the cache files of CSV-files that were moved or deleted don't
+    pile up.
+    """
+    dirname = 'ledgers'
+    # Changed whenever the classes that are pickled change, so that older
+    # cache files are ignored
+    format_version = 1
+    # A file that was modified this many seconds before it was cached could
+    # have been modified again without its modification time changing, so
+    # its contents are always compared
+    racy_seconds = 2
+    # Cache files that weren't used for this many seconds are deleted
+    max_age = 90 * 24 * 60 * 60
+
+    def __init__(self, cache_dir):
+        self._dir = os.path.join(cache_dir, self.dirname)
+        os.makedirs(self._dir, exist_ok=True)
+
+    def _get_path(self, csv_file):
+        name = hashlib.sha256(os.path.abspath(csv_file).encode()).hexdigest()
+        return os.path.join(self._dir, name + '.pickle')
+
+    @staticmethod
+    def _hash_file(csv_file, size=None):
+        """Hash the contents of the file, or only its first size bytes"""
+        file_hash = hashlib.sha256()
+        remaining = size
+        with open(csv_file, 'rb') as f:
+            while remaining is None or remaining > 0:
+                chunk = f.read(1 << 20 if remaining is None else
+                               min(1 << 20, remaining))
+                if not chunk:
+                    break
+                file_hash.update(chunk)
+                if remaining is not None:
+                    remaining -= len(chunk)
+        return file_hash.hexdigest()
+
+    @staticmethod
+    def _ends_entry(csv_file, size):
+        """Whether the first size bytes of the file end with a complete
+        entry, so that the next entry starts right after them"""
+        if not size:
+            return True
+        with open(csv_file, 'rb') as f:
+            f.seek(size - 1)
+            return f.read(1) == b'\n'
+
+    def get_fingerprint(self, csv_file):
+        """Return the fingerprint of the CSV-file, or None if it can't be
+        read"""
+        try:
+            stat = os.stat(csv_file)
+            return {'path': os.path.abspath(csv_file),
+                    'size': stat.st_size,
+                    'mtime_ns': stat.st_mtime_ns,
+                    'hash': self._hash_file(csv_file)}
+        except OSError:
+            return None
+
+    def _get_offset(self, header, csv_file):
+        """Compare the CSV-file with the fingerprint in the header. Return
+        None if it is unchanged, the offset of the entries appended to it
+        if it was only appended to, or False if it changed otherwise."""
+        if (header.get('version') != self.format_version or
+                header.get('path') != os.path.abspath(csv_file)):
+            return False
+        stat = os.stat(csv_file)
+        size = header['size']
+        if stat.st_size < size:
+            return False
+        if stat.st_size > size:
+            if (self._ends_entry(csv_file, size) and
+                    self._hash_file(csv_file, size) == header['hash']):
+                return size
+            return False
+        if (stat.st_mtime_ns == header['mtime_ns'] and
+                stat.st_mtime_ns < header['cached_at_ns'] -
+                self.racy_seconds * 10 ** 9):
+            return None
+        if self._hash_file(csv_file) == header['hash']:
+            return None
+        return False
+
+    def load(self, csv_file):
+        """Return the Transactions cached for the CSV-file and the offset of
+        the entries that were appended to the file since they were cached,
+        which is None if there are none. The Transactions are None if there
+        are none or if the file changed in any other way."""
+        path = self._get_path(csv_file)
+        try:
+            with open(path, 'rb') as f, \
+                    mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                offset = self._get_offset(pickle.load(data), csv_file)
+                if offset is False:
+                    return None, None
+                transactions = pickle.load(data)
+        except Exception:
+            # A cache file that is missing or can't be read is the same as
+            # none at all, it is written again
+            return None, None
+        # Keeps the cache file from being pruned
+        with suppress(OSError):
+            os.utime(path)
+        return transactions, offset
+
+    def save(self, fingerprint, transactions):
+        """Cache the columnar Transactions parsed from the CSV-file with the
+        fingerprint (as returned by get_fingerprint before parsing it). They
+        aren't cached if the file was changed while it was parsed."""
+        csv_file = fingerprint['path']
+        try:
+            stat = os.stat(csv_file)
+        except OSError:
+            return
+        if (stat.st_size != fingerprint['size'] or
+                stat.st_mtime_ns != fingerprint['mtime_ns']):
+            return
+        header = dict(fingerprint, version=self.format_version,
+                      cached_at_ns=time.time_ns())
+        # Written to a temporary file that replaces the cache file once it is
+        # complete, so that it is never read half-written
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self._dir, suffix='.tmp')
+        except OSError:
+            return
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(header, f, pickle.HIGHEST_PROTOCOL)
+                pickle.dump(transactions, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._get_path(csv_file))
+        except OSError:
+            os.unlink(tmp_path)
+            return
+        self.prune()
+
+    def prune(self):
+        """Delete the cache files, and the temporary files left behind by
+        interrupted writes, that weren't used for max_age seconds"""
+        oldest = time.time() - self.max_age
+        with suppress(OSError), os.scandir(self._dir) as entries:
+            for entry in entries:
+                if not entry.name.endswith(('.pickle', '.tmp')):
+                    continue
+                with suppress(OSError):
+                    if entry.stat().st_mtime < oldest:
+                        os.unlink(entry.path)
@@ -0,0 +1,155 @@
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from datetime import date, timedelta
+from decimal import Decimal
+
+
+class RateStore:
+    """A persistent, on-disk store of the exchange rates fetched from the
+    Bank of Canada.
+
+    Alongside the rates themselves, the store keeps track of which date ranges
+    have been fetched for each series so that callers only need to fetch the
+    gaps. The store is backed by SQLite and can safely be shared between
+    several processes.
+    """
+    filename = 'rates.sqlite'
+    # The rates for the last few days may not have been published yet, so the
+    # coverage of these days is only trusted for a short amount of time
+    recent_days = 3
+    recent_ttl = 60 * 60
+    # Seconds to wait on a lock held by another process
+    lock_timeout = 30
+
+    def __init__(self, cache_dir, recent_ttl=None):
+        self._cache_dir = cache_dir
+        self._path = os.path.join(cache_dir, self.filename)
+        if recent_ttl is not None:
+            self.recent_ttl = recent_ttl
+        os.makedirs(cache_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS rates ("
+                "series TEXT NOT NULL, "
+                "date TEXT NOT NULL, "
+                "rate TEXT NOT NULL, "
+                "PRIMARY KEY (series, date))")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS coverage ("
+                "series TEXT NOT NULL, "
+                "start_date TEXT NOT NULL, "
+                "end_date TEXT NOT NULL, "
+                "fetched_at REAL)")
+
+    @property
+    def path(self):
+        return self._path
+
+    @contextmanager
+    def _connect(self):
+        """Open a new connection and commit (or roll back) on exit. A new
+        connection is used for every operation so that the store can be used
+        from several threads and processes at once."""
+        conn = sqlite3.connect(self._path, timeout=self.lock_timeout)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get_rates(self, series, start_date, end_date):
+        """Return all the stored rates for the series between the two dates
+        (inclusive)"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT date, rate FROM rates "
+                "WHERE series = ? AND date >= ? AND date <= ?",
+                (series, start_date.isoformat(), end_date.isoformat()))
+            return {date.fromisoformat(d): Decimal(r) for d, r in rows}
+
+    def get_series(self):
+        """Return the sorted list of series that have rates stored"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT DISTINCT series FROM coverage ORDER BY series")
+            return [series for series, in rows]
+
+    def get_coverage(self, series):
+        """Return the merged list of (start, end) date ranges that have been
+        fetched for the series, regardless of whether they have expired"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT start_date, end_date FROM coverage "
+                "WHERE series = ? ORDER BY start_date", (series,))
+            covered = [(date.fromisoformat(s), date.fromisoformat(e))
+                       for s, e in rows]
+        merged = []
+        for start_date, end_date in covered:
+            if merged and start_date <= merged[-1][1] + timedelta(days=1):
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end_date))
+            else:
+                merged.append((start_date, end_date))
+        return merged
+
+    def missing_ranges(self, series, start_date, end_date, expired_ok=False):
+        """Return the list of (start, end) date ranges between the two dates
+        (inclusive) that have not been fetched for the series yet. If
+        expired_ok is set, the coverage of the last few days is trusted even
+        after its TTL has expired."""
+        expired = 0 if expired_ok else time.time() - self.recent_ttl
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT start_date, end_date FROM coverage "
+                "WHERE series = ? AND start_date <= ? AND end_date >= ? "
+                "AND (fetched_at IS NULL OR fetched_at >= ?) "
+                "ORDER BY start_date",
+                (series, end_date.isoformat(), start_date.isoformat(),
+                 expired))
+            covered = [(date.fromisoformat(s), date.fromisoformat(e))
+                       for s, e in rows]
+        gaps = []
+        gap_start = start_date
+        for covered_start, covered_end in covered:
+            if covered_start > gap_start:
+                gaps.append((gap_start, covered_start - timedelta(days=1)))
+            gap_start = max(gap_start, covered_end + timedelta(days=1))
+            if gap_start > end_date:
+                break
+        if gap_start <= end_date:
+            gaps.append((gap_start, end_date))
+        return gaps
+
+    def add_rates(self, series, rates, start_date, end_date):
+        """Store the rates for the series and record the date range between
+        the two dates (inclusive) as fetched. The expired coverage of recent
+        days within the range is replaced, so that refetching the last few
+        days doesn't add more and more coverage."""
+        # Days before this date will not have their rates change anymore
+        stable_date = date.today() - timedelta(days=self.recent_days)
+        now = time.time()
+        coverage = []
+        if start_date < stable_date:
+            coverage.append((start_date,
+                             min(end_date, stable_date - timedelta(days=1)),
+                             None))
+        if end_date >= stable_date:
+            coverage.append((max(start_date, stable_date), end_date, now))
+        with self._connect() as conn:
+            conn.execute(
+                "DELETE FROM coverage "
+                "WHERE series = ? AND start_date >= ? AND end_date <= ? "
+                "AND fetched_at < ?",
+                (series, start_date.isoformat(), end_date.isoformat(),
+                 now - self.recent_ttl))
+            conn.executemany(
+                "INSERT OR REPLACE INTO rates (series, date, rate) "
+                "VALUES (?, ?, ?)",
+                [(series, d.isoformat(), str(r)) for d, r in rates.items()])
+            conn.executemany(
+                "INSERT INTO coverage (series, start_date, end_date, "
+                "fetched_at) VALUES (?, ?, ?, ?)",
+                [(series, s.isoformat(), e.isoformat(), fetched_at)
+                 for s, e, fetched_at in coverage])
@@ -1,73 +1,215 @@
 from click import ClickException
-from datetime import timedelta
+from datetime import date, timedelta
 from decimal import Decimal
 
+from capgains.transaction import TransactionResult
+
+_zero = Decimal(0.0)
+
+# A loss is superficial if the shares are bought back this many days before
+# or after it
+superficial_loss_days = 30
+
+
+def get_year_end_cutoff(year):
+    """Return the last date whose transactions can change the gains of the
+    year: a loss at the end of the year can be made superficial by a BUY in
+    the first days of the next one"""
+    return date(year, 12, 31) + timedelta(days=superficial_loss_days)
+
+
+def get_rates(transactions, exchange_rates):
+    """Look up the exchange rate of every transaction in the map of
+    currencies to ExchangeRates, resolving the dates of each currency in a
+    single pass"""
+    currency_dates = dict()
+    for t in transactions:
+        currency_dates.setdefault(t.currency, []).append(t.date)
+    currency_rates = {
+        currency: iter(exchange_rates[currency].get_rates(dates))
+        for currency, dates in currency_dates.items()
+    }
+    return [next(currency_rates[t.currency]) for t in transactions]
+
+
+class Checkpoint:
+    """State of a ticker's gains at the end of a year. The gains of the
+    following years can be calculated from it without the transactions up to
+    that year."""
+    __slots__ = ('year', 'share_balance', 'total_acb', 'last_buy_date')
+
+    def __init__(self, year, share_balance, total_acb, last_buy_date=None):
+        self.year = year
+        self.share_balance = share_balance
+        self.total_acb = total_acb
+        # Date of the last BUY up to the end of the year, which can make a
+        # loss early in the next year superficial
+        self.last_buy_date = last_buy_date
+
 
 class TickerGains:
-    def __init__(self, ticker):
+    def __init__(self, ticker, checkpoint=None):
+        """If a Checkpoint is given, the transactions added are the ones that
+        follow the checkpoint's year."""
         self._ticker = ticker
-        self._share_balance = 0
-        self._total_acb = 0
+        self._share_balance = _zero
+        self._total_acb = _zero
+        self._last_buy_date = None
+        if checkpoint is not None:
+            self._share_balance = checkpoint.share_balance
+            self._total_acb = checkpoint.total_acb
+            self._last_buy_date = checkpoint.last_buy_date
+        self._checkpoints = list()
+
+    @property
+    def checkpoints(self):
+        """Return the Checkpoints of the year ends that were crossed while
+        adding transactions"""
+        return list(self._checkpoints)
 
     def add_transactions(self, transactions, exchange_rates):
-        """Adds all transactions and updates the calculated values"""
-        for t in transactions:
-            rate = exchange_rates[t.currency].get_rate(t.date)
-            t.exchange_rate = rate
-            self._add_transaction(t)
-            if self._is_superficial_loss(t, transactions):
-                self._total_acb -= t.capital_gain
+        """Adds all transactions and updates the calculated values. The
+        transactions must be in chronological order."""
+        rates = get_rates(transactions, exchange_rates)
+        year_ends, last_buy_date = self._get_year_ends(transactions)
+        self._add_transactions(transactions, rates, year_ends)
+        self._last_buy_date = last_buy_date
+
+    def _add_transactions(self, transactions, rates, year_ends):
+        """Adds all transactions with their exchange rates, saving a
+        checkpoint after each of the positions in year_ends"""
+        window = _SuperficialLossWindow(transactions,
+                                        last_buy_date=self._last_buy_date)
+        for idx, (t, rate) in enumerate(zip(transactions, rates)):
+            self._add_transaction(t, rate)
+            if self._is_superficial_loss(t, idx, window):
+                self._total_acb -= t.result.capital_gain
                 t.set_superficial_loss()
+            if idx in year_ends:
+                self._add_checkpoint(year_ends[idx], self._share_balance,
+                                     self._total_acb)
+
+    def _get_year_ends(self, transactions):
+        """Find the positions of the transactions that are followed by one in
+        a later year. Returns a map of each position to the (year, date of the
+        last BUY) of its checkpoint, along with the date of the last BUY of
+        all the transactions. The checkpoint is for the year before the next
+        transaction, since no transaction changes the state until then."""
+        year_ends = dict()
+        last_buy_date = self._last_buy_date
+        last_year = None
+        for idx, t in enumerate(transactions):
+            year = t.date.year
+            if last_year is not None and year != last_year:
+                year_ends[idx - 1] = (year - 1, last_buy_date)
+            last_year = year
+            if t.action == 'BUY':
+                last_buy_date = t.date
+        return year_ends, last_buy_date
 
-    def _superficial_window_filter(self, transaction, min_date, max_date):
-        """Filter out BUY transactions that fall within
-        the 61 day superficial loss window"""
-        return transaction.date >= min_date and transaction.date <= max_date
+    def _add_checkpoint(self, year_end, share_balance, total_acb):
+        year, last_buy_date = year_end
+        self._checkpoints.append(Checkpoint(year, share_balance, total_acb,
+                                            last_buy_date))
 
-    def _is_superficial_loss(self, transaction, transactions):
-        """Figures out if the transaction is a superficial loss"""
+    def _is_superficial_loss(self, transaction, idx, window):
+        """Figures out if the transaction at position idx is a superficial
+        loss"""
         # Has to be a capital loss
-        if (transaction.capital_gain >= 0):
+        if (transaction.result.capital_gain >= 0):
             return False
-        min_date = transaction.date - timedelta(days=30)
-        max_date = transaction.date + timedelta(days=30)
-        filtered_transactions = list(filter(
-            lambda t: self._superficial_window_filter(t, min_date, max_date),
-            transactions))
+        window.slide_to(transaction.date)
         # Has to have a purchase either 30 days before or 30 days after
-        if (not any(t.action == 'BUY' for t in filtered_transactions)):
+        if not window.has_buy():
             return False
         # Has to have a positive share balance after 30 days
-        transaction_idx = filtered_transactions.index(transaction)
-        balance = transaction._share_balance
-        for window_transaction in filtered_transactions[transaction_idx+1:]:
-            if window_transaction.action == 'SELL':
-                balance -= window_transaction.qty
-            else:
-                balance += window_transaction.qty
+        balance = (transaction.result.share_balance +
+                   window.share_change_after(idx))
         return balance > 0
 
-    def _add_transaction(self, transaction):
-        """Adds a transaction and updates the calculated values."""
+    def _add_transaction(self, transaction, exchange_rate):
+        """Adds a transaction and records the calculated values in its
+        result."""
+        if type(exchange_rate) is not Decimal:
+            exchange_rate = Decimal(exchange_rate)
         if self._share_balance == 0:
             # to prevent divide by 0 error
             old_acb_per_share = 0
         else:
             old_acb_per_share = self._total_acb / self._share_balance
-        proceeds = (transaction.qty * transaction.price) * transaction.exchange_rate  # noqa: E501
+        qty = transaction.qty
+        proceeds = (qty * transaction.price) * exchange_rate
+        expenses = transaction.commission * exchange_rate
         if transaction.action == 'SELL':
-            self._share_balance -= transaction.qty
-            acb = old_acb_per_share * transaction.qty
-            capital_gain = proceeds - transaction.expenses - acb
+            self._share_balance -= qty
+            acb = old_acb_per_share * qty
+            capital_gain = proceeds - expenses - acb
             self._total_acb -= acb
         else:
-            self._share_balance += transaction.qty
-            acb = proceeds + transaction.expenses
-            capital_gain = Decimal(0.0)
+            self._share_balance += qty
+            acb = proceeds + expenses
+            capital_gain = _zero
             self._total_acb += acb
         if self._share_balance < 0:
             raise ClickException("Transaction caused negative share balance")
-        transaction.share_balance = self._share_balance
-        transaction.proceeds = proceeds
-        transaction.capital_gain = capital_gain
-        transaction.acb = acb
+        transaction.result = TransactionResult(exchange_rate,
+                                               self._share_balance,
+                                               proceeds, capital_gain, acb,
+                                               expenses)
+
+
+class _SuperficialLossWindow:
+    """Follows the 61 day superficial loss window as it slides forward over a
+    list of transactions in chronological order. Prefix sums of the number of
+    BUYs and of the share balance changes, along with two pointers marking the
+    start and end of the window, answer every question about the window in
+    amortized O(1)."""
+
+    def __init__(self, transactions, last_buy_date=None):
+        """The date of the last BUY before the transactions, if any, is also
+        part of the window."""
+        self._last_buy_date = last_buy_date
+        self._min_date = None
+        self._dates = []
+        # Number of BUYs and net change in shares before each position
+        self._buy_counts = [0]
+        self._share_changes = [0]
+        for t in transactions:
+            if self._dates and t.date < self._dates[-1]:
+                raise ClickException(
+                    "Transactions were not entered in chronological order")
+            self._dates.append(t.date)
+            self._buy_counts.append(self._buy_counts[-1] +
+                                    (t.action == 'BUY'))
+            if t.action == 'SELL':
+                self._share_changes.append(self._share_changes[-1] - t.qty)
+            else:
+                self._share_changes.append(self._share_changes[-1] + t.qty)
+        # First position inside the window, and first position past it
+        self._start = 0
+        self._end = 0
+
+    def slide_to(self, date):
+        """Move the window so that it is centered on the date. The window can
+        only move forward."""
+        min_date = self._min_date = date - timedelta(
+            days=superficial_loss_days)
+        max_date = date + timedelta(days=superficial_loss_days)
+        while (self._start < len(self._dates) and
+               self._dates[self._start] < min_date):
+            self._start += 1
+        while (self._end < len(self._dates) and
+               self._dates[self._end] <= max_date):
+            self._end += 1
+
+    def has_buy(self):
+        """Whether there is a BUY in the window"""
+        if self._buy_counts[self._end] > self._buy_counts[self._start]:
+            return True
+        return (self._last_buy_date is not None and
+                self._last_buy_date >= self._min_date)
+
+    def share_change_after(self, idx):
+        """Net change in shares from the transactions in the window that come
+        after position idx"""
+        return self._share_changes[self._end] - self._share_changes[idx + 1]
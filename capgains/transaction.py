@@ -1,112 +1,139 @@
+from datetime import date
 from decimal import Decimal
 
+_zero = Decimal(0.0)
 
-class Transaction:
-    """Represents a transaction entry from the CSV-file"""
 
-    def __init__(self, date, description, ticker, action, qty, price,
-                 commission, currency):
-        self._date = date
-        self._description = description
-        self._ticker = ticker
-        self._action = action
-        self._qty = Decimal(qty)
-        self._price = Decimal(price)
-        self._commission = Decimal(commission)
-        self._currency = currency
-        self._exchange_rate = None
-        self._share_balance = Decimal(0.0)
-        self._proceeds = Decimal(0.0)
-        self._capital_gain = Decimal(0.0)
-        self._acb = Decimal(0.0)
-        self._superficial_loss = False
+class TransactionResult:
+    """Holds the values calculated for a transaction. The expenses are
+    calculated once, when the exchange rate is known."""
+    __slots__ = ('exchange_rate', 'share_balance', 'proceeds', 'capital_gain',
+                 'acb', 'expenses', 'superficial_loss')
 
-    @property
-    def date(self):
-        return self._date
+    def __init__(self, exchange_rate=None, share_balance=_zero,
+                 proceeds=_zero, capital_gain=_zero, acb=_zero,
+                 expenses=None, superficial_loss=False):
+        self.exchange_rate = exchange_rate
+        self.share_balance = share_balance
+        self.proceeds = proceeds
+        self.capital_gain = capital_gain
+        self.acb = acb
+        self.expenses = expenses
+        self.superficial_loss = superficial_loss
 
-    @property
-    def description(self):
-        return self._description
-
-    @property
-    def ticker(self):
-        return self._ticker
-
-    @property
-    def action(self):
-        return self._action
 
-    @property
-    def qty(self):
-        return self._qty
+# Result of a transaction that nothing was calculated for yet. It is shared,
+# so it is never changed.
+_no_result = TransactionResult()
 
-    @property
-    def price(self):
-        return self._price
 
-    @property
-    def commission(self):
-        return self._commission
+class Transaction:
+    """Represents a transaction entry from the CSV-file. The values read from
+    the CSV-file are not meant to be changed, the values calculated for the
+    transaction are kept in its TransactionResult."""
+    __slots__ = ('date', 'description', 'ticker', 'action', 'qty', 'price',
+                 'commission', 'currency', 'result')
 
-    @property
-    def currency(self):
-        return self._currency
+    def __init__(self, date, description, ticker, action, qty, price,
+                 commission, currency):
+        self.date = date
+        self.description = description
+        self.ticker = ticker
+        self.action = action
+        # Values that are already Decimals (such as the ones parsed by the
+        # TransactionsReader) don't need to be constructed again
+        self.qty = qty if type(qty) is Decimal else Decimal(qty)
+        self.price = price if type(price) is Decimal else Decimal(price)
+        self.commission = (commission if type(commission) is Decimal
+                           else Decimal(commission))
+        self.currency = currency
+        self.result = _no_result
+
+    def __reduce__(self):
+        # The default pickling of __slots__, Decimals and dates is slow, so
+        # the date is pickled as its ordinal and the Decimals as strings. The
+        # result is only kept if something was calculated for the
+        # transaction.
+        args = (self.date.toordinal(), self.description, self.ticker,
+                self.action, str(self.qty), str(self.price),
+                str(self.commission), self.currency)
+        if self.result is _no_result:
+            return (_unpickle_transaction, args)
+        return (_unpickle_transaction, args, (None, {'result': self.result}))
+
+    def _get_result(self):
+        """Return the transaction's own result, so that it can be changed"""
+        if self.result is _no_result:
+            self.result = TransactionResult()
+        return self.result
 
     @property
     def exchange_rate(self):
-        return self._exchange_rate
+        return self.result.exchange_rate
 
     @exchange_rate.setter
     def exchange_rate(self, exchange_rate):
-        self._exchange_rate = Decimal(exchange_rate)
+        result = self._get_result()
+        result.exchange_rate = Decimal(exchange_rate)
+        result.expenses = self.commission * result.exchange_rate
 
     @property
     def share_balance(self):
-        return self._share_balance
+        return self.result.share_balance
 
     @share_balance.setter
     def share_balance(self, share_balance):
         if (share_balance < 0):
             raise ValueError("Share balance cannot be negative")
-        self._share_balance = Decimal(share_balance)
+        self._get_result().share_balance = Decimal(share_balance)
 
     @property
     def proceeds(self):
-        return self._proceeds
+        return self.result.proceeds
 
     @proceeds.setter
     def proceeds(self, proceeds):
-        self._proceeds = Decimal(proceeds)
+        self._get_result().proceeds = Decimal(proceeds)
 
     @property
     def capital_gain(self):
-        return self._capital_gain
+        return self.result.capital_gain
 
     @capital_gain.setter
     def capital_gain(self, capital_gain):
-        self._capital_gain = Decimal(capital_gain)
+        self._get_result().capital_gain = Decimal(capital_gain)
 
     @property
     def acb(self):
-        return self._acb
+        return self.result.acb
 
     @acb.setter
     def acb(self, acb):
-        self._acb = Decimal(acb)
+        self._get_result().acb = Decimal(acb)
 
     @property
     def superficial_loss(self):
-        return self._superficial_loss
+        return self.result.superficial_loss
 
     @superficial_loss.setter
     def superficial_loss(self, superficial_loss):
-        self._superficial_loss = Decimal(superficial_loss)
+        self._get_result().superficial_loss = bool(superficial_loss)
 
     @property
     def expenses(self):
-        return self.commission * self.exchange_rate
+        expenses = self.result.expenses
+        if expenses is None:
+            return self.commission * self.exchange_rate
+        return expenses
 
     def set_superficial_loss(self):
-        self.superficial_loss = True
-        self.capital_gain = Decimal(0.0)
+        result = self._get_result()
+        result.superficial_loss = True
+        result.capital_gain = _zero
+
+
+def _unpickle_transaction(ordinal, description, ticker, action, qty, price,
+                          commission, currency):
+    return Transaction(date.fromordinal(ordinal), description, ticker, action,
+                       Decimal(qty), Decimal(price), Decimal(commission),
+                       currency)
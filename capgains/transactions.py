@@ -1,21 +1,74 @@
+import heapq
+from array import array
+
+from .columnar_ledger import ColumnarLedger
+
+
+def _get_currency_date_ranges(transactions):
+    """Return a map of each currency of the transactions to the [first,
+    last] dates of its transactions"""
+    ranges = dict()
+    for t in transactions:
+        date_range = ranges.get(t.currency)
+        if date_range is None:
+            ranges[t.currency] = [t.date, t.date]
+        elif t.date < date_range[0]:
+            date_range[0] = t.date
+        elif t.date > date_range[1]:
+            date_range[1] = t.date
+    return ranges
+
+
 class Transactions:
-    """Holds a collection of transactions"""
+    """Holds a collection of transactions. If columnar is set the
+    transactions are kept in a ColumnarLedger, which uses much less memory but
+    creates the transactions every time they are accessed."""
 
-    def __init__(self, transactions):
-        self._transactions = list()
+    def __init__(self, transactions, columnar=False):
+        self._transactions = ColumnarLedger() if columnar else list()
+        self._last_date = None
+        # Indexes mapping a ticker or an action to the positions of its
+        # transactions
         self._tickers = dict()
-        for transaction in transactions:
-            self.add_transaction(transaction)
+        self._actions = dict()
+        # Index mapping a year to the [start, stop) range of positions of its
+        # transactions. This is only possible while the transactions are added
+        # in chronological order, and is dropped as soon as they are not.
+        self._years = dict()
+        self._sorted_tickers = list()
+        self._add_transactions(transactions)
 
     @property
     def transactions(self):
         """Return all the stored transactions"""
         return self._transactions
 
+    @property
+    def columnar(self):
+        """Whether the transactions are kept in a ColumnarLedger"""
+        return isinstance(self._transactions, ColumnarLedger)
+
+    @property
+    def last_date(self):
+        """Return the date of the last transaction added, or None if there
+        are none"""
+        return self._last_date
+
     @property
     def tickers(self):
         """Return all the unique tickers in this collection of transactions."""
-        return sorted(self._tickers.keys())
+        if self._sorted_tickers is None:
+            self._sorted_tickers = sorted(self._tickers.keys())
+        return list(self._sorted_tickers)
+
+    @property
+    def currency_date_ranges(self):
+        """Return a map of each currency to the [first, last] dates of its
+        transactions"""
+        if self.columnar:
+            return self.transactions.get_currency_date_ranges(
+                range(len(self)))
+        return _get_currency_date_ranges(self)
 
     def __len__(self):
         return len(self.transactions)
@@ -28,31 +81,215 @@ class Transactions:
 
     def add_transaction(self, transaction):
         """Add a transaction to the list of stored transactions."""
-        self.transactions.append(transaction)
+        self._add_transactions((transaction,))
 
-        ticker_refcount = self._tickers.get(transaction.ticker, 0)
-        ticker_refcount += 1
-        self._tickers[transaction.ticker] = ticker_refcount
+    def _add_transactions(self, transactions):
+        """Add the transactions one after the other, updating the indexes.
+        The attributes are looked up once for all of them."""
+        stored = self._transactions
+        tickers = self._tickers
+        actions = self._actions
+        position = len(stored)
+        for transaction in transactions:
+            stored.append(transaction)
+
+            ticker_positions = tickers.get(transaction.ticker)
+            if ticker_positions is None:
+                ticker_positions = tickers[transaction.ticker] = array('q')
+                self._sorted_tickers = None
+            ticker_positions.append(position)
+
+            action_positions = actions.get(transaction.action)
+            if action_positions is None:
+                action_positions = actions[transaction.action] = array('q')
+            action_positions.append(position)
+
+            day = transaction.date
+            if self._years is not None:
+                if position and day < self._last_date:
+                    self._years = None
+                else:
+                    year_range = self._years.get(day.year)
+                    if year_range is None:
+                        self._years[day.year] = [position, position + 1]
+                    else:
+                        year_range[1] = position + 1
+            self._last_date = day
+            position += 1
+
+    def _get_candidate_positions(self, tickers, year, max_year, action):
+        """Use the indexes to find the smallest sorted list of positions
+        that can match the filter parameters"""
+        candidates = [range(len(self))]
+        if tickers:
+            ticker_positions = [self._tickers[ticker] for ticker in
+                                set(tickers) if ticker in self._tickers]
+            if len(ticker_positions) == 1:
+                candidates.append(ticker_positions[0])
+            else:
+                candidates.append(
+                    array('q', heapq.merge(*ticker_positions)))
+        if action:
+            candidates.append(self._actions.get(action, array('q')))
+        if self._years is not None:
+            if year:
+                candidates.append(range(*self._years.get(year, [0, 0])))
+            if max_year:
+                stop = max([year_range[1] for y, year_range in
+                            self._years.items() if y <= max_year] or [0])
+                candidates.append(range(stop))
+        return min(candidates, key=len)
+
+    def group_by_ticker(self):
+        """Split the stored transactions by ticker. Returns a map of each
+        ticker to a view of its transactions, kept in their original
+        order."""
+        return {ticker: TransactionsView(self, tickers=[ticker])
+                for ticker in self._tickers}
 
     def filter_by(self, tickers=None, year=None, max_year=None, action=None,
                   superficial_loss=None):
         """Filter the list of stored transactions on certain parameters (such
         as ticker, year, etc) and return only the transactions that match the
-        requested parameters.
+        requested parameters. The filtering is lazy: a view is returned and
+        the matching transactions are only looked up when it is first used.
         """
-        def lambda_filter(t):
-            keep = True
-            if tickers:
-                keep &= (t.ticker in tickers)
-            if year:
-                keep &= (t.date.year == year)
-            if max_year:
-                keep &= (t.date.year <= max_year)
-            if action:
-                keep &= (t.action == action)
-            if superficial_loss is not None:
-                # superficial_loss can be set to False, so need to explicitly
-                # check that it is not set to None
-                keep &= (t.superficial_loss == superficial_loss)
-            return keep
-        return Transactions(filter(lambda_filter, self.transactions))
+        return TransactionsView(self, tickers, year, max_year, action,
+                                superficial_loss)
+
+
+class TransactionsView:
+    """A lazy, read-only view of the transactions in a Transactions collection
+    that match some filter parameters.
+
+    Nothing is copied when a view is created. Filtering a view returns a new
+    view over the same collection that combines the filter parameters, so
+    that chained filters run as a single pass over the smallest candidate set
+    found in the collection's indexes. The matching positions are looked up
+    on first use and kept from then on.
+    """
+
+    def __init__(self, source, tickers=None, year=None, max_year=None,
+                 action=None, superficial_loss=None):
+        self._source = source
+        self._tickers = set(tickers) if tickers else None
+        self._year = year or None
+        self._max_year = max_year or None
+        self._action = action or None
+        self._superficial_loss = superficial_loss
+        # Set when the combined filter parameters can never match
+        self._empty = False
+        self._positions = None
+
+    def _get_positions(self):
+        if self._positions is not None:
+            return self._positions
+        self._positions = array('q')
+        if self._empty:
+            return self._positions
+        tickers = self._tickers
+        year = self._year
+        max_year = self._max_year
+        action = self._action
+        superficial_loss = self._superficial_loss
+        transactions = self._source.transactions
+        candidates = self._source._get_candidate_positions(tickers, year,
+                                                           max_year, action)
+        if self._source.columnar:
+            self._positions = transactions.filter_positions(
+                candidates, tickers, year, max_year, action, superficial_loss)
+            return self._positions
+        for p in candidates:
+            t = transactions[p]
+            if tickers is not None and t.ticker not in tickers:
+                continue
+            if year is not None and t.date.year != year:
+                continue
+            if max_year is not None and t.date.year > max_year:
+                continue
+            if action is not None and t.action != action:
+                continue
+            if (superficial_loss is not None and
+                    t.superficial_loss != superficial_loss):
+                continue
+            self._positions.append(p)
+        return self._positions
+
+    @property
+    def transactions(self):
+        """Return all the transactions in the view as a new list"""
+        return list(self)
+
+    @property
+    def columnar(self):
+        """Whether the viewed transactions are kept in a ColumnarLedger"""
+        return self._source.columnar
+
+    @property
+    def tickers(self):
+        """Return all the unique tickers in the view."""
+        if self.columnar:
+            return self._source.transactions.get_tickers(
+                self._get_positions())
+        return sorted(set(t.ticker for t in self))
+
+    @property
+    def currency_date_ranges(self):
+        """Return a map of each currency in the view to the [first, last]
+        dates of its transactions"""
+        if self.columnar:
+            return self._source.transactions.get_currency_date_ranges(
+                self._get_positions())
+        return _get_currency_date_ranges(self)
+
+    def __len__(self):
+        return len(self._get_positions())
+
+    def __iter__(self):
+        if self.columnar:
+            return self._source.transactions.iter_rows(self._get_positions())
+        return map(self._source.transactions.__getitem__,
+                   self._get_positions())
+
+    def __getitem__(self, x):
+        if isinstance(x, slice):
+            return [self._source[p] for p in self._get_positions()[x]]
+        return self._source[self._get_positions()[x]]
+
+    def group_by_ticker(self):
+        """Split the transactions in the view by ticker. Returns a map of each
+        ticker to a view of its transactions, kept in their original
+        order."""
+        return {ticker: self.filter_by(tickers=[ticker])
+                for ticker in self.tickers}
+
+    def filter_by(self, tickers=None, year=None, max_year=None, action=None,
+                  superficial_loss=None):
+        """Filter the transactions in the view, returning a new view that
+        combines these filter parameters with the view's own."""
+        view = TransactionsView(self._source, self._tickers, self._year,
+                                self._max_year, self._action,
+                                self._superficial_loss)
+        view._empty = self._empty
+        if tickers:
+            if view._tickers is None:
+                view._tickers = set(tickers)
+            else:
+                view._tickers &= set(tickers)
+                view._empty |= not view._tickers
+        if max_year:
+            view._max_year = min(max_year, view._max_year or max_year)
+        for name, value in (('_year', year or None),
+                            ('_action', action or None),
+                            ('_superficial_loss', superficial_loss)):
+            if value is None:
+                continue
+            if getattr(view, name) not in (None, value):
+                view._empty = True
+            setattr(view, name, value)
+        return view
+
+    def materialize(self):
+        """Copy the transactions in the view into a new Transactions
+        collection"""
+        return Transactions(self)
@@ -1,7 +1,12 @@
 import csv
+import heapq
+import os
+import tempfile
 from click import ClickException
-from datetime import datetime
+from datetime import date, datetime
 from decimal import Decimal, InvalidOperation
+from itertools import chain, islice
+from operator import attrgetter
 
 from .transaction import Transaction
 from .transactions import Transactions
@@ -23,16 +28,279 @@ class TransactionsReader:
     ]
 
     @classmethod
-    def get_transactions(cls, csv_file):
-        """Convert the CSV-file entries into a list of Transactions."""
-        transactions = []
+    def get_transactions(cls, csv_file, columnar=False, ledger_cache=None):
+        """Convert the CSV-file entries into a list of Transactions. If
+        columnar is set the Transactions are stored column by column to use
+        less memory. If a LedgerCache is given, the Transactions are loaded
+        from it when the CSV-file hasn't changed since they were cached, and
+        cached otherwise. When entries were only appended to the file since
+        then, just those entries are read and added to the cached ones. The
+        cached Transactions are stored column by column, and are returned as
+        they are whether or not columnar is set."""
+        if ledger_cache is None:
+            return Transactions(cls.iter_transactions(csv_file),
+                                columnar=columnar)
+        transactions, offset = ledger_cache.load(csv_file)
+        if transactions is not None and offset is None:
+            return transactions
+        fingerprint = ledger_cache.get_fingerprint(csv_file)
+        if transactions is not None:
+            for transaction in cls.iter_transactions(
+                    csv_file, offset=offset, first_entry_no=len(transactions),
+                    last_date=transactions.last_date):
+                transactions.add_transaction(transaction)
+            if fingerprint is not None:
+                ledger_cache.save(fingerprint, transactions)
+            return transactions
+        transactions = Transactions(cls.iter_transactions(csv_file),
+                                    columnar=columnar)
+        if fingerprint is not None:
+            ledger_cache.save(fingerprint, transactions if columnar else
+                              Transactions(transactions, columnar=True))
+        return transactions
+
+    @classmethod
+    def find_csv_files(cls, paths):
+        """Return the CSV-files at the paths. A path to a directory stands for
+        the CSV-files in it, in order of their names."""
+        csv_files = list()
+        for path in paths:
+            if not os.path.isdir(path):
+                if not os.path.exists(path):
+                    raise ClickException("File not found: {}".format(path))
+                csv_files.append(path)
+                continue
+            names = sorted(name for name in os.listdir(path)
+                           if name.lower().endswith('.csv'))
+            if not names:
+                raise ClickException(
+                    "No CSV-files found in {}".format(path))
+            csv_files.extend(os.path.join(path, name) for name in names)
+        return csv_files
+
+    @classmethod
+    def get_merged_transactions(cls, csv_files, columnar=False,
+                                ledger_cache=None):
+        """Merge the entries of the CSV-files into a single collection of
+        Transactions, in chronological order (see merge). The entries of each
+        file are cached on their own when a LedgerCache is given."""
+        if len(csv_files) == 1:
+            return cls.get_transactions(csv_files[0], columnar=columnar,
+                                        ledger_cache=ledger_cache)
+        if ledger_cache is None:
+            return Transactions(cls.iter_merged_transactions(csv_files),
+                                columnar=columnar)
+        streams = list()
+        for csv_file in csv_files:
+            try:
+                streams.append(cls.get_transactions(
+                    csv_file, columnar=True, ledger_cache=ledger_cache))
+            except ClickException as e:
+                raise cls._get_file_error(csv_file, e)
+        return Transactions(cls.merge(streams), columnar=columnar)
+
+    @classmethod
+    def iter_cached_transactions(cls, csv_files, ledger_cache):
+        """Return the Transactions cached in the LedgerCache for the
+        CSV-files as a single stream, in chronological order (see merge), or
+        None unless every file is cached and unchanged since. Nothing is
+        read from the CSV-files other than to compare them with the cache,
+        and nothing is cached."""
+        streams = list()
+        for csv_file in csv_files:
+            transactions, offset = ledger_cache.load(csv_file)
+            if transactions is None or offset is not None:
+                return None
+            streams.append(transactions)
+        if len(streams) == 1:
+            return iter(streams[0])
+        return cls.merge(streams)
+
+    @classmethod
+    def iter_merged_transactions(cls, csv_files):
+        """Merge the entries of the CSV-files into a single stream of
+        Transactions, in chronological order (see merge). Only one entry of
+        each file is held in memory at a time."""
+        if len(csv_files) == 1:
+            return cls.iter_transactions(csv_files[0])
+        return cls.merge([cls._iter_file_transactions(csv_file)
+                          for csv_file in csv_files])
+
+    @staticmethod
+    def merge(streams):
+        """Lazily merge streams of Transactions that are each in
+        chronological order. Transactions on the same date are kept in the
+        order of their streams, then in their order within each stream."""
+        # heapq.merge yields equal items in the order of their streams
+        return heapq.merge(*streams, key=attrgetter('date'))
+
+    @classmethod
+    def _iter_file_transactions(cls, csv_file, **kwargs):
+        """Same as iter_transactions, with the file in the error messages"""
+        try:
+            yield from cls.iter_transactions(csv_file, **kwargs)
+        except ClickException as e:
+            raise cls._get_file_error(csv_file, e)
+
+    # Approximate number of bytes that a Transaction takes in memory, used to
+    # keep the runs of the external sort within its memory budget
+    transaction_size = 500
+    # Default memory budget of the external sort, in bytes
+    sort_memory = 256 * 2 ** 20
+    # Number of runs merged at once, which bounds the number of files open
+    # while sorting
+    max_merge_runs = 64
+
+    @classmethod
+    def get_sorted_transactions(cls, csv_files, columnar=False, memory=None):
+        """Same as get_merged_transactions, for CSV-files whose entries don't
+        need to be in chronological order (see iter_sorted_transactions)"""
+        return Transactions(cls.iter_sorted_transactions(csv_files, memory),
+                            columnar=columnar)
+
+    @classmethod
+    def iter_sorted_transactions(cls, csv_files, memory=None):
+        """Read the entries of the CSV-files, which don't need to be in
+        chronological order, as a stream of Transactions sorted by date.
+
+        This is an external merge sort. The entries are read in runs that fit
+        in the memory budget (in bytes), and if they don't all fit in one
+        run, each run is sorted and written to a temporary CSV-file. The runs
+        are then merged as they are read back, at most max_merge_runs at a
+        time: while there are more runs than that, each group of consecutive
+        runs is merged into a longer run first. The sort is stable:
+        transactions on the same date are kept in the order of their files,
+        then in their order within each file, the same as
+        iter_merged_transactions does.
+        """
+        run_length = max(1, (memory or cls.sort_memory) //
+                         cls.transaction_size)
+        if len(csv_files) == 1:
+            transactions = cls.iter_transactions(csv_files[0],
+                                                 check_order=False)
+        else:
+            transactions = chain.from_iterable(
+                cls._iter_file_transactions(csv_file, check_order=False)
+                for csv_file in csv_files)
+        get_date = attrgetter('date')
+        with tempfile.TemporaryDirectory(prefix='capgains-sort-') as run_dir:
+            run_files = list()
+            run = list(islice(transactions, run_length))
+            while run:
+                # list.sort is stable, so entries on the same date stay in
+                # their order
+                run.sort(key=get_date)
+                if not run_files and len(run) < run_length:
+                    # Everything fits in memory
+                    yield from run
+                    return
+                run_files.append(cls._write_run(run_dir, len(run_files),
+                                                run))
+                run.clear()
+                run = list(islice(transactions, run_length))
+            run_count = len(run_files)
+            while len(run_files) > cls.max_merge_runs:
+                merged_run_files = list()
+                for i in range(0, len(run_files), cls.max_merge_runs):
+                    group = run_files[i:i + cls.max_merge_runs]
+                    merged_run_files.append(cls._write_run(
+                        run_dir, run_count, cls._merge_runs(group)))
+                    run_count += 1
+                    for run_file in group:
+                        os.remove(run_file)
+                run_files = merged_run_files
+            yield from cls._merge_runs(run_files)
+
+    @classmethod
+    def _merge_runs(cls, run_files):
+        """Merge the transactions of the sorted runs. heapq.merge yields
+        equal items in the order of their runs, which are kept in the order
+        the entries were read."""
+        return heapq.merge(*[cls.iter_transactions(run_file)
+                             for run_file in run_files],
+                           key=attrgetter('date'))
+
+    @classmethod
+    def _write_run(cls, run_dir, run_no, run):
+        """Write the sorted run to a CSV-file in the run directory and return
+        its path"""
+        path = os.path.join(run_dir, "run{}.csv".format(run_no))
+        with open(path, 'w', newline='') as f:
+            csv.writer(f).writerows(
+                (t.date.isoformat(), t.description, t.ticker, t.action,
+                 str(t.qty), str(t.price), str(t.commission), t.currency)
+                for t in run)
+        return path
+
+    @staticmethod
+    def _get_file_error(csv_file, e):
+        return ClickException("{}: {}".format(csv_file, e.message))
+
+    # Positions of the columns in each entry
+    date_idx = columns.index("date")
+    description_idx = columns.index("description")
+    ticker_idx = columns.index("ticker")
+    action_idx = columns.index("action")
+    qty_idx = columns.index("qty")
+    price_idx = columns.index("price")
+    commission_idx = columns.index("commission")
+    currency_idx = columns.index("currency")
+    # Number of distinct date strings to remember before starting over
+    max_memoized_dates = 100000
+
+    @classmethod
+    def _parse_date(cls, date_str):
+        """Parse the YYYY-MM-DD date at the start of the string"""
+        day_str = date_str.split(" ")[0]
+        if len(day_str) == 10 and day_str[4] == day_str[7] == "-":
+            # Fast path for dates that are fully zero-padded
+            return date.fromisoformat(day_str)
+        return datetime.strptime(day_str, '%Y-%m-%d').date()
+
+    @staticmethod
+    def _parse_decimal(value_str, name):
+        try:
+            return Decimal(value_str)
+        except InvalidOperation:
+            raise ClickException(
+                "The {} entered {} is not a valid number"
+                .format(name, value_str))
+
+    @classmethod
+    def iter_transactions(cls, csv_file, offset=0, first_entry_no=0,
+                          last_date=None, check_order=True):
+        """Convert the CSV-file entries into Transactions one at a time, so
+        that the whole file never needs to be held in memory. Each entry is
+        validated before it is yielded, and unless check_order is unset, the
+        entries must be in chronological order.
+
+        To read only part of the file, offset is the position of the byte
+        that the first entry to read starts at, first_entry_no is that
+        entry's number and last_date is the date of the entry before it."""
+        expected_num_columns = len(cls.columns)
+        date_idx = cls.date_idx
+        description_idx = cls.description_idx
+        ticker_idx = cls.ticker_idx
+        action_idx = cls.action_idx
+        qty_idx = cls.qty_idx
+        price_idx = cls.price_idx
+        commission_idx = cls.commission_idx
+        currency_idx = cls.currency_idx
+        parse_decimal = cls._parse_decimal
+        # Trades cluster on the same days, so every distinct date string is
+        # only parsed once
+        dates = dict()
+        # The ticker, action and currency repeat on almost every entry, so
+        # they are shared between transactions. Descriptions are often unique
+        # to their entry, and aren't kept, so that memory stays constant.
+        strings = dict()
+        intern = strings.setdefault
         try:
             with open(csv_file, newline='') as f:
+                f.seek(offset)
                 reader = csv.reader(f)
-                last_date = None
-                for entry_no, entry in enumerate(reader):
+                for entry_no, entry in enumerate(reader, first_entry_no):
                     actual_num_columns = len(entry)
-                    expected_num_columns = len(cls.columns)
                     if actual_num_columns != expected_num_columns:
                         # Each line in the CSV file should have the same number
                         # of columns as we expect
@@ -41,48 +309,37 @@ class TransactionsReader:
                             .format(entry_no,
                                     expected_num_columns,
                                     actual_num_columns))
-                    date_idx = cls.columns.index("date")
                     date_str = entry[date_idx]
-                    try:
-                        entry[date_idx] = datetime.strptime(
-                            date_str.split(" ")[0],
-                            '%Y-%m-%d').date()
-                    except ValueError:
-                        raise ClickException(
-                            "The date ({}) was not entered in the correct format (YYYY-MM-DD)"  # noqa: E501
-                            .format(date_str))
-                    qty_idx = cls.columns.index("qty")
-                    qty_str = entry[qty_idx]
-                    try:
-                        entry[qty_idx] = Decimal(qty_str)
-                    except InvalidOperation:
-                        raise ClickException(
-                            "The quantity entered {} is not a valid number"
-                            .format(qty_str))
-                    price_idx = cls.columns.index("price")
-                    price_str = entry[price_idx]
-                    try:
-                        entry[price_idx] = Decimal(price_str)
-                    except InvalidOperation:
-                        raise ClickException(
-                            "The price entered {} is not a valid number"
-                            .format(price_str))
-                    commission_idx = cls.columns.index("commission")
-                    commission_str = entry[commission_idx]
-                    try:
-                        entry[commission_idx] = Decimal(commission_str)
-                    except InvalidOperation:
-                        raise ClickException(
-                            "The commission entered {} is not a valid number"
-                            .format(commission_str))
-                    transaction = Transaction(*entry)
-                    if last_date:
-                        if transaction.date < last_date:
+                    day = dates.get(date_str)
+                    if day is None:
+                        try:
+                            day = cls._parse_date(date_str)
+                        except ValueError:
                             raise ClickException(
-                                "Transactions were not entered in chronological order")  # noqa: E501
-                    last_date = transaction.date
-                    transactions.append(transaction)
-            return Transactions(transactions)
+                                "The date ({}) was not entered in the correct format (YYYY-MM-DD)"  # noqa: E501
+                                .format(date_str))
+                        if len(dates) >= cls.max_memoized_dates:
+                            dates.clear()
+                        dates[date_str] = day
+                    qty = parse_decimal(entry[qty_idx], "quantity")
+                    price = parse_decimal(entry[price_idx], "price")
+                    commission = parse_decimal(entry[commission_idx],
+                                               "commission")
+                    if check_order and last_date and day < last_date:
+                        raise ClickException(
+                            "Transactions were not entered in chronological order")  # noqa: E501
+                    last_date = day
+                    yield Transaction(day,
+                                      entry[description_idx],
+                                      intern(entry[ticker_idx],
+                                             entry[ticker_idx]),
+                                      intern(entry[action_idx],
+                                             entry[action_idx]),
+                                      qty,
+                                      price,
+                                      commission,
+                                      intern(entry[currency_idx],
+                                             entry[currency_idx]))
         except FileNotFoundError:
             raise ClickException("File not found: {}".format(csv_file))
         except OSError:
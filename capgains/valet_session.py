@@ -0,0 +1,83 @@
+import random
+import requests
+import threading
+import time
+
+
+class ValetSession:
+    """A pooled HTTP session used to make requests to the Bank of Canada Valet
+    API.
+
+    Connections are kept alive between requests, every request is given a
+    connect and read timeout, and responses that are rate limited (429) or
+    that failed on the server (5xx) are retried with an exponential backoff
+    and jitter. The session also counts the requests it makes and how long
+    they took.
+    """
+    connect_timeout = 5
+    read_timeout = 30
+    max_retries = 4
+    backoff_factor = 0.5
+    max_backoff = 30
+    retry_statuses = (429, 500, 502, 503, 504)
+    pool_size = 8
+
+    def __init__(self, connect_timeout=None, read_timeout=None,
+                 max_retries=None, backoff_factor=None):
+        if connect_timeout is not None:
+            self.connect_timeout = connect_timeout
+        if read_timeout is not None:
+            self.read_timeout = read_timeout
+        if max_retries is not None:
+            self.max_retries = max_retries
+        if backoff_factor is not None:
+            self.backoff_factor = backoff_factor
+        self._session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1,
+                                                pool_maxsize=self.pool_size)
+        self._session.mount('https://', adapter)
+        self._session.mount('http://', adapter)
+        self._lock = threading.Lock()
+        self.request_count = 0
+        self.retry_count = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def _record_request(self, latency, retry):
+        with self._lock:
+            self.request_count += 1
+            if retry:
+                self.retry_count += 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+
+    def _get_backoff(self, attempt, response):
+        """Return the number of seconds to wait before retrying. The server's
+        Retry-After header is honoured, otherwise a random amount of time up to
+        an exponentially growing limit is used."""
+        retry_after = response.headers.get('Retry-After')
+        if retry_after and retry_after.isdigit():
+            return min(self.max_backoff, int(retry_after))
+        limit = min(self.max_backoff, self.backoff_factor * (2 ** attempt))
+        return random.uniform(0, limit)
+
+    def get(self, url, params=None):
+        """Make a GET request, retrying it if it was rate limited or failed on
+        the server. Raises a requests.HTTPError if the request still fails."""
+        for attempt in range(self.max_retries + 1):
+            start = time.monotonic()
+            try:
+                response = self._session.get(
+                    url, params=params,
+                    timeout=(self.connect_timeout, self.read_timeout))
+            finally:
+                self._record_request(time.monotonic() - start, attempt > 0)
+            if (response.status_code not in self.retry_statuses or
+                    attempt == self.max_retries):
+                break
+            time.sleep(self._get_backoff(attempt, response))
+        response.raise_for_status()
+        return response
+
+    def close(self):
+        self._session.close()
@@ -69,3 +69,12 @@ def exchange_rates_mock(requests_mock, transactions):
             }
         })
     requests_mock.get(rm.ANY, json={"observations": observations})
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    """Keep the exchange rates cached by the CLI out of the user's cache
+    directory"""
+    path = tmp_path / "cache"
+    monkeypatch.setenv("CAPGAINS_CACHE_DIR", str(path))
+    return path
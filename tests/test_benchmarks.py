@@ -0,0 +1,73 @@
+import json
+from click.testing import CliRunner
+from datetime import date
+
+from benchmarks import run
+from benchmarks.ledger_generator import LedgerGenerator
+from benchmarks.valet_stub import ValetStub
+from capgains.exchange_rate import ExchangeRate
+from capgains.transactions_reader import TransactionsReader
+
+
+def test_ledger_generator(testfiles_dir):
+    """Testing that the generated ledger is the same for the same seed, and
+    that it can be read"""
+    generator = LedgerGenerator(500, tickers=5, seed=1)
+    assert list(generator) == list(LedgerGenerator(500, tickers=5, seed=1))
+    assert list(generator) != list(LedgerGenerator(500, tickers=5, seed=2))
+    path = generator.write(str(testfiles_dir.join("generated.csv")))
+    transactions = TransactionsReader.get_transactions(path)
+    assert len(transactions) == 500
+    assert len(transactions.tickers) == 5
+    balances = {}
+    for t in transactions:
+        balances[t.ticker] = balances.get(t.ticker, 0) + (
+            -t.qty if t.action == 'SELL' else t.qty)
+        assert balances[t.ticker] >= 0
+    assert ({t.description for t in transactions} ==
+            {'RSU VEST', 'SALE', 'WASH SALE'})
+    assert not any(row[1] == 'WASH SALE' for row in LedgerGenerator(
+        500, tickers=5, seed=1, wash_clustering=0))
+
+
+def test_valet_stub():
+    """Testing that the exchange rates are fetched from the stub"""
+    valet_obs_url = ExchangeRate.valet_obs_url
+    with ValetStub() as stub:
+        ExchangeRate.valet_obs_url = stub.url
+        try:
+            er = ExchangeRate('USD', date(2016, 12, 29), date(2017, 1, 9))
+        finally:
+            ExchangeRate.valet_obs_url = valet_obs_url
+        assert stub.request_count == 2
+    assert (str(er.get_rate(date(2016, 12, 30))) ==
+            ValetStub.get_rate('IEXE0101', date(2016, 12, 30)))
+    # The rate of the Friday is used on the weekend
+    assert (str(er.get_rate(date(2017, 1, 8))) ==
+            ValetStub.get_rate('FXUSDCAD', date(2017, 1, 6)))
+
+
+def test_benchmarks_run(tmp_path):
+    """Testing that the benchmarks run and that regressions from the
+    baseline are found"""
+    output = str(tmp_path / "results.json")
+    result = CliRunner().invoke(run.main, ['--sizes', '50,100',
+                                           '--repeat', '1',
+                                           '--tickers', '3',
+                                           '-o', output])
+    assert result.exit_code == 0
+    for name in run.benchmarks:
+        assert name in result.output
+    with open(output) as f:
+        results = json.load(f)['results']
+    assert len(results) == 2 * len(run.benchmarks)
+    assert all(r['seconds'] > 0 for r in results)
+
+    baseline = {'results': [dict(r, seconds=r['seconds'] * 2)
+                            for r in results]}
+    assert run.get_regressions(results, baseline, 0) == []
+    baseline['results'][0]['seconds'] = results[0]['seconds'] / 2
+    regressions = run.get_regressions(results, baseline, 0.25)
+    assert [(r['benchmark'], r['rows']) for r in regressions] == [
+        (results[0]['benchmark'], results[0]['rows'])]
+    assert run.get_regressions(results, baseline, 1.5) == []
@@ -1,5 +1,7 @@
+import pytest
 from click.testing import CliRunner
-from capgains.cli import capgains
+from capgains.cli import YearRange, capgains
+from capgains.transactions_reader import TransactionsReader
 
 from tests.helpers import create_csv_file, transactions_to_list
 
@@ -112,6 +114,102 @@ ANET-2018
 """  # noqa: E501
 
 
+def test_calc_columnar(testfiles_dir, transactions, exchange_rates_mock):
+    """Testing the capgains calc command with the transactions stored column
+    by column"""
+    filepath = create_csv_file(testfiles_dir,
+                               "calctickertest.csv",
+                               transactions_to_list(transactions),
+                               True)
+
+    runner = CliRunner()
+    result = runner.invoke(capgains, ['calc', filepath, '2018'])
+    columnar_result = runner.invoke(capgains,
+                                    ['calc', filepath, '2018', '--columnar'])
+    assert columnar_result.exit_code == 0
+    assert columnar_result.output == result.output
+
+
+def test_show_several_files(testfiles_dir, transactions):
+    """Testing the capgains show command with several CSV-files"""
+    rows = transactions_to_list(transactions)
+    filepath = create_csv_file(testfiles_dir, "showtickertest.csv", rows)
+    first = create_csv_file(testfiles_dir, "first.csv", [rows[0], rows[2]])
+    second = create_csv_file(testfiles_dir, "second.csv", [rows[1], rows[3]])
+
+    runner = CliRunner()
+    result = runner.invoke(capgains, ['show', second, first])
+    assert result.exit_code == 0
+    assert result.output == runner.invoke(capgains,
+                                          ['show', filepath]).output
+
+
+def test_calc_several_files(testfiles_dir, transactions, exchange_rates_mock):
+    """Testing the capgains calc command with a directory and a CSV-file"""
+    rows = transactions_to_list(transactions)
+    filepath = create_csv_file(testfiles_dir, "calctickertest.csv", rows)
+    broker = testfiles_dir.mkdir("calcbroker")
+    create_csv_file(broker, "a.csv", rows[:1])
+    create_csv_file(broker, "b.csv", rows[2:])
+    other = create_csv_file(testfiles_dir, "other.csv", rows[1:2])
+
+    runner = CliRunner()
+    result = runner.invoke(capgains, ['calc', str(broker), other, '2018'])
+    assert result.exit_code == 0
+    assert result.output == runner.invoke(capgains,
+                                          ['calc', filepath, '2018']).output
+
+    result = runner.invoke(capgains, ['calc', str(broker), other, '--years',
+                                      '2018'])
+    assert result.exit_code == 0
+    assert result.output == runner.invoke(capgains,
+                                          ['calc', filepath, '2018']).output
+
+
+def test_sort(testfiles_dir, transactions, exchange_rates_mock):
+    """Testing the capgains show and calc commands on a CSV-file that is not
+    in chronological order"""
+    rows = transactions_to_list(transactions)
+    filepath = create_csv_file(testfiles_dir, "calctickertest.csv", rows)
+    unordered = create_csv_file(testfiles_dir, "unordered.csv",
+                                [rows[3], rows[1], rows[0], rows[2]])
+
+    runner = CliRunner()
+    result = runner.invoke(capgains, ['calc', unordered, '2018'])
+    assert result.exit_code == 1
+    assert "not entered in chronological order" in result.output
+    for command in (['show'], ['calc', '--years', '2017-2019']):
+        result = runner.invoke(capgains, command + [filepath])
+        sorted_result = runner.invoke(capgains, command + [
+            unordered, '--sort', '--sort-memory', '1'])
+        assert sorted_result.exit_code == 0
+        assert sorted_result.output == result.output
+
+
+def test_format(testfiles_dir, transactions, exchange_rates_mock):
+    """Testing the capgains show and calc commands with the csv and jsonl
+    formats"""
+    filepath = create_csv_file(testfiles_dir, "calctickertest.csv",
+                               transactions_to_list(transactions))
+
+    runner = CliRunner()
+    result = runner.invoke(capgains, ['show', filepath, '-t', 'GOOGL', '-f',
+                                      'csv'])
+    assert result.exit_code == 0
+    assert result.output == """\
+date,description,ticker,action,qty,price,commission,currency
+2018-02-20,RSU VEST,GOOGL,BUY,30,20,10,USD
+"""
+    result = runner.invoke(capgains, ['calc', filepath, '--years',
+                                      '2017-2018', '--format', 'jsonl'])
+    assert result.exit_code == 0
+    assert result.output == """\
+{"year": 2018, "date": "2018-02-20", "description": "RSU VEST", "ticker": "ANET", "qty": "50", "proceeds": "12000.0", "acb": "5010.0", "outlays": "20.0", "capital_gain": "6970.0"}
+"""  # noqa: E501
+    result = runner.invoke(capgains, ['show', filepath, '-f', 'xml'])
+    assert result.exit_code == 2
+
+
 def test_calc_no_year(testfiles_dir, transactions):
     """Testing the capgains calc command without a year"""
     filepath = create_csv_file(testfiles_dir,
@@ -126,3 +224,223 @@ def test_calc_no_year(testfiles_dir, transactions):
     runner = CliRunner()
     result = runner.invoke(capgains, ['calc', filepath])
     assert result.exit_code == 2
+
+    result = runner.invoke(capgains, ['calc', filepath, '2018', '--years',
+                                      '2018-2019'])
+    assert result.exit_code == 2
+
+    result = runner.invoke(capgains, ['calc', filepath, 'twenty'])
+    assert result.exit_code == 2
+    assert "Invalid value for 'YEAR'" in result.output
+
+
+def test_calc_years(testfiles_dir, transactions, exchange_rates_mock):
+    """Testing the capgains calc command with a range of years"""
+    filepath = create_csv_file(testfiles_dir,
+                               "calctickertest.csv",
+                               transactions_to_list(transactions),
+                               True)
+
+    runner = CliRunner()
+    result = runner.invoke(capgains, ['calc', filepath, '--years',
+                                      '2017-2019', '-t', 'ANET'])
+    assert result.exit_code == 0
+    assert "ANET-2017\nNo capital gains\n" in result.output
+    assert "[Total Gains = 6,970.00]" in result.output
+    assert "ANET-2019\nNo capital gains\n" in result.output
+    assert "| 2018   |            6,970.00 |" in result.output
+
+    result = runner.invoke(capgains, ['calc', filepath, '--years', '2018'])
+    year_result = runner.invoke(capgains, ['calc', filepath, '2018'])
+    assert result.exit_code == 0
+    assert result.output == year_result.output
+
+
+@pytest.mark.parametrize("years", ["2019-2018", "2018-", "twenty"])
+def test_calc_invalid_years(testfiles_dir, transactions, years):
+    """Testing the capgains calc command with an invalid range of years"""
+    filepath = create_csv_file(testfiles_dir,
+                               "calctickertest.csv",
+                               transactions_to_list(transactions),
+                               True)
+
+    runner = CliRunner()
+    result = runner.invoke(capgains, ['calc', filepath, '--years', years])
+    assert result.exit_code == 2
+    assert "Invalid value for '--years'" in result.output
+
+
+def test_year_range_converted():
+    """Testing that a range of years that was already converted is kept"""
+    assert YearRange().convert(range(2017, 2019), None, None) == range(2017,
+                                                                       2019)
+
+
+def test_calc_caches_exchange_rates(testfiles_dir, transactions,
+                                    exchange_rates_mock, requests_mock,
+                                    cache_dir):
+    """Testing that the capgains calc command does not fetch exchange rates
+    again once they are cached"""
+    filepath = create_csv_file(testfiles_dir,
+                               "calctickertest.csv",
+                               transactions_to_list(transactions),
+                               True)
+
+    runner = CliRunner()
+    result = runner.invoke(capgains, ['calc', filepath, '2018'])
+    assert result.exit_code == 0
+    call_count = requests_mock.call_count
+    assert call_count > 0
+    assert cache_dir.exists()
+
+    cached_result = runner.invoke(capgains, ['calc', filepath, '2018'])
+    assert cached_result.exit_code == 0
+    assert cached_result.output == result.output
+    assert requests_mock.call_count == call_count
+
+
+def test_calc_no_cache(testfiles_dir, transactions, exchange_rates_mock,
+                       cache_dir):
+    """Testing that the capgains calc command does not write a cache when
+    asked not to"""
+    filepath = create_csv_file(testfiles_dir,
+                               "calctickertest.csv",
+                               transactions_to_list(transactions),
+                               True)
+
+    runner = CliRunner()
+    result = runner.invoke(capgains, ['--no-cache', 'calc', filepath, '2018'])
+    assert result.exit_code == 0
+    assert not cache_dir.exists()
+
+
+def test_show_ledger_cache(testfiles_dir, transactions, exchange_rates_mock,
+                           cache_dir, monkeypatch):
+    """Testing that the capgains show command streams CSV-files that aren't
+    cached without caching them, and uses the transactions cached by calc"""
+    rows = transactions_to_list(transactions)
+    first = create_csv_file(testfiles_dir, "showcachefirst.csv",
+                            [rows[0], rows[2]])
+    second = create_csv_file(testfiles_dir, "showcachesecond.csv",
+                             [rows[1], rows[3]])
+
+    runner = CliRunner()
+    result = runner.invoke(capgains, ['show', first, second])
+    assert result.exit_code == 0
+    assert not list(cache_dir.glob('ledgers/*.pickle'))
+
+    calc_result = runner.invoke(capgains, ['calc', first, second, '2018'])
+    assert calc_result.exit_code == 0
+    assert len(list(cache_dir.glob('ledgers/*.pickle'))) == 2
+
+    def fail(*args, **kwargs):
+        raise AssertionError("The CSV-file was parsed")
+    monkeypatch.setattr(TransactionsReader, 'iter_transactions', fail)
+    cached_result = runner.invoke(capgains, ['show', first, second])
+    assert cached_result.exit_code == 0
+    assert cached_result.output == result.output
+
+
+def test_calc_unusable_cache(testfiles_dir, transactions,
+                             exchange_rates_mock, cache_dir):
+    """Testing that the capgains calc command warns and runs without the
+    cache when the exchange rate cache can't be opened"""
+    filepath = create_csv_file(testfiles_dir,
+                               "calctickertest.csv",
+                               transactions_to_list(transactions),
+                               True)
+    runner = CliRunner()
+    result = runner.invoke(capgains, ['--no-cache', 'calc', filepath, '2018'])
+    assert result.exit_code == 0
+
+    (cache_dir / "rates.sqlite").mkdir(parents=True)
+    warned_result = runner.invoke(capgains, ['calc', filepath, '2018'])
+    assert warned_result.exit_code == 0
+    warning, output = warned_result.output.split("\n", 1)
+    assert warning.startswith("Warning: Cannot use the cache directory {}: "
+                              .format(cache_dir))
+    assert warning.endswith("Running without the cache.")
+    assert output == result.output
+    assert not (cache_dir / "checkpoints.sqlite").exists()
+
+
+@pytest.mark.parametrize("command", [['show'], ['calc', '2018']])
+def test_uncreatable_cache(testfiles_dir, transactions, exchange_rates_mock,
+                           command):
+    """Testing that the capgains show and calc commands stream or parse the
+    CSV-files without the cache when its directory can't be created"""
+    filepath = create_csv_file(testfiles_dir,
+                               "uncreatablecache.csv",
+                               transactions_to_list(transactions),
+                               True)
+    testfiles_dir.join("notadir").write("")
+    cache = str(testfiles_dir.join("notadir", "cache"))
+    args = command[:1] + [filepath] + command[1:]
+    runner = CliRunner()
+    result = runner.invoke(capgains, ['--no-cache'] + args)
+    assert result.exit_code == 0
+
+    warned_result = runner.invoke(capgains, ['--cache-dir', cache] + args)
+    assert warned_result.exit_code == 0
+    warning, output = warned_result.output.split("\n", 1)
+    assert warning.startswith(
+        "Warning: Cannot use the cache directory {}: ".format(cache))
+    assert output == result.output
+
+
+def test_rates_unusable_cache(testfiles_dir):
+    """Testing that the rates commands fail without a traceback when the
+    cache directory can't be created"""
+    testfiles_dir.join("notadir").write("")
+    cache = str(testfiles_dir.join("notadir", "cache"))
+    runner = CliRunner()
+    result = runner.invoke(capgains, ['--cache-dir', cache, 'rates',
+                                      'export'])
+    assert result.exit_code == 1
+    assert result.output.startswith(
+        "Error: Cannot use the cache directory {}: ".format(cache))
+
+
+def test_calc_offline(testfiles_dir, transactions, exchange_rates_mock,
+                      requests_mock):
+    """Testing the capgains calc command in offline mode, with exchange rates
+    exported from another machine"""
+    filepath = create_csv_file(testfiles_dir,
+                               "calctickertest.csv",
+                               transactions_to_list(transactions),
+                               True)
+    bundle = str(testfiles_dir.join("bundle.json"))
+
+    runner = CliRunner()
+    result = runner.invoke(capgains, ['calc', filepath, '2018'])
+    assert result.exit_code == 0
+    export_result = runner.invoke(capgains, ['rates', 'export', bundle])
+    assert export_result.exit_code == 0
+    call_count = requests_mock.call_count
+
+    other_cache = str(testfiles_dir.join("othercache"))
+    import_result = runner.invoke(capgains, ['--cache-dir', other_cache,
+                                             'rates', 'import', bundle])
+    assert import_result.exit_code == 0
+    assert import_result.output == """\
+Imported 3 FXUSDCAD rates from 2017-02-08 to 2018-02-20
+"""
+    offline_result = runner.invoke(capgains, ['--cache-dir', other_cache,
+                                              '--offline', 'calc', filepath,
+                                              '2018'])
+    assert offline_result.exit_code == 0
+    assert offline_result.output == result.output
+    assert requests_mock.call_count == call_count
+
+
+def test_offline_no_cache():
+    runner = CliRunner()
+    result = runner.invoke(capgains, ['--offline', '--no-cache', 'rates',
+                                      'export'])
+    assert result.exit_code == 2
+
+
+def test_rates_no_cache():
+    runner = CliRunner()
+    result = runner.invoke(capgains, ['--no-cache', 'rates', 'export'])
+    assert result.exit_code == 2
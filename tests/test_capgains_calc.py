@@ -1,6 +1,8 @@
+import pytest
 from datetime import date
 import requests_mock as rm
 
+from capgains.checkpoint_store import CheckpointStore
 from capgains.commands import capgains_calc as CapGainsCalc
 from capgains.transaction import Transaction
 from capgains.transactions import Transactions
@@ -64,8 +66,11 @@ No capital gains
 """
 
 
-def test_superficial_loss_not_displayed(capfd, exchange_rates_mock):
-    """Testing capgains_calc with a superficial loss transaction"""
+@pytest.mark.parametrize("columnar", [False, True])
+def test_superficial_loss_not_displayed(capfd, exchange_rates_mock,
+                                        columnar):
+    """Testing capgains_calc with a superficial loss transaction, with the
+    transactions in a list or stored column by column"""
     transactions = [
         Transaction(
             date(2018, 1, 1),
@@ -98,7 +103,7 @@ def test_superficial_loss_not_displayed(capfd, exchange_rates_mock):
             'USD'
         )
     ]
-    transactions = Transactions(transactions)
+    transactions = Transactions(transactions, columnar=columnar)
     CapGainsCalc.capgains_calc(transactions, 2018)
     out, _ = capfd.readouterr()
     assert out == """\
@@ -196,3 +201,181 @@ ANET-2018
 +------------+---------------+----------+-------+------------+-------+-----------+---------------------+
 
 """  # noqa: E501
+
+
+def test_exchange_rates_fetched_once(transactions, capfd, requests_mock,
+                                     exchange_rates_mock):
+    """Testing that capgains_calc fetches the exchange rates once for all
+    tickers"""
+    CapGainsCalc.capgains_calc(transactions, 2018)
+    assert requests_mock.call_count == 1
+    assert requests_mock.last_request.qs == {
+        'start_date': ['2017-02-08'],
+        'end_date': ['2018-02-20']
+    }
+
+
+def test_jobs(transactions, capfd, requests_mock, exchange_rates_mock):
+    """Testing that capgains_calc prints the same output, in the same order,
+    when the tickers are calculated by several processes"""
+    CapGainsCalc.capgains_calc(transactions, 2018)
+    expected, _ = capfd.readouterr()
+    CapGainsCalc.capgains_calc(transactions, 2018, jobs=2)
+    out, _ = capfd.readouterr()
+    assert out == expected
+    # The workers use the exchange rates that were already fetched
+    assert requests_mock.call_count == 2
+
+
+def test_worker_ticker_reports(transactions, exchange_rates_mock,
+                               monkeypatch):
+    """Testing the reports of a worker process, calculated in this process
+    since the coverage of the worker processes isn't measured"""
+    for name in ['_worker_ticker_transactions', '_worker_exchange_rates',
+                 '_worker_checkpoint_store']:
+        monkeypatch.setattr(CapGainsCalc, name, None)
+    exchange_rates = CapGainsCalc._get_map_of_currencies_to_exchange_rates(
+        transactions)
+    CapGainsCalc._init_worker(transactions.group_by_ticker(), exchange_rates,
+                              None)
+    assert (CapGainsCalc._get_worker_ticker_reports('ANET', [2018], 'csv') ==
+            CapGainsCalc._get_ticker_reports(transactions, [2018], 'ANET',
+                                             exchange_rates, None, 'csv'))
+
+
+def test_checkpoints(transactions, capfd, cache_dir, exchange_rates_mock):
+    """Testing that capgains_calc saves the year-end checkpoints of the
+    tickers and prints the same output when it resumes from them"""
+    CapGainsCalc.capgains_calc(transactions, 2018)
+    expected, _ = capfd.readouterr()
+    store = CheckpointStore(str(cache_dir))
+    CapGainsCalc.capgains_calc(transactions, 2018, checkpoint_store=store)
+    out, _ = capfd.readouterr()
+    assert out == expected
+    anet_transactions = transactions.filter_by(tickers=['ANET'])
+    hashes = store.get_ledger_hashes(
+        anet_transactions, 2018,
+        CapGainsCalc._get_map_of_currencies_to_exchange_rates(
+            anet_transactions))
+    checkpoint = store.get_checkpoint(hashes)
+    assert checkpoint.year == 2017
+    assert checkpoint.share_balance == 100
+    assert checkpoint.total_acb == 10020
+
+    CapGainsCalc.capgains_calc(transactions, 2018, checkpoint_store=store)
+    out, _ = capfd.readouterr()
+    assert out == expected
+
+
+def test_checkpoints_exchange_rates(transactions, capfd, cache_dir,
+                                    requests_mock, exchange_rates_mock):
+    """Testing that a checkpoint isn't used once the exchange rates it was
+    calculated with change"""
+    store = CheckpointStore(str(cache_dir))
+    CapGainsCalc.capgains_calc(transactions, 2018, checkpoint_store=store)
+    before, _ = capfd.readouterr()
+    requests_mock.get(rm.ANY, json={"observations": [
+        {'d': t.date.isoformat(), 'FXUSDCAD': {'v': '3.0'}}
+        for t in transactions]})
+    CapGainsCalc.capgains_calc(transactions, 2018)
+    expected, _ = capfd.readouterr()
+    CapGainsCalc.capgains_calc(transactions, 2018, checkpoint_store=store)
+    out, _ = capfd.readouterr()
+    assert out == expected
+    assert out != before
+
+
+def test_capgains_calc_years(transactions, capfd, requests_mock,
+                             exchange_rates_mock):
+    """Testing capgains_calc_years with several years"""
+    CapGainsCalc.capgains_calc_years(transactions, [2019, 2018])
+    out, _ = capfd.readouterr()
+    assert out == """\
+ANET-2018
+[Total Gains = 6,970.00]
++------------+---------------+----------+-------+------------+----------+-----------+---------------------+
+| date       | description   | ticker   |   qty |   proceeds |      ACB |   outlays |   capital gain/loss |
+|------------+---------------+----------+-------+------------+----------+-----------+---------------------|
+| 2018-02-20 | RSU VEST      | ANET     |    50 |  12,000.00 | 5,010.00 |     20.00 |            6,970.00 |
++------------+---------------+----------+-------+------------+----------+-----------+---------------------+
+
+ANET-2019
+No capital gains
+
+GOOGL-2018
+No capital gains
+
+GOOGL-2019
+No capital gains
+
+[Total Gains by Year]
++--------+---------------------+
+| year   |   capital gain/loss |
+|--------+---------------------|
+| 2018   |            6,970.00 |
+| 2019   |                0.00 |
++--------+---------------------+
+
+"""  # noqa: E501
+    # The exchange rates are fetched once for all the years
+    assert requests_mock.call_count == 1
+
+
+def test_calculate_gains_by_year(transactions, exchange_rates_mock):
+    """Testing that the gains of several years calculated at once are the
+    ones calculated for each year"""
+    by_year = CapGainsCalc.calculate_gains_by_year(transactions,
+                                                   range(2017, 2020), 'ANET')
+    assert list(by_year) == [2017, 2018, 2019]
+    for year, transactions_to_report in by_year.items():
+        expected = CapGainsCalc.calculate_gains(transactions, year, 'ANET')
+        assert ([(t.date, t.capital_gain) for t in transactions_to_report] ==
+                [(t.date, t.capital_gain) for t in expected])
+    assert len(by_year[2018]) == 1
+
+
+def test_calculate_gains_by_year_superficial_loss(exchange_rates_mock):
+    """Testing that a loss at the end of a year that is bought back early in
+    the next year is superficial whether or not the next year is calculated
+    too"""
+    transactions = Transactions([
+        Transaction(date(2018, 6, 1), 'ESPP PURCHASE', 'ANET', 'BUY', 10,
+                    100.00, 10.00, 'USD'),
+        Transaction(date(2018, 12, 20), 'RSU VEST', 'ANET', 'SELL', 10,
+                    50.00, 10.00, 'USD'),
+        Transaction(date(2019, 1, 10), 'ESPP PURCHASE', 'ANET', 'BUY', 10,
+                    60.00, 10.00, 'USD'),
+    ])
+    assert list(CapGainsCalc.calculate_gains(transactions, 2018, 'ANET')) == []
+    by_year = CapGainsCalc.calculate_gains_by_year(transactions, [2018, 2019],
+                                                   'ANET')
+    assert list(by_year[2018]) == []
+    assert transactions[1].superficial_loss
+
+
+def test_csv_format(transactions, capfd, exchange_rates_mock):
+    """Testing capgains_calc_years with the csv format"""
+    CapGainsCalc.capgains_calc_years(transactions, [2018, 2019], fmt="csv")
+    out, _ = capfd.readouterr()
+    assert out == """\
+year,date,description,ticker,qty,proceeds,acb,outlays,capital_gain
+2018,2018-02-20,RSU VEST,ANET,50,12000.0,5010.0,20.0,6970.0
+"""
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_jsonl_format(transactions, capfd, exchange_rates_mock, jobs):
+    """Testing capgains_calc with the jsonl format"""
+    CapGainsCalc.capgains_calc(transactions, 2018, fmt="jsonl", jobs=jobs)
+    out, _ = capfd.readouterr()
+    assert out == """\
+{"year": 2018, "date": "2018-02-20", "description": "RSU VEST", "ticker": "ANET", "qty": "50", "proceeds": "12000.0", "acb": "5010.0", "outlays": "20.0", "capital_gain": "6970.0"}
+"""  # noqa: E501
+
+
+def test_no_transactions_csv_format(capfd):
+    """Testing capgains_calc with the csv format without any transactions"""
+    CapGainsCalc.capgains_calc(Transactions([]), 2018, fmt="csv")
+    out, err = capfd.readouterr()
+    assert out == "year,date,description,ticker,qty,proceeds,acb,outlays,capital_gain\n"  # noqa: E501
+    assert err == "No transactions available\n"
@@ -0,0 +1,173 @@
+import io
+import json
+import pytest
+from click import ClickException
+from datetime import date
+from decimal import Decimal
+
+from capgains.commands import capgains_rates as CapGainsRates
+from capgains.rate_store import RateStore
+
+valet_json = {
+    "seriesDetail": {
+        "FXUSDCAD": {
+            "label": "USD/CAD"
+        }
+    },
+    "observations": [
+        {
+            "d": "2020-05-21",
+            "FXUSDCAD": {
+                "v": "1.2"
+            }
+        },
+        {
+            "d": "2020-05-22",
+            "FXUSDCAD": {
+                "v": "1.3"
+            }
+        },
+    ]
+}
+
+valet_csv = """\
+"TERMS AND CONDITIONS"
+"https://www.bankofcanada.ca/terms/"
+
+"SERIES"
+"id","label","description"
+"FXUSDCAD","USD/CAD","US dollar to Canadian dollar daily exchange rate"
+
+"OBSERVATIONS"
+"date","FXUSDCAD","FXEURCAD"
+"2020-05-21","1.2","1.5"
+"2020-05-22","1.3",""
+"""
+
+
+@pytest.fixture(scope='function')
+def rate_store(cache_dir):
+    return RateStore(str(cache_dir))
+
+
+def _write_bundle(tmp_path, filename, content):
+    path = tmp_path / filename
+    path.write_text(content)
+    return str(path)
+
+
+def test_import_json(tmp_path, rate_store, capfd):
+    """Testing importing a Valet JSON dump"""
+    path = _write_bundle(tmp_path, "rates.json", json.dumps(valet_json))
+    CapGainsRates.capgains_rates_import(rate_store, path)
+    out, _ = capfd.readouterr()
+    assert out == "Imported 2 FXUSDCAD rates from 2020-05-21 to 2020-05-22\n"
+    assert rate_store.get_rates('FXUSDCAD', date(2020, 5, 1),
+                                date(2020, 5, 31)) == {
+        date(2020, 5, 21): Decimal('1.2'),
+        date(2020, 5, 22): Decimal('1.3'),
+    }
+    assert rate_store.get_coverage('FXUSDCAD') == [
+        (date(2020, 5, 21), date(2020, 5, 22))
+    ]
+
+
+def test_import_csv(tmp_path, rate_store, capfd):
+    """Testing importing a Valet CSV dump, skipping unsupported series"""
+    path = _write_bundle(tmp_path, "rates.csv", valet_csv)
+    CapGainsRates.capgains_rates_import(rate_store, path)
+    out, _ = capfd.readouterr()
+    assert out == """\
+Skipping unsupported series FXEURCAD
+Imported 2 FXUSDCAD rates from 2020-05-21 to 2020-05-22
+"""
+    assert rate_store.get_series() == ['FXUSDCAD']
+    assert rate_store.get_rates('FXUSDCAD', date(2020, 5, 1),
+                                date(2020, 5, 31)) == {
+        date(2020, 5, 21): Decimal('1.2'),
+        date(2020, 5, 22): Decimal('1.3'),
+    }
+
+
+def test_import_csv_sections(tmp_path, rate_store):
+    """Testing that the sections after the observations of a Valet CSV dump
+    are not read as observations"""
+    path = _write_bundle(tmp_path, "sections.csv", valet_csv + """
+"ERRORS"
+"2020-05-23","Not a rate"
+""")
+    CapGainsRates.capgains_rates_import(rate_store, path)
+    assert rate_store.get_rates('FXUSDCAD', date(2020, 5, 1),
+                                date(2020, 5, 31)) == {
+        date(2020, 5, 21): Decimal('1.2'),
+        date(2020, 5, 22): Decimal('1.3'),
+    }
+
+
+def test_import_file_not_found(tmp_path, rate_store):
+    with pytest.raises(ClickException) as excinfo:
+        CapGainsRates.capgains_rates_import(rate_store,
+                                            str(tmp_path / "dne.json"))
+    assert excinfo.value.message == "File not found: {}".format(
+        tmp_path / "dne.json")
+
+
+def test_import_no_observations(tmp_path, rate_store):
+    path = _write_bundle(tmp_path, "rates.json", "{}")
+    with pytest.raises(ClickException) as excinfo:
+        CapGainsRates.capgains_rates_import(rate_store, path)
+    assert excinfo.value.message == "No observations were found in the rate bundle"  # noqa: E501
+
+    path = _write_bundle(tmp_path, "rates.csv", "no,observations\n")
+    with pytest.raises(ClickException) as excinfo:
+        CapGainsRates.capgains_rates_import(rate_store, path)
+    assert excinfo.value.message == "No observations were found in the rate bundle"  # noqa: E501
+
+
+def test_import_invalid_observation(tmp_path, rate_store):
+    path = _write_bundle(tmp_path, "rates.csv",
+                         '"date","FXUSDCAD"\n"2020-05-21","BLAH"\n')
+    with pytest.raises(ClickException) as excinfo:
+        CapGainsRates.capgains_rates_import(rate_store, path)
+    assert excinfo.value.message == "Invalid FXUSDCAD observation on 2020-05-21: BLAH"  # noqa: E501
+
+
+def test_import_no_supported_series(tmp_path, rate_store):
+    path = _write_bundle(tmp_path, "rates.csv",
+                         '"date","FXEURCAD"\n"2020-05-21","1.5"\n')
+    with pytest.raises(ClickException) as excinfo:
+        CapGainsRates.capgains_rates_import(rate_store, path)
+    assert excinfo.value.message == "No supported series were found in the rate bundle. The supported series are ['IEXE0101', 'FXUSDCAD']"  # noqa: E501
+
+
+def test_export_import_round_trip(tmp_path, rate_store, cache_dir):
+    """Testing that exported rates keep their coverage when imported into
+    another store"""
+    rates = {date(2020, 5, 22): Decimal('1.3')}
+    rate_store.add_rates('FXUSDCAD', rates, date(2020, 5, 20),
+                         date(2020, 5, 24))
+    output = io.StringIO()
+    CapGainsRates.capgains_rates_export(rate_store, output)
+    path = _write_bundle(tmp_path, "bundle.json", output.getvalue())
+
+    other_store = RateStore(str(tmp_path / "other"))
+    CapGainsRates.capgains_rates_import(other_store, path)
+    assert other_store.get_rates('FXUSDCAD', date(2020, 5, 1),
+                                 date(2020, 5, 31)) == rates
+    assert other_store.get_coverage('FXUSDCAD') == [
+        (date(2020, 5, 20), date(2020, 5, 24))
+    ]
+
+
+def test_export_csv(rate_store):
+    rate_store.add_rates('FXUSDCAD', {date(2017, 1, 3): Decimal('1.3')},
+                         date(2017, 1, 3), date(2017, 1, 3))
+    rate_store.add_rates('IEXE0101', {date(2016, 12, 30): Decimal('1.2')},
+                         date(2016, 12, 30), date(2016, 12, 30))
+    output = io.StringIO()
+    CapGainsRates.capgains_rates_export(rate_store, output, "csv")
+    assert output.getvalue() == """\
+date,FXUSDCAD,IEXE0101
+2016-12-30,,1.2
+2017-01-03,1.3,
+"""
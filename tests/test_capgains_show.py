@@ -1,4 +1,5 @@
 from datetime import date
+from decimal import Decimal
 
 from capgains.commands import capgains_show as CapGainsShow
 from capgains.transaction import Transaction
@@ -124,3 +125,48 @@ def test_partial_shares(capfd, requests_mock):
 | 2018-02-20 | RSU VEST      | ANET     | SELL     |   0.5 |  100.00 |         0.00 |        CAD |
 +------------+---------------+----------+----------+-------+---------+--------------+------------+
 """  # noqa: E501
+
+
+def test_stream(transactions, capfd):
+    """Testing capgains_show with a stream of transactions"""
+    CapGainsShow.capgains_show(iter(transactions), tickers=['GOOGL'])
+    out, _ = capfd.readouterr()
+    assert out == """\
++------------+---------------+----------+----------+-------+---------+--------------+------------+
+| date       | description   | ticker   | action   |   qty |   price |   commission |   currency |
+|------------+---------------+----------+----------+-------+---------+--------------+------------|
+| 2018-02-20 | RSU VEST      | GOOGL    | BUY      |    30 |   20.00 |        10.00 |        USD |
++------------+---------------+----------+----------+-------+---------+--------------+------------+
+"""  # noqa: E501
+
+
+def test_csv_format(transactions, capfd):
+    """Testing capgains_show with the csv format"""
+    transactions[0].qty = Decimal('100.50')
+    CapGainsShow.capgains_show(transactions, tickers=['ANET'], fmt="csv")
+    out, _ = capfd.readouterr()
+    assert out == """\
+date,description,ticker,action,qty,price,commission,currency
+2017-02-15,ESPP PURCHASE,ANET,BUY,100.50,50,10,USD
+2018-02-20,RSU VEST,ANET,SELL,50,120,10,USD
+2019-02-15,ESPP PURCHASE,ANET,BUY,50,130,10,USD
+"""
+
+
+def test_jsonl_format(transactions, capfd):
+    """Testing capgains_show with the jsonl format, on a stream of
+    transactions"""
+    CapGainsShow.capgains_show(iter(transactions[1:3]), fmt="jsonl")
+    out, _ = capfd.readouterr()
+    assert out == """\
+{"date": "2018-02-20", "description": "RSU VEST", "ticker": "GOOGL", "action": "BUY", "qty": "30", "price": "20", "commission": "10", "currency": "USD"}
+{"date": "2018-02-20", "description": "RSU VEST", "ticker": "ANET", "action": "SELL", "qty": "50", "price": "120", "commission": "10", "currency": "USD"}
+"""  # noqa: E501
+
+
+def test_no_transactions_csv_format(capfd):
+    """Testing capgains_show with the csv format without any
+    transactions"""
+    CapGainsShow.capgains_show(Transactions([]), fmt="csv")
+    out, _ = capfd.readouterr()
+    assert out == "date,description,ticker,action,qty,price,commission,currency\n"  # noqa: E501
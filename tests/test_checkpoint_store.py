@@ -0,0 +1,140 @@
+import pickle
+import requests_mock as rm
+from datetime import date
+from decimal import Decimal
+
+from capgains.checkpoint_store import CheckpointStore
+from capgains.exchange_rate import ExchangeRate
+from capgains.ticker_gains import Checkpoint
+from capgains.transaction import Transaction
+
+
+def _get_transactions():
+    return [
+        Transaction(date(2017, 3, 1), 'BUY', 'ANET', 'BUY', 100, 100.00,
+                    10.00, 'USD'),
+        Transaction(date(2018, 1, 20), 'SELL', 'ANET', 'SELL', 20, 120.00,
+                    10.00, 'USD'),
+        Transaction(date(2018, 3, 1), 'SELL', 'ANET', 'SELL', 20, 120.00,
+                    10.00, 'USD'),
+        Transaction(date(2020, 5, 1), 'SELL', 'ANET', 'SELL', 10, 120.00,
+                    10.00, 'USD'),
+    ]
+
+
+def _get_exchange_rates(requests_mock, rate='1.4'):
+    """Return the USD rates of the transactions, which change to the given
+    rate on the day of the last SELL in 2018"""
+    requests_mock.get(rm.ANY, json={"observations": [
+        {'d': '2017-03-01', 'FXUSDCAD': {'v': '1.3'}},
+        {'d': '2018-03-01', 'FXUSDCAD': {'v': rate}},
+    ]})
+    return {'USD': ExchangeRate('USD', date(2017, 3, 1), date(2020, 5, 1))}
+
+
+def test_ledger_hashes(requests_mock):
+    """Testing that each year is hashed with the transactions up to 30 days
+    after its end"""
+    exchange_rates = _get_exchange_rates(requests_mock)
+    hashes = CheckpointStore.get_ledger_hashes(_get_transactions(), 2020,
+                                               exchange_rates)
+    assert list(hashes) == [2017, 2018, 2019]
+    assert len(set(hashes.values())) == 3
+
+    # A transaction in the 30 days after the year end changes its hash
+    transactions = _get_transactions()
+    transactions[1].qty = Decimal(21)
+    changed = CheckpointStore.get_ledger_hashes(transactions, 2020,
+                                                exchange_rates)
+    assert changed[2017] != hashes[2017]
+    assert changed[2018] != hashes[2018]
+
+    # A transaction after that doesn't
+    transactions = _get_transactions()
+    transactions[2].price = Decimal(121)
+    changed = CheckpointStore.get_ledger_hashes(transactions, 2020,
+                                                exchange_rates)
+    assert changed[2017] == hashes[2017]
+    assert changed[2018] != hashes[2018]
+
+    # Neither does a description
+    transactions = _get_transactions()
+    transactions[0].description = 'ESPP PURCHASE'
+    assert CheckpointStore.get_ledger_hashes(transactions, 2020,
+                                             exchange_rates) == hashes
+
+    # Nor the transactions of later years
+    assert CheckpointStore.get_ledger_hashes(
+        _get_transactions()[:2], 2018, exchange_rates) == {
+            2017: hashes[2017]}
+
+
+def test_ledger_hashes_exchange_rates(requests_mock):
+    """Testing that the exchange rate of a transaction changes the hashes
+    it is part of"""
+    hashes = CheckpointStore.get_ledger_hashes(
+        _get_transactions(), 2020, _get_exchange_rates(requests_mock))
+    changed = CheckpointStore.get_ledger_hashes(
+        _get_transactions(), 2020, _get_exchange_rates(requests_mock, '1.5'))
+    assert changed[2017] == hashes[2017]
+    assert changed[2018] != hashes[2018]
+    assert changed[2019] != hashes[2019]
+
+
+def test_ledger_hashes_no_transactions():
+    assert CheckpointStore.get_ledger_hashes([], 2020, {}) == {}
+
+
+def test_checkpoint_store_latest_checkpoint(cache_dir, requests_mock):
+    """Testing that the latest checkpoint of the ledger is returned"""
+    store = CheckpointStore(str(cache_dir))
+    exchange_rates = _get_exchange_rates(requests_mock)
+    hashes = CheckpointStore.get_ledger_hashes(_get_transactions(), 2020,
+                                               exchange_rates)
+    assert store.get_checkpoint(hashes) is None
+    store.add_checkpoints(hashes, [
+        Checkpoint(2017, Decimal(100), Decimal('10010.0'),
+                   date(2017, 3, 1)),
+        Checkpoint(2019, Decimal(50), Decimal('5005.00'), date(2017, 3, 1)),
+        # Not in the hashes, so not stored
+        Checkpoint(2020, Decimal(40), Decimal('4004.00'), None),
+    ])
+    checkpoint = CheckpointStore(str(cache_dir)).get_checkpoint(hashes)
+    assert checkpoint.year == 2019
+    assert checkpoint.share_balance == 50
+    assert str(checkpoint.total_acb) == '5005.00'
+    assert checkpoint.last_buy_date == date(2017, 3, 1)
+
+    # Changing an earlier transaction invalidates the later checkpoints
+    transactions = _get_transactions()
+    transactions[2].price = Decimal(121)
+    changed = CheckpointStore.get_ledger_hashes(transactions, 2020,
+                                                exchange_rates)
+    assert store.get_checkpoint(changed).year == 2017
+
+
+def test_checkpoint_store_no_last_buy_date(cache_dir):
+    store = CheckpointStore(str(cache_dir))
+    hashes = {2017: 'abc'}
+    store.add_checkpoints(hashes,
+                          [Checkpoint(2017, Decimal(0), Decimal(0))])
+    assert store.get_checkpoint(hashes).last_buy_date is None
+
+
+def test_checkpoint_store_other_year(cache_dir):
+    """Testing that a checkpoint is only used for the year of its ledger
+    hash"""
+    store = CheckpointStore(str(cache_dir))
+    store.add_checkpoints({2017: 'abc'},
+                          [Checkpoint(2017, Decimal(1), Decimal(2))])
+    assert store.get_checkpoint({2018: 'abc'}) is None
+
+
+def test_checkpoint_store_pickle(cache_dir):
+    store = CheckpointStore(str(cache_dir))
+    hashes = {2017: 'abc'}
+    store.add_checkpoints(hashes,
+                          [Checkpoint(2017, Decimal(1), Decimal(2))])
+    copy = pickle.loads(pickle.dumps(store))
+    assert copy.path == store.path
+    assert copy.get_checkpoint(hashes).total_acb == 2
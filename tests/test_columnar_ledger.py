@@ -0,0 +1,101 @@
+import pytest
+from datetime import date
+from decimal import Decimal
+
+from capgains.columnar_ledger import ColumnarLedger, _DecimalColumn
+from capgains.transaction import Transaction
+from capgains.transactions import Transactions
+
+
+def _values(t):
+    return (t.date, t.description, t.ticker, t.action, str(t.qty),
+            str(t.price), str(t.commission), t.currency)
+
+
+def test_ledger_round_trip(transactions):
+    """Testing that the transactions are created again with the same
+    values"""
+    ledger = ColumnarLedger(transactions)
+    assert len(ledger) == len(transactions)
+    assert [_values(t) for t in ledger] == [_values(t) for t in transactions]
+    assert _values(ledger[-1]) == _values(transactions[-1])
+    assert ([_values(t) for t in ledger[1:3]] ==
+            [_values(t) for t in transactions[1:3]])
+    assert ([_values(t) for t in ledger.iter_rows([1, 3])] ==
+            [_values(transactions[1]), _values(transactions[3])])
+    with pytest.raises(IndexError):
+        ledger[len(transactions)]
+
+
+@pytest.mark.parametrize("value", [
+    '0', '0.00', '-12.5', '307.96', '1E+5', '123456789012345678',
+    '1234567890123456789012345', '-0', '1E-200', 'NaN',
+])
+def test_ledger_decimals(value):
+    """Testing that Decimals keep their exact digits and exponent, including
+    the ones that do not fit in the integer columns"""
+    transaction = Transaction(date(2018, 1, 1), 'RSU VEST', 'ANET', 'BUY',
+                              Decimal(value), Decimal(value),
+                              Decimal(value), 'USD')
+    ledger = ColumnarLedger([transaction])
+    for row in [ledger[0], next(iter(ledger)), next(ledger.iter_rows([0]))]:
+        for actual in [row.qty, row.price, row.commission]:
+            assert str(actual) == value
+            assert actual.as_tuple() == Decimal(value).as_tuple()
+
+
+def test_ledger_float_values():
+    transaction = Transaction(date(2018, 1, 1), 'RSU VEST', 'ANET', 'BUY',
+                              21, 307.96, 20.99, 'USD')
+    row = ColumnarLedger([transaction])[0]
+    assert row.qty == transaction.qty
+    assert row.price == transaction.price
+    assert row.commission == transaction.commission
+
+
+def test_ledger_memoized_values(transactions, monkeypatch):
+    """Testing that the values are still right once the memoized ones are
+    forgotten"""
+    monkeypatch.setattr(_DecimalColumn, 'max_memoized_values', 1)
+    ledger = ColumnarLedger(transactions)
+    assert [_values(t) for t in ledger] == [_values(t) for t in transactions]
+
+
+@pytest.mark.parametrize("filters", [
+    {},
+    {'tickers': ['ANET']},
+    {'tickers': ['ANET', 'FB']},
+    {'year': 2018},
+    {'max_year': 2018},
+    {'action': 'SELL'},
+    {'action': 'BLAH'},
+    {'superficial_loss': False},
+    {'superficial_loss': True},
+    {'tickers': ['ANET'], 'year': 2018, 'action': 'SELL'},
+    {'tickers': ['GOOGL'], 'year': 2017},
+    {'tickers': ['GOOGL'], 'year': 2019},
+    {'tickers': ['GOOGL'], 'action': 'SELL'},
+])
+def test_columnar_transactions_filter_by(transactions, filters):
+    """Testing that filtering columnar transactions matches filtering the
+    transactions in a list"""
+    columnar = Transactions(transactions, columnar=True)
+    assert columnar.columnar
+    expected = [_values(t) for t in transactions.filter_by(**filters)]
+    view = columnar.filter_by(**filters)
+    assert [_values(t) for t in view] == expected
+    assert view.tickers == sorted(set(t[2] for t in expected))
+    assert (view.currency_date_ranges ==
+            transactions.filter_by(**filters).currency_date_ranges)
+
+
+def test_columnar_transactions_materialize(transactions):
+    """Testing that materializing a columnar view keeps the values calculated
+    on its transactions"""
+    view = Transactions(transactions, columnar=True).filter_by(
+        tickers=['ANET'])
+    materialized = view.materialize()
+    assert not materialized.columnar
+    materialized[0].set_superficial_loss()
+    assert materialized.filter_by(superficial_loss=True).transactions == [
+        materialized[0]]
@@ -1,13 +1,16 @@
+import pickle
 import pytest
 import re
 import requests_mock as rm
 import requests
+import threading
 
 from datetime import date, timedelta, datetime
 from decimal import Decimal
 from click import ClickException
 
 from capgains.exchange_rate import ExchangeRate
+from capgains.rate_store import RateStore
 
 
 def _request_error_throwing_test(requests_mock, expected_error,
@@ -175,3 +178,180 @@ def test_get_rate_before_min_date_exception(USD_exchange_rates_mock):
     with pytest.raises(ClickException) as excinfo:
         er.get_rate(date(2017, 1, 2))
     assert excinfo.value.message == "Unable to find exchange rate on 2017-01-02"  # noqa: E501
+
+
+def test_exchange_rate_cached(USD_exchange_rates_mock, requests_mock,
+                              cache_dir):
+    """Testing that exchange rates held in the rate store are not fetched
+    again"""
+    store = RateStore(str(cache_dir))
+    friday = date(2020, 5, 22)
+    monday = date(2020, 5, 25)
+    er = ExchangeRate('USD', friday, friday, rate_store=store)
+    assert er.get_rate(friday) == Decimal('1.3')
+    assert requests_mock.call_count == 1
+
+    er = ExchangeRate('USD', friday, friday, rate_store=store)
+    assert er.get_rate(friday) == Decimal('1.3')
+    assert requests_mock.call_count == 1
+
+    # Only the missing days are fetched
+    er = ExchangeRate('USD', friday, monday, rate_store=store)
+    assert er.get_rate(monday) == Decimal('1.4')
+    assert requests_mock.call_count == 2
+    assert requests_mock.last_request.qs == {
+        'start_date': ['2020-05-23'],
+        'end_date': ['2020-05-25']
+    }
+
+
+def test_get_rates(USD_exchange_rates_mock):
+    """Testing that get_rates resolves a sorted column of dates, including
+    weekends"""
+    er = ExchangeRate('USD', date(2020, 5, 21), date(2020, 5, 25))
+    days = [date(2020, 5, 21), date(2020, 5, 22), date(2020, 5, 23),
+            date(2020, 5, 24), date(2020, 5, 25), date(2020, 5, 26)]
+    assert er.get_rates(days) == [
+        Decimal('1.2'), Decimal('1.3'), Decimal('1.3'), Decimal('1.3'),
+        Decimal('1.4'), Decimal('1.4')
+    ]
+    assert er.get_rates(days) == [er.get_rate(day) for day in days]
+
+
+def test_get_rates_unsorted(USD_exchange_rates_mock):
+    """Testing that get_rates still resolves dates that are not sorted"""
+    er = ExchangeRate('USD', date(2020, 5, 21), date(2020, 5, 25))
+    days = [date(2020, 5, 25), date(2020, 5, 21), date(2020, 5, 24)]
+    assert er.get_rates(days) == [
+        Decimal('1.4'), Decimal('1.2'), Decimal('1.3')
+    ]
+
+
+def test_pickle(USD_exchange_rates_mock, cache_dir):
+    """Testing that a pickled ExchangeRate keeps its rates but not its rate
+    store or session"""
+    store = RateStore(str(cache_dir))
+    er = ExchangeRate('USD', date(2020, 5, 21), date(2020, 5, 25),
+                      rate_store=store)
+    copy = pickle.loads(pickle.dumps(er))
+    assert copy._rate_store is None
+    assert copy._session is None
+    assert (copy.get_rates([date(2020, 5, 21), date(2020, 5, 22)]) ==
+            er.get_rates([date(2020, 5, 21), date(2020, 5, 22)]))
+    assert copy.get_rate(date(2020, 5, 24)) == Decimal('1.3')
+
+
+def test_get_rates_cad():
+    day = date(2020, 5, 22)
+    er = ExchangeRate('CAD', day, day)
+    assert er.get_rates([day, day]) == [1, 1]
+
+
+def test_get_rates_before_min_date_exception(USD_exchange_rates_mock):
+    er = ExchangeRate('USD', date(2020, 5, 22), date(2020, 5, 25))
+    with pytest.raises(ClickException) as excinfo:
+        er.get_rates([date(2017, 1, 2), date(2020, 5, 22)])
+    assert excinfo.value.message == "Unable to find exchange rate on 2017-01-02"  # noqa: E501
+
+
+def test_exchange_rate_offline(requests_mock, cache_dir):
+    """Testing that offline exchange rates are read from the rate store
+    without touching the network"""
+    store = RateStore(str(cache_dir))
+    store.add_rates('FXUSDCAD', {date(2020, 5, 22): Decimal('1.3')},
+                    date(2020, 5, 20), date(2020, 5, 24))
+    er = ExchangeRate('USD', date(2020, 5, 22), date(2020, 5, 24),
+                      rate_store=store, offline=True)
+    assert er.get_rate(date(2020, 5, 24)) == Decimal('1.3')
+    assert requests_mock.call_count == 0
+
+
+def test_exchange_rate_offline_missing_coverage(requests_mock, cache_dir):
+    """Testing that offline exchange rates fail fast when the rate store does
+    not cover the requested dates"""
+    store = RateStore(str(cache_dir))
+    store.add_rates('FXUSDCAD', {date(2020, 5, 22): Decimal('1.3')},
+                    date(2020, 5, 20), date(2020, 5, 24))
+    with pytest.raises(ClickException) as excinfo:
+        ExchangeRate('USD', date(2020, 5, 22), date(2020, 5, 27),
+                     rate_store=store, offline=True)
+    assert excinfo.value.message == "Exchange rates for FXUSDCAD are not available offline from 2020-05-25 to 2020-05-27"  # noqa: E501
+    assert requests_mock.call_count == 0
+
+
+def test_exchange_rate_offline_no_rate_store(requests_mock):
+    day = date(2020, 5, 22)
+    with pytest.raises(ClickException) as excinfo:
+        ExchangeRate('USD', day, day, offline=True)
+    assert excinfo.value.message == "Exchange rates can only be used offline from the cache"  # noqa: E501
+    assert requests_mock.call_count == 0
+
+
+def _observations_callback(request, context):
+    """Return a rate of 1.5 for the start date of the requested range"""
+    forex_str = request.path.split('/')[-2].upper()
+    return {
+        "observations": [
+            {
+                "d": request.qs['start_date'][0],
+                forex_str: {
+                    "v": "1.5"
+                }
+            },
+        ]
+    }
+
+
+def test_exchange_rate_chunks(monkeypatch):
+    """Testing that long date ranges are split into chunks, and that the
+    chunks of the noon and indicative rates are all fetched concurrently"""
+    monkeypatch.setattr(ExchangeRate, 'chunk_days', 10)
+    requested_ranges = []
+    # Only passes once all five chunks are being fetched at the same time
+    barrier = threading.Barrier(5, timeout=5)
+
+    def fetch_rates(self, start_date, end_date, forex_str):
+        requested_ranges.append((forex_str, start_date, end_date))
+        barrier.wait()
+        return {start_date: Decimal('1.5')}
+
+    monkeypatch.setattr(ExchangeRate, '_fetch_rates', fetch_rates)
+    er = ExchangeRate('USD', date(2016, 12, 20), date(2017, 1, 10))
+    assert sorted(requested_ranges) == [
+        ('FXUSDCAD', date(2016, 12, 27), date(2017, 1, 5)),
+        ('FXUSDCAD', date(2017, 1, 6), date(2017, 1, 10)),
+        ('IEXE0101', date(2016, 12, 13), date(2016, 12, 22)),
+        ('IEXE0101', date(2016, 12, 23), date(2017, 1, 1)),
+        ('IEXE0101', date(2017, 1, 2), date(2017, 1, 2)),
+    ]
+    assert er.get_rate(date(2016, 12, 22)) == Decimal('1.5')
+    assert er.get_rate(date(2017, 1, 10)) == Decimal('1.5')
+
+
+def test_exchange_rate_resume_after_failure(requests_mock, monkeypatch,
+                                            cache_dir):
+    """Testing that the chunks fetched before a failure are not fetched
+    again"""
+    monkeypatch.setattr(ExchangeRate, 'chunk_days', 10)
+    store = RateStore(str(cache_dir))
+
+    def failing_callback(request, context):
+        if request.qs['start_date'][0] == '2017-01-06':
+            raise requests.ConnectionError()
+        return _observations_callback(request, context)
+
+    requests_mock.get(rm.ANY, json=failing_callback)
+    with pytest.raises(ClickException):
+        ExchangeRate('USD', date(2017, 1, 3), date(2017, 1, 20),
+                     rate_store=store)
+    assert requests_mock.call_count == 3
+
+    requests_mock.get(rm.ANY, json=_observations_callback)
+    er = ExchangeRate('USD', date(2017, 1, 3), date(2017, 1, 20),
+                      rate_store=store)
+    assert requests_mock.call_count == 4
+    assert requests_mock.last_request.qs == {
+        'start_date': ['2017-01-06'],
+        'end_date': ['2017-01-15']
+    }
+    assert er.get_rate(date(2017, 1, 3)) == Decimal('1.5')
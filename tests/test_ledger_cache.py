@@ -0,0 +1,309 @@
+import os
+from click import ClickException
+import pytest
+
+from capgains.ledger_cache import LedgerCache
+from capgains.transactions_reader import TransactionsReader
+from tests.helpers import create_csv_file, transactions_to_list
+
+
+def _values(transactions):
+    return [(t.date, t.description, t.ticker, t.action, t.qty, t.price,
+             t.commission, t.currency) for t in transactions]
+
+
+def _age(path, seconds):
+    """Set the modification time of the file back by some seconds, so that
+    the cache doesn't need to compare its contents"""
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns,
+                       stat.st_mtime_ns - seconds * 10 ** 9))
+
+
+def test_ledger_cache_hit(testfiles_dir, transactions, tmp_path):
+    """Testing that the cached transactions are the ones that were parsed,
+    and that they are used as they are while the file is unchanged"""
+    filepath = create_csv_file(testfiles_dir, "ledger.csv",
+                               transactions_to_list(transactions))
+    _age(filepath, 60)
+    cache = LedgerCache(str(tmp_path))
+    assert cache.load(filepath) == (None, None)
+    parsed = TransactionsReader.get_transactions(filepath,
+                                                 ledger_cache=cache)
+    cached, offset = cache.load(filepath)
+    assert offset is None
+    assert cached.columnar
+    assert _values(cached) == _values(parsed)
+    assert cached.tickers == parsed.tickers
+
+    columnar = TransactionsReader.get_transactions(filepath, columnar=True,
+                                                   ledger_cache=cache)
+    assert columnar.columnar
+    assert _values(columnar) == _values(parsed)
+    loaded = TransactionsReader.get_transactions(filepath,
+                                                 ledger_cache=cache)
+    assert loaded.columnar
+    assert _values(loaded) == _values(parsed)
+    assert (_values(loaded.filter_by(tickers=['ANET'], year=2018)) ==
+            _values(parsed.filter_by(tickers=['ANET'], year=2018)))
+
+
+def test_ledger_cache_changed_file(testfiles_dir, transactions, tmp_path):
+    """Testing that the cache is not used once the file changes"""
+    filepath = create_csv_file(testfiles_dir, "ledger.csv",
+                               transactions_to_list(transactions))
+    cache = LedgerCache(str(tmp_path))
+    TransactionsReader.get_transactions(filepath, ledger_cache=cache)
+    assert cache.load(filepath)[0] is not None
+
+    # Same size and modification time, but different contents
+    stat = os.stat(filepath)
+    transactions[0].description = 'ESPP PURCHASF'
+    create_csv_file(testfiles_dir, "ledger.csv",
+                    transactions_to_list(transactions))
+    os.utime(filepath, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert os.stat(filepath).st_size == stat.st_size
+    assert cache.load(filepath) == (None, None)
+    parsed = TransactionsReader.get_transactions(filepath,
+                                                 ledger_cache=cache)
+    assert parsed[0].description == 'ESPP PURCHASF'
+    assert cache.load(filepath)[0][0].description == 'ESPP PURCHASF'
+
+    # Different size
+    create_csv_file(testfiles_dir, "ledger.csv",
+                    transactions_to_list(transactions[:2]))
+    assert cache.load(filepath) == (None, None)
+    assert len(TransactionsReader.get_transactions(
+        filepath, ledger_cache=cache)) == 2
+
+
+def test_ledger_cache_touched_file(testfiles_dir, transactions, tmp_path):
+    """Testing that the cache is still used when only the modification time
+    of the file changes"""
+    filepath = create_csv_file(testfiles_dir, "ledger.csv",
+                               transactions_to_list(transactions))
+    cache = LedgerCache(str(tmp_path))
+    TransactionsReader.get_transactions(filepath, ledger_cache=cache)
+    _age(filepath, 60)
+    cached, offset = cache.load(filepath)
+    assert offset is None
+    assert _values(cached) == _values(transactions)
+
+
+def test_ledger_cache_corrupt_file(testfiles_dir, transactions, tmp_path):
+    """Testing that a cache file that can't be read is ignored"""
+    filepath = create_csv_file(testfiles_dir, "ledger.csv",
+                               transactions_to_list(transactions))
+    cache = LedgerCache(str(tmp_path))
+    TransactionsReader.get_transactions(filepath, ledger_cache=cache)
+    cache_path = cache._get_path(filepath)
+    with open(cache_path, 'r+b') as f:
+        f.truncate(os.path.getsize(cache_path) // 2)
+    assert cache.load(filepath) == (None, None)
+    open(cache_path, 'w').close()
+    assert cache.load(filepath) == (None, None)
+    assert len(TransactionsReader.get_transactions(
+        filepath, ledger_cache=cache)) == len(transactions)
+
+
+def test_iter_cached_transactions(testfiles_dir, transactions, tmp_path):
+    """Testing that the cached transactions are only streamed while every
+    file is cached and unchanged"""
+    rows = transactions_to_list(transactions)
+    first = create_csv_file(testfiles_dir, "cachedfirst.csv",
+                            [rows[0], rows[2]])
+    second = create_csv_file(testfiles_dir, "cachedsecond.csv", [rows[1]])
+    cache = LedgerCache(str(tmp_path))
+    TransactionsReader.get_transactions(first, ledger_cache=cache)
+    assert TransactionsReader.iter_cached_transactions(
+        [first, second], cache) is None
+    assert (_values(TransactionsReader.iter_cached_transactions([first],
+                                                                cache)) ==
+            _values([transactions[0], transactions[2]]))
+
+    TransactionsReader.get_transactions(second, ledger_cache=cache)
+    assert _values(TransactionsReader.iter_cached_transactions(
+        [first, second], cache)) == _values(
+            [transactions[0], transactions[2], transactions[1]])
+
+    # Entries appended to a file are not cached yet
+    create_csv_file(testfiles_dir, "cachedsecond.csv", [rows[1], rows[3]])
+    assert TransactionsReader.iter_cached_transactions(
+        [first, second], cache) is None
+
+
+def test_ledger_cache_appended_entries(testfiles_dir, transactions,
+                                       tmp_path, monkeypatch):
+    """Testing that only the entries appended to the file are read"""
+    rows = transactions_to_list(transactions)
+    filepath = create_csv_file(testfiles_dir, "ledger.csv", rows[:3])
+    cache = LedgerCache(str(tmp_path))
+    TransactionsReader.get_transactions(filepath, ledger_cache=cache)
+    offset = os.path.getsize(filepath)
+    create_csv_file(testfiles_dir, "ledger.csv", rows)
+    assert cache.load(filepath)[1] == offset
+
+    offsets = []
+    iter_transactions = TransactionsReader.iter_transactions.__func__
+
+    def record_offset(cls, csv_file, offset=0, **kwargs):
+        offsets.append(offset)
+        return iter_transactions(cls, csv_file, offset, **kwargs)
+    monkeypatch.setattr(TransactionsReader, 'iter_transactions',
+                        classmethod(record_offset))
+    appended = TransactionsReader.get_transactions(filepath, columnar=True,
+                                                   ledger_cache=cache)
+    assert offsets == [offset]
+    assert _values(appended) == _values(transactions)
+    assert appended.tickers == ['ANET', 'GOOGL']
+    assert (_values(appended.filter_by(tickers=['ANET'], year=2018)) ==
+            _values([t for t in transactions
+                     if t.ticker == 'ANET' and t.date.year == 2018]))
+    cached, cached_offset = cache.load(filepath)
+    assert cached_offset is None
+    assert _values(cached) == _values(transactions)
+
+
+def test_ledger_cache_edited_before_offset(testfiles_dir, transactions,
+                                           tmp_path):
+    """Testing that the whole file is read again when an entry before the
+    appended ones changes"""
+    rows = transactions_to_list(transactions)
+    filepath = create_csv_file(testfiles_dir, "ledger.csv", rows[:3])
+    cache = LedgerCache(str(tmp_path))
+    TransactionsReader.get_transactions(filepath, ledger_cache=cache)
+    rows[0][1] = 'ESPP PURCHASF'
+    create_csv_file(testfiles_dir, "ledger.csv", rows)
+    assert cache.load(filepath) == (None, None)
+    parsed = TransactionsReader.get_transactions(filepath,
+                                                 ledger_cache=cache)
+    assert parsed[0].description == 'ESPP PURCHASF'
+    assert len(parsed) == len(transactions)
+
+
+def test_ledger_cache_unterminated_entry(testfiles_dir, transactions,
+                                         tmp_path):
+    """Testing that the whole file is read again when the cached part did
+    not end with a complete entry"""
+    rows = transactions_to_list(transactions)
+    filepath = create_csv_file(testfiles_dir, "ledger.csv", rows[:2])
+    with open(filepath, 'rb+') as f:
+        f.truncate(os.path.getsize(filepath) - 2)
+    cache = LedgerCache(str(tmp_path))
+    TransactionsReader.get_transactions(filepath, ledger_cache=cache)
+    with open(filepath, 'a') as f:
+        f.write('\n')
+    assert cache.load(filepath) == (None, None)
+    parsed = TransactionsReader.get_transactions(filepath,
+                                                 ledger_cache=cache)
+    assert _values(parsed) == _values(transactions[:2])
+
+
+def test_ledger_cache_appended_out_of_order(testfiles_dir, transactions,
+                                            tmp_path):
+    """Testing that the appended entries are checked against the cached
+    ones"""
+    rows = transactions_to_list(transactions)
+    filepath = create_csv_file(testfiles_dir, "ledger.csv", rows[1:3])
+    cache = LedgerCache(str(tmp_path))
+    TransactionsReader.get_transactions(filepath, ledger_cache=cache)
+    create_csv_file(testfiles_dir, "ledger.csv", rows[1:3] + rows[:1])
+    with pytest.raises(ClickException) as excinfo:
+        TransactionsReader.get_transactions(filepath, ledger_cache=cache)
+    assert excinfo.value.message == "Transactions were not entered in chronological order"  # noqa: E501
+
+
+def test_ledger_cache_prune(testfiles_dir, transactions, tmp_path):
+    """Testing that the cache files that weren't used for a while are deleted
+    when a file is cached, and that using a cache file keeps it"""
+    rows = transactions_to_list(transactions)
+    used = create_csv_file(testfiles_dir, "pruneused.csv", rows)
+    unused = create_csv_file(testfiles_dir, "pruneunused.csv", rows)
+    cache = LedgerCache(str(tmp_path))
+    TransactionsReader.get_transactions(used, ledger_cache=cache)
+    TransactionsReader.get_transactions(unused, ledger_cache=cache)
+    leftover = os.path.join(cache._dir, "leftover.tmp")
+    other = os.path.join(cache._dir, "other")
+    for path in [leftover, other]:
+        open(path, 'w').close()
+    for path in [cache._get_path(used), cache._get_path(unused), leftover,
+                 other]:
+        _age(path, cache.max_age + 60)
+
+    assert cache.load(used)[0] is not None
+    new = create_csv_file(testfiles_dir, "prunenew.csv", rows)
+    TransactionsReader.get_transactions(new, ledger_cache=cache)
+    assert os.path.exists(cache._get_path(new))
+    assert os.path.exists(cache._get_path(used))
+    assert not os.path.exists(cache._get_path(unused))
+    assert not os.path.exists(leftover)
+    assert os.path.exists(other)
+
+
+def test_ledger_cache_empty_file(testfiles_dir, transactions, tmp_path):
+    """Testing that the entries appended to an empty file that was cached
+    are read from its start"""
+    filepath = str(testfiles_dir.join("emptyledger.csv"))
+    open(filepath, 'w').close()
+    cache = LedgerCache(str(tmp_path))
+    assert len(TransactionsReader.get_transactions(filepath,
+                                                   ledger_cache=cache)) == 0
+    create_csv_file(testfiles_dir, "emptyledger.csv",
+                    transactions_to_list(transactions))
+    assert cache.load(filepath)[1] == 0
+    assert _values(TransactionsReader.get_transactions(
+        filepath, ledger_cache=cache)) == _values(transactions)
+
+
+def test_ledger_cache_other_version(testfiles_dir, transactions, tmp_path,
+                                    monkeypatch):
+    """Testing that the cache files of another format version are ignored"""
+    filepath = create_csv_file(testfiles_dir, "ledger.csv",
+                               transactions_to_list(transactions))
+    cache = LedgerCache(str(tmp_path))
+    TransactionsReader.get_transactions(filepath, ledger_cache=cache)
+    monkeypatch.setattr(LedgerCache, 'format_version',
+                        LedgerCache.format_version + 1)
+    assert cache.load(filepath) == (None, None)
+
+
+def test_ledger_cache_unreadable_file(testfiles_dir, tmp_path):
+    """Testing that a file that can't be read has no fingerprint"""
+    cache = LedgerCache(str(tmp_path))
+    assert cache.get_fingerprint(str(testfiles_dir.join("dne.csv"))) is None
+
+
+def test_ledger_cache_changed_while_parsing(testfiles_dir, transactions,
+                                            tmp_path):
+    """Testing that the transactions aren't cached if the file changed or
+    was deleted after its fingerprint was taken"""
+    rows = transactions_to_list(transactions)
+    filepath = create_csv_file(testfiles_dir, "parsedledger.csv", rows[:2])
+    cache = LedgerCache(str(tmp_path))
+    fingerprint = cache.get_fingerprint(filepath)
+    parsed = TransactionsReader.get_transactions(filepath, columnar=True)
+    create_csv_file(testfiles_dir, "parsedledger.csv", rows)
+    cache.save(fingerprint, parsed)
+    assert not os.path.exists(cache._get_path(filepath))
+
+    os.remove(filepath)
+    cache.save(fingerprint, parsed)
+    assert not os.path.exists(cache._get_path(filepath))
+
+
+@pytest.mark.parametrize("failing", ['tempfile.mkstemp', 'os.replace'])
+def test_ledger_cache_failed_write(testfiles_dir, transactions, tmp_path,
+                                   monkeypatch, failing):
+    """Testing that the transactions are still returned when they can't be
+    cached, and that no temporary file is left behind"""
+    filepath = create_csv_file(testfiles_dir, "ledger.csv",
+                               transactions_to_list(transactions))
+    cache = LedgerCache(str(tmp_path))
+
+    def fail(*args, **kwargs):
+        raise OSError("No space left on device")
+    monkeypatch.setattr(failing, fail)
+    parsed = TransactionsReader.get_transactions(filepath,
+                                                 ledger_cache=cache)
+    assert _values(parsed) == _values(transactions)
+    assert os.listdir(cache._dir) == []
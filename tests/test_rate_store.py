@@ -0,0 +1,84 @@
+import os
+from datetime import date, timedelta
+from decimal import Decimal
+
+from capgains.rate_store import RateStore
+
+
+def test_rate_store_empty(cache_dir):
+    """Testing that an empty store is missing the whole date range"""
+    store = RateStore(str(cache_dir))
+    start = date(2020, 5, 1)
+    end = date(2020, 5, 31)
+    assert store.missing_ranges('FXUSDCAD', start, end) == [(start, end)]
+    assert store.get_rates('FXUSDCAD', start, end) == {}
+    assert store.path == os.path.join(str(cache_dir), RateStore.filename)
+
+
+def test_rate_store_add_rates(cache_dir):
+    """Testing that stored rates and coverage are returned"""
+    store = RateStore(str(cache_dir))
+    rates = {date(2020, 5, 21): Decimal('1.2'),
+             date(2020, 5, 22): Decimal('1.3')}
+    store.add_rates('FXUSDCAD', rates, date(2020, 5, 20), date(2020, 5, 24))
+    assert store.get_rates('FXUSDCAD', date(2020, 5, 1),
+                           date(2020, 5, 31)) == rates
+    assert store.get_rates('IEXE0101', date(2020, 5, 1),
+                           date(2020, 5, 31)) == {}
+    assert store.missing_ranges('FXUSDCAD', date(2020, 5, 1),
+                                date(2020, 5, 31)) == [
+        (date(2020, 5, 1), date(2020, 5, 19)),
+        (date(2020, 5, 25), date(2020, 5, 31))
+    ]
+    assert store.missing_ranges('FXUSDCAD', date(2020, 5, 21),
+                                date(2020, 5, 23)) == []
+
+
+def test_rate_store_shared_between_instances(cache_dir):
+    """Testing that the rates persist across RateStore instances"""
+    rates = {date(2020, 5, 21): Decimal('1.2')}
+    RateStore(str(cache_dir)).add_rates('FXUSDCAD', rates, date(2020, 5, 21),
+                                        date(2020, 5, 21))
+    store = RateStore(str(cache_dir))
+    assert store.get_rates('FXUSDCAD', date(2020, 5, 21),
+                           date(2020, 5, 21)) == rates
+
+
+def test_rate_store_recent_coverage_expires(cache_dir):
+    """Testing that the coverage of the last few days expires, while older
+    coverage is kept"""
+    store = RateStore(str(cache_dir), recent_ttl=-1)
+    today = date.today()
+    start = today - timedelta(days=10)
+    store.add_rates('FXUSDCAD', {}, start, today)
+    stable_date = today - timedelta(days=RateStore.recent_days)
+    assert store.missing_ranges('FXUSDCAD', start, today) == [
+        (stable_date, today)
+    ]
+
+
+def test_rate_store_recent_coverage_replaced(cache_dir):
+    """Testing that refetching the expired last few days replaces their
+    coverage instead of adding to it"""
+    store = RateStore(str(cache_dir), recent_ttl=-1)
+    today = date.today()
+    start = today - timedelta(days=10)
+    store.add_rates('FXUSDCAD', {}, start, today)
+    for _ in range(3):
+        for gap_start, gap_end in store.missing_ranges('FXUSDCAD', start,
+                                                       today):
+            store.add_rates('FXUSDCAD', {}, gap_start, gap_end)
+    with store._connect() as conn:
+        rows = conn.execute("SELECT COUNT(*) FROM coverage").fetchone()[0]
+    assert rows == 2
+    assert store.get_coverage('FXUSDCAD') == [(start, today)]
+
+
+def test_rate_store_recent_coverage_within_ttl(cache_dir):
+    """Testing that the coverage of the last few days is trusted until its
+    TTL expires"""
+    store = RateStore(str(cache_dir))
+    today = date.today()
+    start = today - timedelta(days=10)
+    store.add_rates('FXUSDCAD', {}, start, today)
+    assert store.missing_ranges('FXUSDCAD', start, today) == []
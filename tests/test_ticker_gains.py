@@ -1,8 +1,9 @@
 from click import ClickException
 import pytest
 from datetime import date
+from decimal import Decimal
 
-from capgains.ticker_gains import TickerGains
+from capgains.ticker_gains import Checkpoint, TickerGains
 from capgains.exchange_rate import ExchangeRate
 from capgains.transaction import Transaction
 
@@ -230,6 +231,21 @@ def test_ticker_gains_negative_balance(transactions, exchange_rates_mock):
     assert excinfo.value.message == "Transaction caused negative share balance"
 
 
+class _IntegerRates:
+    def get_rates(self, dates):
+        return [2] * len(dates)
+
+
+def test_ticker_gains_rates_not_decimals():
+    """Testing that exchange rates that aren't Decimals are converted"""
+    transaction = Transaction(date(2018, 1, 1), 'BUY', 'ANET', 'BUY', 10,
+                              100.00, 10.00, 'USD')
+    TickerGains('ANET').add_transactions([transaction],
+                                         {'USD': _IntegerRates()})
+    assert type(transaction.exchange_rate) is Decimal
+    assert transaction.acb == 2020
+
+
 def test_ticker_gains_ok(transactions, exchange_rates_mock):
     tg = TickerGains(transactions[0].ticker)
     er = ExchangeRate('USD', transactions[0].date, transactions[3].date)
@@ -266,3 +282,112 @@ def test_ticker_gains_ok(transactions, exchange_rates_mock):
     assert transactions[3].acb == 13020.00
     assert transactions[3].superficial_loss is False
     assert transactions[3].expenses == 20.0
+
+
+def test_superficial_loss_window_boundaries(exchange_rates_mock):
+    """Testing that purchases exactly 30 days away from a loss are in the
+    superficial loss window, while those 31 days away are not"""
+    transactions = [
+        Transaction(date(2018, 1, 1), 'BUY', 'ANET', 'BUY', 100, 100.00,
+                    0.00, 'USD'),
+        Transaction(date(2018, 3, 1), 'LOSS', 'ANET', 'SELL', 10, 50.00,
+                    0.00, 'USD'),
+        Transaction(date(2018, 3, 31), 'BUY', 'ANET', 'BUY', 1, 50.00,
+                    0.00, 'USD'),
+        Transaction(date(2018, 6, 1), 'LOSS', 'ANET', 'SELL', 10, 50.00,
+                    0.00, 'USD'),
+        Transaction(date(2018, 7, 2), 'BUY', 'ANET', 'BUY', 1, 50.00,
+                    0.00, 'USD'),
+    ]
+    tg = TickerGains(transactions[0].ticker)
+    er = ExchangeRate('USD', transactions[0].date, transactions[-1].date)
+    tg.add_transactions(transactions, {'USD': er})
+    assert transactions[1].superficial_loss
+    assert not transactions[3].superficial_loss
+    assert transactions[3].capital_gain < 0
+
+
+def test_superficial_loss_balance_at_window_end(exchange_rates_mock):
+    """Testing that the share balance at the end of the window counts sales
+    made later in the window"""
+    transactions = [
+        Transaction(date(2018, 1, 1), 'BUY', 'ANET', 'BUY', 100, 100.00,
+                    0.00, 'USD'),
+        Transaction(date(2018, 1, 2), 'LOSS', 'ANET', 'SELL', 50, 50.00,
+                    0.00, 'USD'),
+        Transaction(date(2018, 1, 2), 'LOSS', 'ANET', 'SELL', 40, 50.00,
+                    0.00, 'USD'),
+        Transaction(date(2018, 2, 1), 'SELL', 'ANET', 'SELL', 10, 50.00,
+                    0.00, 'USD'),
+    ]
+    tg = TickerGains(transactions[0].ticker)
+    er = ExchangeRate('USD', transactions[0].date, transactions[-1].date)
+    tg.add_transactions(transactions, {'USD': er})
+    assert not transactions[1].superficial_loss
+    assert not transactions[2].superficial_loss
+
+
+def test_ticker_gains_out_of_order(transactions, exchange_rates_mock):
+    """Testing that transactions that are not in chronological order are
+    rejected"""
+    tg = TickerGains(transactions[0].ticker)
+    er = ExchangeRate('USD', transactions[0].date, transactions[3].date)
+    with pytest.raises(ClickException) as excinfo:
+        tg.add_transactions([transactions[3], transactions[0]], {'USD': er})
+    assert excinfo.value.message == "Transactions were not entered in chronological order"  # noqa: E501
+
+
+def _get_cad_rates(transactions):
+    return {'CAD': ExchangeRate('CAD', transactions[0].date,
+                                transactions[-1].date)}
+
+
+def _get_checkpoint_transactions():
+    return [
+        Transaction(date(2017, 3, 1), 'BUY', 'ANET', 'BUY', 100, 100.00,
+                    10.00, 'CAD'),
+        Transaction(date(2017, 6, 1), 'SELL', 'ANET', 'SELL', 20, 120.00,
+                    10.00, 'CAD'),
+        Transaction(date(2018, 12, 20), 'BUY', 'ANET', 'BUY', 10, 90.00,
+                    10.00, 'CAD'),
+        Transaction(date(2019, 1, 5), 'LOSS', 'ANET', 'SELL', 50, 50.00,
+                    10.00, 'CAD'),
+        Transaction(date(2019, 4, 1), 'SELL', 'ANET', 'SELL', 10, 150.00,
+                    10.00, 'CAD'),
+    ]
+
+
+def test_ticker_gains_checkpoints():
+    """Testing that a checkpoint is saved at the end of the year before each
+    year that has transactions"""
+    transactions = _get_checkpoint_transactions()
+    tg = TickerGains('ANET')
+    tg.add_transactions(transactions, _get_cad_rates(transactions))
+    checkpoints = tg.checkpoints
+    assert [c.year for c in checkpoints] == [2017, 2018]
+    assert checkpoints[0].share_balance == 80
+    assert checkpoints[0].total_acb == 8008
+    assert checkpoints[0].last_buy_date == date(2017, 3, 1)
+    assert checkpoints[1].share_balance == 90
+    assert checkpoints[1].total_acb == 8918
+    assert checkpoints[1].last_buy_date == date(2018, 12, 20)
+
+
+def test_ticker_gains_resume_from_checkpoint():
+    """Testing that the gains calculated from a checkpoint are the same as
+    the ones calculated from all the transactions, including a superficial
+    loss caused by a BUY before the checkpoint"""
+    transactions = _get_checkpoint_transactions()
+    TickerGains('ANET').add_transactions(transactions,
+                                         _get_cad_rates(transactions))
+    resumed = _get_checkpoint_transactions()[3:]
+    tg = TickerGains('ANET', Checkpoint(2018, Decimal(90), Decimal(8918),
+                                        date(2018, 12, 20)))
+    tg.add_transactions(resumed, _get_cad_rates(resumed))
+    assert resumed[0].superficial_loss
+    for t, expected in zip(resumed, transactions[3:]):
+        assert t.share_balance == expected.share_balance
+        assert t.acb == expected.acb
+        assert t.capital_gain == expected.capital_gain
+        assert t.superficial_loss == expected.superficial_loss
+    assert tg.checkpoints == []
@@ -1,7 +1,74 @@
+import pickle
 import pytest
+from decimal import Decimal
+
+from capgains.transaction import Transaction, TransactionResult
 
 
 def test_cannot_set_negative_share_balance(transactions):
     with pytest.raises(ValueError) as excinfo:
         transactions[0].share_balance = -1
     assert str(excinfo.value) == "Share balance cannot be negative"
+
+
+def test_no_extra_attributes(transactions):
+    with pytest.raises(AttributeError):
+        transactions[0].extra = 1
+
+
+def test_default_result(transactions):
+    """Testing the values of a transaction that nothing was calculated for,
+    and that changing them does not change other transactions"""
+    transaction = transactions[0]
+    assert transaction.exchange_rate is None
+    assert transaction.share_balance == 0
+    assert transaction.superficial_loss is False
+    transaction.set_superficial_loss()
+    assert transaction.superficial_loss is True
+    assert transactions[1].superficial_loss is False
+
+
+def test_set_result_values(transactions):
+    """Testing that the values set on a transaction are kept in its own
+    result"""
+    transaction = transactions[0]
+    transaction.share_balance = 10
+    transaction.proceeds = '1.5'
+    transaction.capital_gain = -2
+    transaction.acb = 3
+    transaction.superficial_loss = 1
+    assert transaction.share_balance == Decimal(10)
+    assert transaction.proceeds == Decimal('1.5')
+    assert transaction.capital_gain == Decimal(-2)
+    assert transaction.acb == Decimal(3)
+    assert transaction.superficial_loss is True
+    other = transactions[1]
+    assert (other.share_balance, other.proceeds, other.capital_gain,
+            other.acb, other.superficial_loss) == (0, 0, 0, 0, False)
+
+
+def test_expenses(transactions):
+    transaction = transactions[0]
+    transaction.exchange_rate = 2
+    assert transaction.expenses == 20
+    assert transaction.result.expenses == 20
+
+    transaction.result = TransactionResult(exchange_rate=Decimal(3))
+    assert transaction.expenses == 30
+
+
+def test_pickle(transactions):
+    transaction = transactions[0]
+    transaction.exchange_rate = 2
+    copy = pickle.loads(pickle.dumps(transaction))
+    for name in Transaction.__slots__[:-1]:
+        assert getattr(copy, name) == getattr(transaction, name)
+    assert copy.expenses == transaction.expenses
+
+
+def test_pickle_no_result(transactions):
+    transaction = transactions[0]
+    copy = pickle.loads(pickle.dumps(transaction))
+    for name in Transaction.__slots__[:-1]:
+        assert getattr(copy, name) == getattr(transaction, name)
+    assert copy.exchange_rate is None
@@ -0,0 +1,134 @@
+import pytest
+from datetime import date
+
+from capgains.transaction import Transaction
+from capgains.transactions import Transactions, TransactionsView
+
+
+def test_group_by_ticker(transactions):
+    """Testing that transactions are grouped by ticker, keeping their
+    order"""
+    groups = transactions.group_by_ticker()
+    assert sorted(groups) == ['ANET', 'GOOGL']
+    assert groups['ANET'].transactions == [transactions[0],
+                                           transactions[2],
+                                           transactions[3]]
+    assert groups['ANET'].tickers == ['ANET']
+    assert groups['GOOGL'].transactions == [transactions[1]]
+
+
+def test_group_by_ticker_empty():
+    assert Transactions([]).group_by_ticker() == {}
+
+
+def _naive_filter(transactions, tickers=None, year=None, max_year=None,
+                  action=None):
+    return [t for t in transactions
+            if (not tickers or t.ticker in tickers) and
+            (not year or t.date.year == year) and
+            (not max_year or t.date.year <= max_year) and
+            (not action or t.action == action)]
+
+
+@pytest.mark.parametrize("filters", [
+    {},
+    {'tickers': ['ANET']},
+    {'tickers': ['ANET', 'GOOGL']},
+    {'tickers': ['FB']},
+    {'year': 2018},
+    {'year': 1998},
+    {'max_year': 2018},
+    {'max_year': 2016},
+    {'action': 'SELL'},
+    {'action': 'BLAH'},
+    {'tickers': ['ANET'], 'year': 2018, 'action': 'SELL'},
+    {'tickers': ['GOOGL', 'ANET'], 'max_year': 2018, 'action': 'BUY'},
+])
+def test_filter_by_indexes(transactions, filters):
+    """Testing that filtering through the indexes matches filtering every
+    transaction"""
+    expected = _naive_filter(transactions, **filters)
+    assert transactions.filter_by(**filters).transactions == expected
+
+
+def test_filter_by_not_chronological(transactions):
+    """Testing that filtering by year still works when transactions were not
+    added in chronological order"""
+    unordered = Transactions(reversed(transactions.transactions))
+    assert unordered.filter_by(year=2018).transactions == [transactions[2],
+                                                           transactions[1]]
+    assert unordered.filter_by(max_year=2017).transactions == [
+        transactions[0]
+    ]
+
+
+def test_tickers_updated(transactions):
+    """Testing that the tickers are kept up to date as transactions are
+    added"""
+    assert transactions.tickers == ['ANET', 'GOOGL']
+    transaction = Transaction(date(2019, 3, 1), 'RSU VEST', 'AAPL', 'BUY', 1,
+                              1.00, 0.00, 'USD')
+    transactions.add_transaction(transaction)
+    assert transactions.tickers == ['AAPL', 'ANET', 'GOOGL']
+    assert transactions.filter_by(tickers=['AAPL']).transactions == [
+        transaction
+    ]
+
+
+def test_filter_by_returns_lazy_view(transactions):
+    """Testing that filtering returns a view that is only evaluated when it
+    is first used"""
+    view = transactions.filter_by(tickers=['ANET'], superficial_loss=True)
+    assert isinstance(view, TransactionsView)
+    transactions[2].set_superficial_loss()
+    assert view.transactions == [transactions[2]]
+    assert len(view) == 1
+    assert view[0] is transactions[2]
+
+
+def test_chained_filters(transactions):
+    """Testing that filtering a view combines the filters"""
+    view = transactions.filter_by(tickers=['ANET']).filter_by(
+        max_year=2018).filter_by(action='BUY')
+    assert view.transactions == [transactions[0]]
+    assert view.tickers == ['ANET']
+    assert transactions.filter_by(year=2018).filter_by(
+        year=2019).transactions == []
+
+
+def test_view_interface(transactions):
+    view = transactions.filter_by(year=2018)
+    assert list(view) == [transactions[1], transactions[2]]
+    assert view[-1] is transactions[2]
+    assert view[:1] == [transactions[1]]
+    assert view.tickers == ['ANET', 'GOOGL']
+    groups = view.group_by_ticker()
+    assert sorted(groups) == ['ANET', 'GOOGL']
+    assert groups['ANET'].transactions == [transactions[2]]
+    materialized = view.materialize()
+    assert isinstance(materialized, Transactions)
+    assert materialized.transactions == view.transactions
+    assert not transactions.filter_by(tickers=['FB'])
+
+
+def test_currency_date_ranges(transactions):
+    """Testing that the first and last date of each currency are found, in
+    a list and in a columnar ledger"""
+    transactions.add_transaction(Transaction(date(2018, 6, 1), 'BUY', 'SHOP',
+                                             'BUY', 1, 100.00, 10.00, 'CAD'))
+    expected = {'USD': [date(2017, 2, 15), date(2019, 2, 15)],
+                'CAD': [date(2018, 6, 1), date(2018, 6, 1)]}
+    columnar = Transactions(transactions, columnar=True)
+    assert transactions.currency_date_ranges == expected
+    assert columnar.currency_date_ranges == expected
+    assert transactions.filter_by(year=2018).currency_date_ranges == {
+        'USD': [date(2018, 2, 20), date(2018, 2, 20)],
+        'CAD': [date(2018, 6, 1), date(2018, 6, 1)]}
+    assert Transactions([]).currency_date_ranges == {}
+
+    unordered = Transactions([transactions[2], transactions[0],
+                              transactions[3]])
+    expected = {'USD': [date(2017, 2, 15), date(2019, 2, 15)]}
+    assert unordered.currency_date_ranges == expected
+    assert Transactions(unordered,
+                        columnar=True).currency_date_ranges == expected
@@ -2,6 +2,7 @@ from click import ClickException
 from datetime import date
 import pytest
 
+from capgains.ledger_cache import LedgerCache
 from capgains.transaction import Transaction
 from capgains.transactions_reader import TransactionsReader
 from tests.helpers import create_csv_file, transactions_to_list
@@ -26,7 +27,9 @@ def test_transactions_reader_default(testfiles_dir, transactions):
     actual_transactions = TransactionsReader.get_transactions(filepath)
     assert len(actual_transactions) == 1
     actual_transaction = actual_transactions[0]
-    assert actual_transaction.__dict__ == exp_transaction.__dict__
+    for name in Transaction.__slots__:
+        assert (getattr(actual_transaction, name) ==
+                getattr(exp_transaction, name))
 
 
 def test_transactions_reader_columns_error(testfiles_dir):
@@ -127,10 +130,10 @@ def test_transactions_qty_not_number(testfiles_dir):
                               50.00,
                               0.0,
                               'USD')
+    transactions = transactions_to_list([transaction])
     # Overwrite the qty after creating the object because otherwise the object
     # initialization will throw an error
-    transaction._qty = 'BLAH'
-    transactions = transactions_to_list([transaction])
+    transactions[0][4] = 'BLAH'
     filepath = create_csv_file(testfiles_dir,
                                "qtynotinteger.csv,",
                                transactions,
@@ -150,10 +153,10 @@ def test_transactions_price_not_number(testfiles_dir):
                               100,
                               0.0,
                               'USD')
+    transactions = transactions_to_list([transaction])
     # Overwrite the price after creating the object because otherwise the
     # object initialization will throw an error
-    transaction._price = 'BLAH'
-    transactions = transactions_to_list([transaction])
+    transactions[0][5] = 'BLAH'
     filepath = create_csv_file(testfiles_dir,
                                "pricenotfloat.csv,",
                                transactions,
@@ -173,10 +176,10 @@ def test_transactions_commission_not_number(testfiles_dir):
                               50.00,
                               0.0,
                               'USD')
+    transactions = transactions_to_list([transaction])
     # Overwrite the commission after creating the object because otherwise the
     # object initialization will throw an error
-    transaction._commission = 'BLAH'
-    transactions = transactions_to_list([transaction])
+    transactions[0][6] = 'BLAH'
     filepath = create_csv_file(testfiles_dir,
                                "commissionnotfloat.csv,",
                                transactions,
@@ -184,3 +187,227 @@ def test_transactions_commission_not_number(testfiles_dir):
     with pytest.raises(ClickException) as excinfo:
         TransactionsReader.get_transactions(filepath)
     assert excinfo.value.message == "The commission entered BLAH is not a valid number"  # noqa: E501
+
+
+def test_iter_transactions(testfiles_dir, transactions):
+    """Testing that TransactionsReader streams the transactions one at a
+    time"""
+    filepath = create_csv_file(testfiles_dir,
+                               "stream.csv",
+                               transactions_to_list(transactions),
+                               True)
+    stream = TransactionsReader.iter_transactions(filepath)
+    assert iter(stream) is stream
+    actual = [(t.date, t.ticker, t.action, t.qty) for t in stream]
+    expected = [(t.date, t.ticker, t.action, t.qty) for t in transactions]
+    assert actual == expected
+
+
+def test_iter_transactions_validates_lazily(testfiles_dir, transactions):
+    """Testing that entries are validated as they are streamed, so valid
+    entries before an invalid one are still yielded"""
+    entries = transactions_to_list(transactions)
+    entries[1].append('EXTRA_COLUMN_VALUE')
+    filepath = create_csv_file(testfiles_dir,
+                               "streaminvalid.csv",
+                               entries,
+                               True)
+    stream = TransactionsReader.iter_transactions(filepath)
+    assert next(stream).date == date(2017, 2, 15)
+    with pytest.raises(ClickException) as excinfo:
+        next(stream)
+    assert excinfo.value.message == "Transaction entry 1: expected 8 columns, entry has 9"  # noqa: E501
+
+
+def test_transactions_reader_date_formats(testfiles_dir):
+    """Testing that dates followed by a time, and dates that are not
+    zero-padded, are still read"""
+    entries = [
+        ['2018-02-15 10:00:00', 'RSU VEST', 'ANET', 'BUY', '1', '2', '0', 'USD'],  # noqa: E501
+        ['2018-2-16', 'RSU VEST', 'ANET', 'BUY', '1', '2', '0', 'USD'],
+        ['2018-02-16', 'RSU VEST', 'ANET', 'BUY', '1', '2', '0', 'USD'],
+    ]
+    filepath = create_csv_file(testfiles_dir, "dateformats.csv", entries,
+                               True)
+    actual = TransactionsReader.get_transactions(filepath)
+    assert [t.date for t in actual] == [date(2018, 2, 15),
+                                        date(2018, 2, 16),
+                                        date(2018, 2, 16)]
+
+
+def test_transactions_reader_memoized_dates(testfiles_dir, transactions,
+                                            monkeypatch):
+    """Testing that the dates are still right once the memoized ones are
+    forgotten"""
+    monkeypatch.setattr(TransactionsReader, 'max_memoized_dates', 1)
+    filepath = create_csv_file(testfiles_dir, "memoizeddates.csv",
+                               transactions_to_list(transactions))
+    assert ([t.date for t in TransactionsReader.get_transactions(filepath)] ==
+            [t.date for t in transactions])
+
+
+def test_transactions_reader_shares_strings(testfiles_dir, transactions):
+    """Testing that repeated column values are shared between
+    transactions"""
+    filepath = create_csv_file(testfiles_dir,
+                               "shared.csv",
+                               transactions_to_list(transactions),
+                               True)
+    first, second, third = TransactionsReader.get_transactions(filepath)[:3]
+    assert first.ticker is third.ticker
+    assert first.currency is second.currency is third.currency
+
+
+def _values(transactions):
+    return [(t.date, t.description, t.ticker, t.action, t.qty, t.price,
+             t.commission, t.currency) for t in transactions]
+
+
+@pytest.mark.parametrize("columnar", [False, True])
+def test_merged_transactions(testfiles_dir, transactions, tmp_path,
+                             columnar):
+    """Testing that the entries of several files are merged by date, with
+    the entries on the same date kept in the order of their files"""
+    rows = transactions_to_list(transactions)
+    first = create_csv_file(testfiles_dir, "first.csv", [rows[0], rows[2]])
+    second = create_csv_file(testfiles_dir, "second.csv", rows[1:2] + rows[3:])
+    expected = [transactions[0], transactions[2], transactions[1],
+                transactions[3]]
+    assert (_values(TransactionsReader.iter_merged_transactions(
+        [first, second])) == _values(expected))
+    assert (_values(TransactionsReader.get_merged_transactions(
+        [first, second], columnar=columnar)) == _values(expected))
+    cache = LedgerCache(str(tmp_path))
+    for _ in range(2):
+        merged = TransactionsReader.get_merged_transactions(
+            [first, second], columnar=columnar, ledger_cache=cache)
+        assert merged.columnar == columnar
+        assert _values(merged) == _values(expected)
+    assert (_values(TransactionsReader.iter_merged_transactions(
+        [second, first])) == _values(transactions))
+
+
+def test_find_csv_files(testfiles_dir, transactions):
+    """Testing that a directory stands for the CSV-files in it, in order of
+    their names"""
+    rows = transactions_to_list(transactions)
+    broker = testfiles_dir.mkdir("mergebroker")
+    create_csv_file(broker, "b.csv", rows[1:2])
+    create_csv_file(broker, "a.CSV", rows[:1])
+    create_csv_file(broker, "notes.txt", [["not a transaction"]])
+    other = create_csv_file(testfiles_dir, "other.csv", rows[2:])
+    csv_files = TransactionsReader.find_csv_files([str(broker), other])
+    assert csv_files == [str(broker.join("a.CSV")), str(broker.join("b.csv")),
+                         other]
+    assert (_values(TransactionsReader.iter_merged_transactions(csv_files)) ==
+            _values(transactions))
+
+    empty = testfiles_dir.mkdir("emptybroker")
+    with pytest.raises(ClickException) as excinfo:
+        TransactionsReader.find_csv_files([str(empty)])
+    assert excinfo.value.message == "No CSV-files found in {}".format(empty)
+    with pytest.raises(ClickException) as excinfo:
+        TransactionsReader.find_csv_files([str(broker.join("dne.csv"))])
+    assert excinfo.value.message == "File not found: {}".format(
+        broker.join("dne.csv"))
+
+
+@pytest.mark.parametrize("cached", [False, True])
+def test_merged_transactions_error(testfiles_dir, transactions, tmp_path,
+                                   cached):
+    """Testing that errors in merged files name the file"""
+    rows = transactions_to_list(transactions)
+    good = create_csv_file(testfiles_dir, "good.csv", rows)
+    rows[1][4] = 'BLAH'
+    bad = create_csv_file(testfiles_dir, "bad.csv", rows)
+    with pytest.raises(ClickException) as excinfo:
+        TransactionsReader.get_merged_transactions(
+            [good, bad], ledger_cache=LedgerCache(str(tmp_path)) if cached
+            else None)
+    assert excinfo.value.message == "{}: The quantity entered BLAH is not a valid number".format(bad)  # noqa: E501
+
+
+def _unordered_transactions():
+    return [
+        Transaction(date(2018, 3, 1), 'c', 'ANET', 'SELL', 1, 10, 0, 'USD'),
+        Transaction(date(2018, 1, 1), 'a', 'ANET', 'BUY', 1, 10, 0, 'USD'),
+        Transaction(date(2018, 3, 1), 'd', 'ANET', 'BUY', 1, 10, 0, 'USD'),
+        Transaction(date(2018, 2, 1), 'b', 'GOOGL', 'BUY', 1, 10, 0, 'USD'),
+        Transaction(date(2018, 3, 1), 'e', 'ANET', 'SELL', 1, 10, 0, 'USD'),
+        Transaction(date(2017, 1, 1), 'z', 'GOOGL', 'BUY', 1, 10, 0, 'USD'),
+    ]
+
+
+@pytest.mark.parametrize("run_length", [1, 2, 4, 100])
+def test_sorted_transactions(testfiles_dir, run_length, monkeypatch):
+    """Testing that the entries are sorted by date with the entries on the
+    same date kept in their order, whether they fit in memory or not"""
+    transactions = _unordered_transactions()
+    filepath = create_csv_file(testfiles_dir, "unordered.csv",
+                               transactions_to_list(transactions))
+    runs = []
+    write_run = TransactionsReader._write_run.__func__
+
+    def record_run(cls, run_dir, run_no, run):
+        runs.append(len(run))
+        return write_run(cls, run_dir, run_no, run)
+    monkeypatch.setattr(TransactionsReader, '_write_run',
+                        classmethod(record_run))
+    memory = run_length * TransactionsReader.transaction_size
+    sorted_transactions = list(TransactionsReader.iter_sorted_transactions(
+        [filepath], memory))
+    assert ([t.description for t in sorted_transactions] ==
+            ['z', 'a', 'b', 'c', 'd', 'e'])
+    assert (_values(sorted_transactions) ==
+            _values(sorted(transactions, key=lambda t: t.date)))
+    assert sum(runs) == (len(transactions) if run_length < len(transactions)
+                         else 0)
+
+    collection = TransactionsReader.get_sorted_transactions(
+        [filepath], columnar=True, memory=memory)
+    assert collection.columnar
+    assert _values(collection) == _values(sorted_transactions)
+
+
+@pytest.mark.parametrize("max_merge_runs", [2, 3, 5])
+def test_sorted_transactions_merge_passes(testfiles_dir, max_merge_runs,
+                                          monkeypatch):
+    """Testing that no more than max_merge_runs runs are merged at once when
+    there are more runs than that, and that the sort stays stable"""
+    transactions = _unordered_transactions()
+    filepath = create_csv_file(testfiles_dir, "unorderedpasses.csv",
+                               transactions_to_list(transactions))
+    merges = []
+    merge_runs = TransactionsReader._merge_runs.__func__
+
+    def record_merge(cls, run_files):
+        merges.append(len(run_files))
+        return merge_runs(cls, run_files)
+    monkeypatch.setattr(TransactionsReader, '_merge_runs',
+                        classmethod(record_merge))
+    monkeypatch.setattr(TransactionsReader, 'max_merge_runs', max_merge_runs)
+    sorted_transactions = list(TransactionsReader.iter_sorted_transactions(
+        [filepath], TransactionsReader.transaction_size))
+    assert ([t.description for t in sorted_transactions] ==
+            ['z', 'a', 'b', 'c', 'd', 'e'])
+    assert len(merges) > 1
+    assert max(merges) <= max_merge_runs
+
+
+def test_sorted_transactions_several_files(testfiles_dir):
+    """Testing that the entries of several files on the same date are kept
+    in the order of their files"""
+    transactions = _unordered_transactions()
+    rows = transactions_to_list(transactions)
+    first = create_csv_file(testfiles_dir, "unordered1.csv", rows[3:])
+    second = create_csv_file(testfiles_dir, "unordered2.csv", rows[:3])
+    sorted_transactions = TransactionsReader.iter_sorted_transactions(
+        [first, second], 2 * TransactionsReader.transaction_size)
+    assert ([t.description for t in sorted_transactions] ==
+            ['z', 'a', 'b', 'e', 'c', 'd'])
+
+    rows[4][4] = 'BLAH'
+    create_csv_file(testfiles_dir, "unordered1.csv", rows[3:])
+    with pytest.raises(ClickException) as excinfo:
+        list(TransactionsReader.iter_sorted_transactions([first, second]))
+    assert excinfo.value.message == "{}: The quantity entered BLAH is not a valid number".format(first)  # noqa: E501
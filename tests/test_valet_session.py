@@ -0,0 +1,99 @@
+import pytest
+import requests
+from datetime import date
+from click import ClickException
+
+from capgains.exchange_rate import ExchangeRate
+from capgains.valet_session import ValetSession
+
+url = ExchangeRate.valet_obs_url + '/FXUSDCAD/json'
+
+
+@pytest.fixture(scope='function')
+def sleeps(monkeypatch):
+    """Record the backoffs instead of sleeping through them"""
+    sleeps = []
+    monkeypatch.setattr('capgains.valet_session.time.sleep', sleeps.append)
+    return sleeps
+
+
+def test_session_ok(requests_mock):
+    requests_mock.get(url, json={"observations": []})
+    session = ValetSession(connect_timeout=1, read_timeout=2)
+    response = session.get(url, params={"start_date": "2020-05-22"})
+    assert response.json() == {"observations": []}
+    assert requests_mock.last_request.timeout == (1, 2)
+    assert requests_mock.last_request.qs == {"start_date": ["2020-05-22"]}
+    assert session.request_count == 1
+    assert session.retry_count == 0
+    assert session.total_latency >= session.max_latency >= 0
+    session.close()
+
+
+def test_session_retries_server_errors(requests_mock, sleeps):
+    """Testing that 5xx responses are retried with an exponential backoff"""
+    requests_mock.get(url, [{'status_code': 503},
+                            {'status_code': 500},
+                            {'json': {"observations": []}}])
+    session = ValetSession(backoff_factor=1)
+    response = session.get(url)
+    assert response.status_code == 200
+    assert session.request_count == 3
+    assert session.retry_count == 2
+    assert len(sleeps) == 2
+    assert 0 <= sleeps[0] <= 1
+    assert 0 <= sleeps[1] <= 2
+
+
+def test_session_retry_after(requests_mock, sleeps):
+    """Testing that the Retry-After header of a 429 response is honoured"""
+    requests_mock.get(url, [{'status_code': 429,
+                             'headers': {'Retry-After': '3'}},
+                            {'json': {"observations": []}}])
+    session = ValetSession()
+    assert session.get(url).status_code == 200
+    assert sleeps == [3]
+
+
+def test_session_retries_exhausted(requests_mock, sleeps):
+    requests_mock.get(url, status_code=502)
+    session = ValetSession(max_retries=2)
+    with pytest.raises(requests.HTTPError):
+        session.get(url)
+    assert session.request_count == 3
+    assert len(sleeps) == 2
+
+
+def test_session_client_errors_not_retried(requests_mock, sleeps):
+    requests_mock.get(url, status_code=404)
+    session = ValetSession()
+    with pytest.raises(requests.HTTPError):
+        session.get(url)
+    assert session.request_count == 1
+    assert sleeps == []
+
+
+def test_session_connection_error_counted(requests_mock):
+    requests_mock.get(url, exc=requests.ConnectionError)
+    session = ValetSession()
+    with pytest.raises(requests.ConnectionError):
+        session.get(url)
+    assert session.request_count == 1
+
+
+def test_exchange_rate_server_error(requests_mock, sleeps):
+    """Testing that a server error that outlasts the retries is reported"""
+    requests_mock.get(url, status_code=500)
+    day = date(2020, 5, 22)
+    session = ValetSession(max_retries=1)
+    with pytest.raises(ClickException) as excinfo:
+        ExchangeRate("USD", day, day, session=session)
+    assert excinfo.value.message.startswith(
+        "HTTP request for URL {} was unsuccessful : 500 Server Error".format(
+            url))
+    assert session.request_count == 2
+
+
+def test_exchange_rate_default_session_shared():
+    assert (ExchangeRate.get_default_session() is
+            ExchangeRate.get_default_session())